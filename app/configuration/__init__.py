@@ -1,7 +1,11 @@
+import os
+import threading
+from time import sleep
 from typing import Optional
 
 from app.configuration.serializer import deserialize, serialize
 from app.server import Server
+from app.server.Logger import logger
 
 
 def load_server(path_to_file: str) -> Optional[Server]:
@@ -15,6 +19,43 @@ def load_server(path_to_file: str) -> Optional[Server]:
     return server
 
 
+def reload_server(path_to_file: str, server: Server) -> bool:
+    # Only the balancer is reloaded, the other settings of the server need a restart
+    try:
+        new_server = load_server(path_to_file)
+    except Exception as err:
+        logger.error(server, "Configuration not reloaded: {}", err)
+        return False
+    if new_server.balancer is None or len(new_server.balancer.links) == 0:
+        logger.error(server, "Configuration not reloaded: no link in '{}'.", path_to_file)
+        return False
+    return server.reload_balancer(new_server.balancer)
+
+
+def watch_server(path_to_file: str, server: Server, interval: float) -> threading.Thread:
+    def watch():
+        last_modification = previous_modification = _get_modification_time(path_to_file)
+        while not server.STOP:
+            sleep(interval)
+            modification = _get_modification_time(path_to_file)
+            # A file still being written is reloaded once its modification time is the same for two polls
+            if modification is not None and modification == previous_modification != last_modification:
+                last_modification = modification
+                reload_server(path_to_file, server)
+            previous_modification = modification
+
+    watch_thread = threading.Thread(target=watch, name="ConfigurationWatcher", daemon=True)
+    watch_thread.start()
+    return watch_thread
+
+
+def _get_modification_time(path_to_file: str) -> Optional[float]:
+    try:
+        return os.stat(path_to_file).st_mtime
+    except OSError:
+        return None
+
+
 def save_server(path_to_file: str, server: Server):
     try:
         json = serialize(server)
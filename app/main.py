@@ -1,19 +1,24 @@
 import optparse
 import signal
+import threading
 
 from app.server.Logger import logger
-from app.configuration import load_server
+from app.configuration import load_server, reload_server, watch_server
 
 
 def signal_handler(sig, frame):
     server.stop()
 
 
-signal.signal(signal.SIGINT, signal_handler)
+def reload_handler(sig, frame):
+    # The new configuration is loaded out of the signal handler
+    threading.Thread(target=reload_server, args=(options.input, server)).start()
+
 
 parser = optparse.OptionParser()
 parser.add_option('-i', '--input', action="store", dest="input", default="basic.json")
 parser.add_option('-l', '--log', action="store", dest="log", default=None)
+parser.add_option('-w', '--watch', action="store", dest="watch", type="int", default=0)
 
 if __name__ == '__main__':
     options, args = parser.parse_args()
@@ -24,5 +29,11 @@ if __name__ == '__main__':
         logger.set_output(options.log)
 
     server = load_server(options.input)
+    # The handlers use the server and the options, they are registered once both exist
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGHUP, reload_handler)
 
     server.start()
+
+    if options.watch > 0:
+        watch_server(options.input, server, options.watch)
@@ -0,0 +1,88 @@
+import json
+from enum import Enum
+from time import monotonic, time
+
+from app.server.BatchWriter import BatchWriter
+from app.server.Logger import logger
+
+
+class CloseReason(str, Enum):
+    EOF = "eof"
+    IDLE = "idle"
+    ERROR = "error"
+    STOPPED = "stopped"
+    REJECTED = "rejected"
+    CONNECT_ERROR = "connect_error"
+    LIFETIME = "lifetime"
+
+
+class TunnelStats:
+    __slots__ = ("client", "client_ip", "link", "request", "started", "start_time", "handshake_time", "connect_time",
+                 "bytes_in", "bytes_out", "duration", "close_reason", "last_activity")
+
+    def __init__(self, client="", client_ip=""):
+        self.client = client
+        self.client_ip = client_ip
+        self.link = None
+        self.request = None
+        self.started = time()
+        self.start_time = monotonic()
+        self.handshake_time = None
+        self.connect_time = None
+        # From the client to the upstream and from the upstream to the client
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.duration = None
+        self.close_reason = None
+        # Time of the last data relayed, checked against the idle timeout
+        self.last_activity = self.start_time
+
+    def set_handshake_done(self):
+        self.handshake_time = monotonic() - self.start_time
+
+    def close(self, close_reason: CloseReason):
+        if self.close_reason is None:
+            self.close_reason = close_reason
+
+    def to_record(self) -> dict:
+        return {
+            "time": round(self.started, 3),
+            "client": self.client,
+            "link": str(self.link) if self.link is not None else None,
+            "request": str(self.request),
+            "handshake": _round(self.handshake_time),
+            "connect": _round(self.connect_time),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "duration": _round(self.duration),
+            "close_reason": self.close_reason.value if self.close_reason is not None else None
+        }
+
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+
+class AccessLog(BatchWriter):
+    # One JSON object per line and per tunnel, serialized and written in batches by a background thread
+    def __str__(self):
+        return "AccessLog"
+
+    def is_enabled(self) -> bool:
+        return self.file is not None
+
+    def record(self, stats: TunnelStats):
+        if self.file is None or stats.request is None:
+            return
+        if stats.duration is None:
+            stats.duration = monotonic() - stats.start_time
+        self._put(stats)
+
+    def _write_batch(self, batch: list):
+        dropped = self._pop_dropped()
+        if dropped:
+            logger.warning(self, "{} records dropped, the access log output is too slow.", dropped)
+        self._write_lines([json.dumps(stats.to_record(), separators=(",", ":")) for stats in batch])
+
+
+access_log = AccessLog()
@@ -0,0 +1,310 @@
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, List, Optional, Union
+
+import socks
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.HttpProxy import HttpError, HttpParser, HttpStatus, build_response
+from app.server.Link import Link
+from app.server.Logger import logger
+from app.server.Metrics import metrics
+from app.server.RateLimit import TokenBucket
+from app.server.Relay import RELAY_BUFFER_SIZE
+from app.server.Request import Request
+from app.server.UdpRelay import get_bind_address
+from app.server.Socks import SocksCommand, SocksError, SocksMethod, SocksParser, SocksReply, \
+    build_chosen_method_packet, build_reply_packet
+
+
+class AsyncEngine:
+    def __init__(self, server):
+        self._server = server
+        self._executor = None
+
+    def __str__(self):
+        return "AsyncEngine:{}:{}".format(self._server.domain, self._server.port)
+
+    def run(self, server_sockets: List[socket.socket]):
+        # The first socket is the SOCKS5 listener, the second one the optional HTTP proxy listener
+        logger.info(self, "Ready to receive requests.")
+        # Only the upstream connect (proxy negotiation included) is blocking, it runs in this pool
+        self._executor = ThreadPoolExecutor(max_workers=self._server.max_threads)
+        try:
+            asyncio.run(self._serve(server_sockets))
+        except Exception as err:
+            logger.error(self, "Event loop stopped, error: \"{}\".", err)
+        finally:
+            self._executor.shutdown(wait=False)
+            for server_socket in server_sockets:
+                server_socket.close()
+        logger.info(self, "Stopping server.")
+
+    async def _serve(self, server_sockets: List[socket.socket]):
+        async_servers = []
+        for server_socket, handler in zip(server_sockets, [self._handle_client, self._handle_http_client]):
+            server_socket.setblocking(False)
+            async_servers.append(await asyncio.start_server(handler, sock=server_socket))
+        try:
+            while not self._server.STOP:
+                await asyncio.sleep(self._server.timeout)
+        finally:
+            for async_server in async_servers:
+                async_server.close()
+                await async_server.wait_closed()
+
+    async def _handle_client(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        await self._serve_client(client_reader, client_writer, SocksParser(), self._socks_handshake)
+
+    async def _handle_http_client(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        await self._serve_client(client_reader, client_writer, HttpParser(), self._http_request)
+
+    async def _serve_client(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter,
+                            parser: Union[SocksParser, HttpParser], handshake: Callable):
+        peer_name = client_writer.get_extra_info("peername")
+        client_ip = peer_name[0] if peer_name else ""
+        if not self._server.accept_client(client_ip):
+            client_writer.close()
+            await self._wait_closed(client_writer)
+            return
+        stats = TunnelStats("{}:{}".format(*peer_name[:2]) if peer_name else "", client_ip)
+        metrics.open_tunnel()
+        try:
+            request = await handshake(client_reader, client_writer, parser, stats)
+            if request is None:
+                return
+            link, connection_id, socket_link = request
+            try:
+                socket_link.setblocking(False)
+                link_reader, link_writer = await asyncio.open_connection(sock=socket_link)
+            except OSError as err:
+                logger.error(self, "Cannot attach link socket to the event loop: \"{}\".", err)
+                stats.close(CloseReason.ERROR)
+                link.close_connection(connection_id)
+                return
+            # The idle and lifetime limits are checked by the timer wheel of the server, from its own thread
+            loop = asyncio.get_running_loop()
+            watch = self._server.tunnel_timeouts.watch(
+                stats, lambda: loop.call_soon_threadsafe(self._abort, client_writer, link_writer))
+            try:
+                # The client may send its first data with the request, without waiting for the reply
+                pending = parser.pop_pending()
+                if pending:
+                    link_writer.write(pending)
+                    stats.bytes_in += len(pending)
+                    metrics.relay_bytes["in"].inc(len(pending))
+                await self._exchange_with_client(client_reader, client_writer, link_reader, link_writer, stats,
+                                                 link.get_bandwidth_bucket())
+            finally:
+                self._server.tunnel_timeouts.unwatch(watch)
+                link_writer.close()
+                await self._wait_closed(link_writer)
+                link.close_connection(connection_id)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            logger.error(self, "Client closed or timed out during the handshake.")
+        except OSError as err:
+            stats.close(CloseReason.ERROR)
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
+        finally:
+            client_writer.close()
+            await self._wait_closed(client_writer)
+            self._server.finish_tunnel(stats)
+
+    async def _receive(self, reader: asyncio.StreamReader, parser: Union[SocksParser, HttpParser],
+                       parse: Callable[[], bool]):
+        # Each phase of the handshake has its own deadline, however the message is split
+        deadline = monotonic() + self._server.handshake_timeout
+        while not parse():
+            data = await asyncio.wait_for(reader.read(len(parser.get_free_buffer())), deadline - monotonic())
+            if not data:
+                raise asyncio.IncompleteReadError(b'', None)
+            parser.feed(data)
+
+    async def _send(self, writer: asyncio.StreamWriter, packet: bytes) -> bool:
+        try:
+            writer.write(packet)
+            await writer.drain()
+        except OSError as err:
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
+            return False
+        return True
+
+    async def _socks_handshake(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, parser: SocksParser,
+                               stats: TunnelStats) -> (Optional[Link], Optional[str], Optional[socks.socksocket]):
+        if not await self._socks_sub_negotiation(reader, writer, parser):
+            return None
+        return await self._socks_request(reader, writer, parser, stats)
+
+    async def _socks_sub_negotiation(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                     parser: SocksParser) -> bool:
+        method = SocksMethod.NO_ACCEPTABLE_METHODS
+        try:
+            await self._receive(reader, parser, parser.parse_greeting)
+        except SocksError as err:
+            logger.error(self, "Invalid SOCKS greeting: \"{}\".", err)
+        else:
+            if ord(SocksMethod.NO_AUTH.value) in parser.methods:
+                method = SocksMethod.NO_AUTH
+
+        await self._send(writer, build_chosen_method_packet(method))
+        return method != SocksMethod.NO_ACCEPTABLE_METHODS
+
+    async def _socks_request_get_dest(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                                      parser: SocksParser) -> (Optional[str], Optional[int]):
+        try:
+            await self._receive(reader, parser, parser.parse_request)
+        except SocksError as err:
+            logger.error(self, "Invalid SOCKS request: \"{}\".", err)
+            await self._send(writer, build_reply_packet(err.reply))
+            return None, None
+
+        if parser.command not in (SocksCommand.CONNECT, SocksCommand.UDP_ASSOCIATE):
+            logger.error(self, "SOCKS command '{}' not supported.", parser.command.name)
+            await self._send(writer, build_reply_packet(SocksReply.COMMAND_NOT_SUPPORTED))
+            return None, None
+
+        return parser.domain, parser.port
+
+    async def _socks_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, parser: SocksParser,
+                             stats: TunnelStats) -> (Optional[Link], Optional[str], Optional[socks.socksocket]):
+        domain, port = await self._socks_request_get_dest(reader, writer, parser)
+        if domain is None:
+            return None
+        request = Request(domain, port, stats.client_ip)
+        stats.request = request
+        stats.set_handshake_done()
+        if parser.command == SocksCommand.UDP_ASSOCIATE:
+            await self._socks_udp_associate(reader, writer, request, stats)
+            return None
+        connection = await asyncio.get_running_loop().run_in_executor(self._executor, self._server.connector.connect,
+                                                                      request, stats)
+        if connection is None:
+            if stats.close_reason == CloseReason.REJECTED:
+                logger.error(self, "No Link available to handle the request.")
+                await self._send(writer, build_reply_packet(SocksReply.CONNECTION_NOT_ALOWED))
+            else:
+                await self._send(writer, build_reply_packet(SocksReply.NETWORK_UNREACHABLE))
+            return None
+        link, connection_id, socket_link = connection
+
+        if not await self._send(writer, build_reply_packet(SocksReply.SUCCEEDED)):
+            stats.close(CloseReason.ERROR)
+            link.close_connection(connection_id)
+            return None
+
+        return link, connection_id, socket_link
+
+    async def _http_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, parser: HttpParser,
+                            stats: TunnelStats) -> (Optional[Link], Optional[str], Optional[socks.socksocket]):
+        try:
+            await self._receive(reader, parser, parser.parse_request)
+        except HttpError as err:
+            logger.error(self, "Invalid HTTP proxy request: \"{}\".", err)
+            await self._send(writer, build_response(err.status))
+            return None
+
+        request = Request(parser.domain, parser.port, stats.client_ip)
+        stats.request = request
+        stats.set_handshake_done()
+        connection = await asyncio.get_running_loop().run_in_executor(self._executor, self._server.connector.connect,
+                                                                      request, stats)
+        if connection is None:
+            if stats.close_reason == CloseReason.REJECTED:
+                logger.error(self, "No Link available to handle the request.")
+                await self._send(writer, build_response(HttpStatus.FORBIDDEN))
+            else:
+                await self._send(writer, build_response(HttpStatus.BAD_GATEWAY))
+            return None
+        link, connection_id, socket_link = connection
+
+        # A forward request is answered by the target itself
+        if parser.is_connect() and not await self._send(writer, build_response(HttpStatus.CONNECTION_ESTABLISHED)):
+            stats.close(CloseReason.ERROR)
+            link.close_connection(connection_id)
+            return None
+
+        return link, connection_id, socket_link
+
+    async def _socks_udp_associate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request: Request,
+                                   stats: TunnelStats):
+        # The port given by the client is only trusted when it also gives its own address
+        client_port = request.port if request.domain == stats.client_ip else 0
+        try:
+            association = self._server.udp_relay.open(
+                get_bind_address(writer.get_extra_info("sockname"), self._server.domain), stats.client_ip,
+                client_port, stats)
+        except OSError as err:
+            logger.error(self, "Cannot open a UDP relay: \"{}\".", err)
+            stats.close(CloseReason.ERROR)
+            await self._send(writer, build_reply_packet(SocksReply.SERVER_FAILURE))
+            return
+
+        try:
+            if await self._send(writer, build_reply_packet(SocksReply.SUCCEEDED, association.get_address())):
+                # The association lasts as long as the TCP connection of the client
+                while await reader.read(RELAY_BUFFER_SIZE):
+                    pass
+        finally:
+            self._server.udp_relay.close(association, CloseReason.STOPPED if self._server.STOP else CloseReason.EOF)
+
+    async def _exchange_with_client(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter,
+                                    link_reader: asyncio.StreamReader, link_writer: asyncio.StreamWriter,
+                                    stats: TunnelStats, throttle: Optional[TokenBucket] = None):
+        # The idle and lifetime limits abort the transports, which ends both pipes
+        # Bytes relayed in each direction
+        progress = [0, 0]
+        pipes = [
+            asyncio.ensure_future(self._pipe(client_reader, link_writer, progress, 0, throttle, stats)),
+            asyncio.ensure_future(self._pipe(link_reader, client_writer, progress, 1, throttle, stats))
+        ]
+        try:
+            pending = pipes
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if any(pipe.exception() is not None for pipe in done):
+                    stats.close(CloseReason.ERROR)
+                    break
+            stats.close(CloseReason.EOF)
+        finally:
+            stats.bytes_in += progress[0]
+            stats.bytes_out += progress[1]
+            for pipe in pipes:
+                pipe.cancel()
+            for result in await asyncio.gather(*pipes, return_exceptions=True):
+                if isinstance(result, OSError):
+                    logger.error(self, "Socket error while trying to communicate with client: \"{}\".", result)
+
+    @staticmethod
+    async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, progress: list, direction: int,
+                    throttle: Optional[TokenBucket] = None, stats: Optional[TunnelStats] = None):
+        relayed = metrics.relay_bytes["in" if direction == 0 else "out"]
+        while True:
+            data = await reader.read(RELAY_BUFFER_SIZE)
+            if not data:
+                # Half-close: forward the EOF and let the other direction carry on
+                if writer.can_write_eof():
+                    writer.write_eof()
+                return
+            progress[direction] += len(data)
+            relayed.inc(len(data))
+            delay = throttle.consume(len(data)) if throttle is not None else 0
+            if delay > 0:
+                await asyncio.sleep(delay)
+            writer.write(data)
+            await writer.drain()
+            if stats is not None:
+                stats.last_activity = monotonic()
+
+    @staticmethod
+    def _abort(*writers: asyncio.StreamWriter):
+        for writer in writers:
+            writer.transport.abort()
+
+    @staticmethod
+    async def _wait_closed(writer: asyncio.StreamWriter):
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
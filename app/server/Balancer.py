@@ -1,30 +1,69 @@
-from typing import Optional, List
+from time import monotonic, perf_counter
+from typing import Iterator, Optional, List, Sequence
 
+from app.server.HealthChecker import HealthChecker
 from app.server.Link import Link, PriorityLevel
 from app.server.Logger import logger
+from app.server.Metrics import metrics
 from app.server.Request import Request
-from app.server.RequestMatcher import RequestMatcher, Policy
-from app.server.balancing_strategy import Strategy, get_next_link
+from app.server.RequestMatcher import RequestMatcher
+from app.server.RoutingCache import RoutingCache
+from app.server.RoutingIndex import RoutingIndex
+from app.server.SharedState import SharedLinkState
+from app.server.balancing_strategy import Affinity, Strategy, build_strategy, get_affinity_key
+from app.server.balancing_strategy.rendezvous import Rendezvous
 
 
 class Balancer:
     OBJECT_SERIALIZATION_DATA = [
         ("strategy", "strategy", Strategy, False),
         ("links", "links", Link, True),
-        ("matchers", "_request_matchers", RequestMatcher, False)
+        ("matchers", "_request_matchers", RequestMatcher, False),
+        ("cache_size", "cache_size", int, False),
+        ("health_check_workers", "health_check_workers", int, False),
+        ("connect_attempts", "connect_attempts", int, False),
+        ("connect_deadline", "connect_deadline", int, False),
+        ("hedge_delay", "hedge_delay", int, False),
+        ("affinity", "affinity", Affinity, False)
     ]
 
-    def __init__(self, strategy=Strategy.ROUND_ROBIN):
+    def __init__(self, strategy=Strategy.ROUND_ROBIN, cache_size=4096, health_check_workers=8, connect_attempts=3,
+                 connect_deadline=0, hedge_delay=0, affinity=Affinity.NONE):
         self.strategy = strategy
+        self.affinity = affinity
         self.links = []
+        self.cache_size = cache_size
+        self.health_check_workers = health_check_workers
+        self.connect_attempts = connect_attempts
+        self.connect_deadline = connect_deadline
+        self.hedge_delay = hedge_delay
+        self._health_checker = None
+        # Set once another balancer took over this one, the checks of this one then belong to the new one
+        self._closed = False
         self._request_matchers = []
-        self._last_link = None
+        self._routing_index = None
+        self._strategies = {}
+        self._affinity_strategies = {}
+        self._routing_cache = RoutingCache(cache_size)
+        self._shared_state = None
+        self._shared_status_version = 0
+        self._circuit_check_time = None
 
     def __str__(self):
         return "Balancer:{},{}".format(self.strategy, self.links.__len__())
 
+    def serializer_update_object(self):
+        self._routing_cache.size = self.cache_size
+        for link in self.links:
+            link.add_routing_listener(self._on_link_routing_change)
+            link.add_connections_listener(self._update_strategies)
+        self._invalidate_routing_index()
+
     def add_link(self, link: Link):
         self.links.append(link)
+        link.add_routing_listener(self._on_link_routing_change)
+        link.add_connections_listener(self._update_strategies)
+        self._invalidate_routing_index()
         return self
 
     def add_links(self, links: list):
@@ -32,12 +71,65 @@ class Balancer:
             self.add_link(link)
         return self
 
+    def set_cache_size(self, cache_size: int):
+        self.cache_size = cache_size
+        self._routing_cache.size = cache_size
+        self._routing_cache.clear()
+        return self
+
+    def attach_shared_state(self, shared_state: SharedLinkState):
+        self._shared_state = shared_state
+        for link_idx, link in enumerate(self.links):
+            link.attach_shared_state(shared_state, link_idx)
+        self._strategies = {}
+        return self
+
+    def take_over(self, balancer: "Balancer") -> Optional[List[Link]]:
+        # The links of the running balancer with the same upstream as a new link are kept, so their connections and
+        # health state carry over, and get the new configuration. Returns the links of the running balancer left out.
+        if balancer._shared_state is not None and [link.get_upstream_key() for link in balancer.links] != [
+                link.get_upstream_key() for link in self.links]:
+            # The shared memory of the processes is indexed by link
+            logger.error(self, "With several processes, the links can not be added, removed or reordered.")
+            return None
+
+        old_links = list(balancer.links)
+        links = []
+        for link in self.links:
+            link.remove_routing_listener(self._on_link_routing_change)
+            link.remove_connections_listener(self._update_strategies)
+            old_link = next((old_link for old_link in old_links if
+                             old_link.get_upstream_key() == link.get_upstream_key()), None)
+            if old_link is not None:
+                old_links.remove(old_link)
+                link = old_link.update_configuration(link)
+            link.add_routing_listener(self._on_link_routing_change)
+            link.add_connections_listener(self._update_strategies)
+            links.append(link)
+        self.links = links
+        self._shared_state = balancer._shared_state
+        self._shared_status_version = balancer._shared_status_version
+        # The checks go on with the same schedule
+        self._health_checker, balancer._health_checker = balancer._health_checker, None
+        balancer._closed = True
+        self._strategies = {}
+        self._invalidate_routing_index()
+        return old_links
+
+    def detach_links(self):
+        for link in self.links:
+            link.remove_routing_listener(self._on_link_routing_change)
+            link.remove_connections_listener(self._update_strategies)
+        return self
+
     def set_strategy(self, strategy: Strategy):
         self.strategy = strategy
+        self._strategies = {}
         return self
 
     def add_request_matcher(self, request_matcher: RequestMatcher):
         self._request_matchers.append(request_matcher)
+        self._invalidate_routing_index()
         return self
 
     def add_request_matchers(self, request_matchers: List[RequestMatcher]):
@@ -45,53 +137,166 @@ class Balancer:
             self.add_request_matcher(request_matcher)
         return self
 
+    def set_affinity(self, affinity: Affinity):
+        self.affinity = affinity
+        return self
+
+    def _on_link_routing_change(self, is_index_changed: bool):
+        if is_index_changed:
+            self._invalidate_routing_index()
+        else:
+            self._invalidate_routing()
+
+    def _invalidate_routing_index(self):
+        # Only the matchers and the list of links are compiled in the index
+        self._routing_index = None
+        self._invalidate_routing()
+
+    def _invalidate_routing(self):
+        self._strategies = {}
+        self._affinity_strategies = {}
+        self._routing_cache.clear()
+        # The cached routing ignores the open links, it is rebuilt when the first of them becomes half-open
+        half_open_times = [link.circuit_breaker.get_half_open_time() for link in self.links]
+        self._circuit_check_time = min([time for time in half_open_times if time is not None], default=None)
+
+    def _update_strategies(self, link: Link):
+        for strategy in list(self._strategies.values()):
+            strategy.update(link)
+
+    def _get_routing_index(self) -> RoutingIndex:
+        routing_index = self._routing_index
+        if routing_index is None:
+            routing_index = RoutingIndex(self._request_matchers, self.links)
+            self._routing_index = routing_index
+        return routing_index
+
+    def _get_routing(self, request: Request) -> (bool, tuple, tuple, tuple):
+        circuit_check_time = self._circuit_check_time
+        if circuit_check_time is not None and monotonic() >= circuit_check_time:
+            self._circuit_check_time = None
+            for link in self.links:
+                link.update_circuit_breaker()
+        if self._shared_state is not None:
+            # Another process may have changed the status of a link
+            shared_status_version = self._shared_state.get_status_version()
+            if shared_status_version != self._shared_status_version:
+                self._shared_status_version = shared_status_version
+                self._routing_cache.clear()
+
+        key = (request.domain, request.port)
+        generation = self._routing_cache.get_generation()
+        routing = self._routing_cache.get(key)
+        if routing is None:
+            routing_index = self._get_routing_index()
+            matching = routing_index.match(request)
+            is_accepted = routing_index.should_accept_request(request, matching)
+            high_priority, normal_priority, low_priority = [], [], []
+            if is_accepted:
+                high_priority, normal_priority, low_priority = routing_index.get_link_ids_for_request(request,
+                                                                                                    matching)
+            routing = (is_accepted, tuple(high_priority), tuple(normal_priority), tuple(low_priority))
+            self._routing_cache.put(key, routing, generation)
+        return routing
+
+    def get_routing_cache(self) -> RoutingCache:
+        return self._routing_cache
+
     def get_link_ids_for_request(self, request: Request) -> (list, list, list):
-        high_priority = []
-        normal_priority = []
-        low_priority = []
-        for link_id, link in enumerate(self.links):
-            priority_level = link.get_request_priority_level(request)
-            if priority_level == PriorityLevel.HIGH:
-                high_priority.append(link_id)
-            elif priority_level == PriorityLevel.NORMAL:
-                normal_priority.append(link_id)
-            elif priority_level == PriorityLevel.LOW:
-                low_priority.append(link_id)
-
-        return high_priority, normal_priority, low_priority
-
-    def get_next_link(self, request: Request) -> Optional[Link]:
-        if not self.should_accept_request(request):
-            logger.error(str(self), "Request {} rejected.".format(request))
-            return None
+        _, high_priority, normal_priority, low_priority = self._get_routing(request)
+        return list(high_priority), list(normal_priority), list(low_priority)
 
-        high_priority, normal_priority, low_priority = self.get_link_ids_for_request(request)
+    def _get_candidates(self, links_id: tuple, affinity_key: str) -> Iterator[Link]:
+        # The link picked by the strategy of the whole level first, then the others in an order which does not depend
+        # on the links left out, so that only one strategy is built for each level
+        if affinity_key:
+            strategy = self._affinity_strategies.get(links_id)
+            if strategy is None:
+                strategy = Rendezvous([self.links[link_id] for link_id in links_id])
+                self._affinity_strategies[links_id] = strategy
+            link = strategy.get_next_link(affinity_key)
+            yield link
+            # Without the links already tried, the key goes to its next link in the rendezvous order
+            yield from (other_link for other_link in strategy.get_ranked_links(affinity_key) if other_link is not link)
+            return
 
-        if len(high_priority) != 0:
-            links_id = high_priority
-        elif len(normal_priority) != 0:
-            links_id = normal_priority
-        elif len(low_priority) != 0:
-            links_id = low_priority
-        else:
-            logger.error(str(self), "No link available to take this request ({}).".format(request))
+        # A strategy is built once for each set of links and then picks without scanning them
+        strategy = self._strategies.get(links_id)
+        if strategy is None:
+            strategy = build_strategy(self.strategy, [self.links[link_id] for link_id in links_id],
+                                      self._shared_state is not None)
+            self._strategies[links_id] = strategy
+        link = strategy.get_next_link()
+        yield link
+        link_idx = next(idx for idx, link_id in enumerate(links_id) if self.links[link_id] is link)
+        for other_idx in range(link_idx + 1, link_idx + len(links_id)):
+            yield self.links[links_id[other_idx % len(links_id)]]
+
+    def get_next_link(self, request: Request, excluded_links: Sequence[Link] = ()) -> Optional[Link]:
+        is_accepted, high_priority, normal_priority, low_priority = self._get_routing(request)
+        if not is_accepted:
+            logger.error(self, "Request {} rejected.", request)
+            return None
+        if len(high_priority) == 0 and len(normal_priority) == 0 and len(low_priority) == 0:
+            logger.error(self, "No link available to take this request ({}).", request)
             return None
 
-        links = [self.links[link_id] for link_id in links_id]
+        s_time = perf_counter()
+        affinity_key = get_affinity_key(self.affinity, request) if self.affinity != Affinity.NONE else ""
+        # A failover goes to the other links of the same level first, then to the lower levels. The links at their
+        # limits are left out the same way until a connection is closed or a token is refilled, and the recovering
+        # links only get a growing part of the requests while the others have a choice.
+        link = recovering_link = None
+        is_capped = False
+        for links_id, priority_level in ((high_priority, PriorityLevel.HIGH), (normal_priority, PriorityLevel.NORMAL),
+                                         (low_priority, PriorityLevel.LOW)):
+            if len(links_id) == 0:
+                continue
+            for candidate in self._get_candidates(links_id, affinity_key):
+                if candidate in excluded_links:
+                    continue
+                if not candidate.has_capacity():
+                    is_capped = True
+                elif candidate.circuit_breaker.is_request_allowed():
+                    link = candidate
+                    break
+                elif recovering_link is None:
+                    recovering_link, recovering_level = candidate, priority_level
+            if link is not None:
+                break
+        if link is None and recovering_link is not None:
+            link, priority_level = recovering_link, recovering_level
+        metrics.pick_time.observe(perf_counter() - s_time)
 
-        self._last_link = get_next_link(links, self._last_link, self.strategy)
+        if link is None:
+            if is_capped and not excluded_links:
+                logger.warning(self, "Every link able to take this request ({}) is at its limits.", request)
+            return None
+        metrics.routing_decisions[priority_level].inc()
+        return link
 
-        return self._last_link
+    def _get_health_checker(self) -> Optional[HealthChecker]:
+        # A loop still holding a balancer which was taken over must not start a checker nobody would shut down
+        if self._closed:
+            return None
+        if self._health_checker is None:
+            self._health_checker = HealthChecker(self.health_check_workers)
+        return self._health_checker
 
     def update_links_status(self):
-        for link in self.links:  # TODO: Parallelize iterations
-            link.update_latency_and_status()
+        health_checker = self._get_health_checker()
+        if health_checker is not None:
+            health_checker.check_links(self.links)
 
-    def should_accept_request(self, request: Request) -> bool:
-        for request_matcher in self._request_matchers:
-            is_matching = request_matcher.request_match(request)
+    def check_due_links(self):
+        health_checker = self._get_health_checker()
+        if health_checker is not None:
+            health_checker.check_due_links(self.links)
+
+    def stop_health_checks(self):
+        if self._health_checker is not None:
+            self._health_checker.shutdown()
+            self._health_checker = None
 
-            if (request_matcher.policy == Policy.ALLOW and not is_matching) or (
-                    request_matcher.policy == Policy.FORBID and is_matching):
-                return False
-        return True
+    def should_accept_request(self, request: Request) -> bool:
+        return self._get_routing(request)[0]
@@ -0,0 +1,103 @@
+import atexit
+import os
+import queue
+import threading
+from abc import ABC, abstractmethod
+
+# Items written at once by the writer thread
+BATCH_SIZE = 256
+
+
+class BatchWriter(ABC):
+    # The items are queued by the calling threads and formatted and written in batches by a single background thread,
+    # the items which do not fit in the queue are dropped and counted
+    def __init__(self, output="", max_pending=10000, batch_size=BATCH_SIZE):
+        self.file = None
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        # Total of the items dropped since the start
+        self.dropped = 0
+        self._dropped_reported = 0
+        self._queue = queue.Queue(max_pending)
+        self._writer_thread = None
+        self._lock = threading.Lock()
+        self.set_output(output)
+
+        if hasattr(os, "register_at_fork"):
+            # The writer thread does not exist in a forked process and the queue may have been copied locked
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def __str__(self):
+        return "BatchWriter"
+
+    def __del__(self):
+        if self.file is not None:
+            self.file.close()
+
+    def set_output(self, output: str):
+        if output != "":
+            try:
+                self.file = open(output, 'a')
+            except IOError:
+                raise Exception("Can not access to {}.".format(output))
+
+    def _reset(self):
+        self._queue = queue.Queue(self.max_pending)
+        self._writer_thread = None
+        self._lock = threading.Lock()
+
+    def _put(self, item):
+        if self._writer_thread is None:
+            with self._lock:
+                if self._writer_thread is None:
+                    self._writer_thread = threading.Thread(target=self._write_loop, name=str(self), daemon=True)
+                    self._writer_thread.start()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _pop_dropped(self) -> int:
+        # Items dropped since the last call
+        with self._lock:
+            dropped, self._dropped_reported = self.dropped - self._dropped_reported, self.dropped
+        return dropped
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch([item for item in batch if not isinstance(item, threading.Event)])
+            for event in batch:
+                if isinstance(event, threading.Event):
+                    event.set()
+
+    @abstractmethod
+    def _write_batch(self, items: list):
+        pass
+
+    def _write_lines(self, lines: list):
+        try:
+            if lines and self.file is not None:
+                self.file.write("\n".join(lines) + "\n")
+                self.file.flush()
+            elif lines:
+                print("\n".join(lines), flush=True)
+        except (OSError, ValueError):
+            pass
+
+    def flush(self, timeout=1.0) -> bool:
+        if self._writer_thread is None:
+            return True
+        event = threading.Event()
+        try:
+            self._queue.put(event, timeout=timeout)
+        except queue.Full:
+            return False
+        return event.wait(timeout)
@@ -0,0 +1,90 @@
+import random
+import threading
+from enum import Enum
+from time import monotonic
+from typing import Optional
+
+# Part of the requests let through as soon as the circuit is half-open, it then grows up to all of them
+HALF_OPEN_MIN_RATIO = 0.1
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    OBJECT_SERIALIZATION_DATA = [
+        ("failure_threshold", "failure_threshold", int, False),
+        ("open_time", "open_time", int, False),
+        ("ramp_time", "ramp_time", int, False)
+    ]
+
+    # Opened after failure_threshold consecutive failures, the link then gets no request for open_time seconds.
+    # Once half-open, the part of the requests sent to the link grows during ramp_time seconds, a failure opens the
+    # circuit again and the circuit is closed when the ramp ends without failure.
+    def __init__(self, failure_threshold=5, open_time=10, ramp_time=10):
+        self.failure_threshold = failure_threshold
+        self.open_time = open_time
+        self.ramp_time = ramp_time
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._state_time = monotonic()
+
+    def __str__(self):
+        return "CircuitBreaker:{}".format(self._state.value)
+
+    def get_state(self) -> CircuitState:
+        return self._state
+
+    def is_open(self) -> bool:
+        return self._state == CircuitState.OPEN
+
+    def get_half_open_time(self) -> Optional[float]:
+        if self._state != CircuitState.OPEN:
+            return None
+        return self._state_time + self.open_time
+
+    def _set_state(self, state: CircuitState):
+        self._state = state
+        self._state_time = monotonic()
+        self._failures = 0
+
+    def update(self) -> bool:
+        # Returns True when the state changed
+        with self._lock:
+            if self._state == CircuitState.OPEN and monotonic() >= self._state_time + self.open_time:
+                self._set_state(CircuitState.HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self) -> bool:
+        with self._lock:
+            self._failures = 0
+            if self._state == CircuitState.HALF_OPEN and monotonic() >= self._state_time + self.ramp_time:
+                self._set_state(CircuitState.CLOSED)
+                return True
+            return False
+
+    def record_failure(self) -> bool:
+        if self.failure_threshold <= 0:
+            return False
+        with self._lock:
+            if self._state == CircuitState.OPEN:
+                return False
+            self._failures += 1
+            if self._state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._set_state(CircuitState.OPEN)
+                return True
+            return False
+
+    def is_request_allowed(self) -> bool:
+        state = self._state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.OPEN:
+            return False
+        ramp = (monotonic() - self._state_time) / self.ramp_time if self.ramp_time > 0 else 1
+        return random.random() < HALF_OPEN_MIN_RATIO + (1 - HALF_OPEN_MIN_RATIO) * min(ramp, 1)
@@ -0,0 +1,49 @@
+import threading
+from typing import Hashable, List, Optional
+
+
+class ConnectionRegistry:
+    # The connections are spread over several dicts, each one with its own lock, so that the client threads opening
+    # and closing connections on the same link rarely wait for each other
+    def __init__(self, stripes=16):
+        self._stripes = [{} for _ in range(stripes)]
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __len__(self):
+        return sum(len(stripe) for stripe in self._stripes)
+
+    def __contains__(self, connection_id: Hashable) -> bool:
+        return connection_id in self._stripes[hash(connection_id) % len(self._stripes)]
+
+    def __getitem__(self, connection_id: Hashable):
+        return self._stripes[hash(connection_id) % len(self._stripes)][connection_id]
+
+    def add(self, connection_id: Hashable, connection) -> bool:
+        stripe_idx = hash(connection_id) % len(self._stripes)
+        with self._locks[stripe_idx]:
+            stripe = self._stripes[stripe_idx]
+            if connection_id in stripe:
+                return False
+            stripe[connection_id] = connection
+            return True
+
+    def replace(self, connection_id: Hashable, connection) -> bool:
+        stripe_idx = hash(connection_id) % len(self._stripes)
+        with self._locks[stripe_idx]:
+            stripe = self._stripes[stripe_idx]
+            if connection_id not in stripe:
+                return False
+            stripe[connection_id] = connection
+            return True
+
+    def pop(self, connection_id: Hashable) -> Optional[object]:
+        stripe_idx = hash(connection_id) % len(self._stripes)
+        with self._locks[stripe_idx]:
+            return self._stripes[stripe_idx].pop(connection_id, None)
+
+    def keys(self) -> List[Hashable]:
+        keys = []
+        for stripe_idx, stripe in enumerate(self._stripes):
+            with self._locks[stripe_idx]:
+                keys.extend(stripe.keys())
+        return keys
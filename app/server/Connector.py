@@ -0,0 +1,128 @@
+import queue
+import socket
+import threading
+from time import monotonic
+from typing import Optional
+
+import socks
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Balancer import Balancer
+from app.server.Link import Link
+from app.server.Logger import logger
+from app.server.Request import Request
+
+
+class Connector:
+    # Picks a link for the request and connects through it. When the connect fails, the next candidate link is tried,
+    # in the same priority level first, until connect_attempts links were tried or connect_deadline is reached.
+    # With a hedge_delay, another link is raced when the connect takes longer than the delay.
+    def __init__(self, server):
+        self._server = server
+
+    def __str__(self):
+        return "Connector:{}".format(self._server)
+
+    def connect(self, request: Request, stats: TunnelStats) -> Optional[tuple]:
+        balancer = self._server.balancer
+        deadline = monotonic() + balancer.connect_deadline if balancer.connect_deadline else None
+        s_time = monotonic()
+        # The whole failover uses the same balancer even if the configuration is reloaded meanwhile
+        if balancer.hedge_delay > 0:
+            connection = self._connect_hedged(balancer, request, deadline, balancer.hedge_delay / 1000)
+        else:
+            connection = self._connect_sequentially(balancer, request, deadline)
+        if isinstance(connection, CloseReason):
+            stats.close(connection)
+            return None
+        stats.link = connection[0]
+        stats.connect_time = monotonic() - s_time
+        return connection
+
+    @staticmethod
+    def _get_remaining_time(deadline: Optional[float]) -> Optional[float]:
+        if deadline is None:
+            return None
+        return deadline - monotonic()
+
+    def _open(self, link: Link, request: Request, timeout: Optional[float]) -> tuple:
+        connection_id = self._server.generate_connection_id()
+        if link.open_connection(connection_id) is None:
+            raise socket.error("Can not open a connection on {}.".format(link))
+        try:
+            return link, connection_id, link.connect(connection_id, (request.domain, request.port), timeout)
+        except (socket.error, socks.ProxyError, ValueError) as err:
+            link.close_connection(connection_id)
+            logger.error(self, "Socket error while trying to connect to {} through {}: \"{}\".", request, link, err)
+            raise
+
+    def _connect_sequentially(self, balancer: Balancer, request: Request, deadline: Optional[float]):
+        tried_links = []
+        while len(tried_links) < max(balancer.connect_attempts, 1):
+            remaining = self._get_remaining_time(deadline)
+            if remaining is not None and remaining <= 0:
+                break
+            link = balancer.get_next_link(request, tried_links)
+            if link is None:
+                break
+            tried_links.append(link)
+            try:
+                return self._open(link, request, remaining)
+            except (socket.error, socks.ProxyError, ValueError):
+                continue
+        return CloseReason.CONNECT_ERROR if tried_links else CloseReason.REJECTED
+
+    def _connect_hedged(self, balancer: Balancer, request: Request, deadline: Optional[float], hedge_delay: float):
+        # Each attempt runs in its own thread, the first connection established is kept, the connections of the
+        # attempts ending after it are closed at once
+        results = queue.Queue()
+        lock = threading.Lock()
+        winner = []
+        tried_links = []
+        in_progress = 0
+
+        def attempt(link: Link, timeout: Optional[float]):
+            try:
+                connection = self._open(link, request, timeout)
+            except (socket.error, socks.ProxyError, ValueError):
+                results.put(None)
+                return
+            with lock:
+                is_winner = not winner
+                if is_winner:
+                    winner.append(connection)
+            if not is_winner:
+                connection[0].close_connection(connection[1])
+            results.put(connection if is_winner else None)
+
+        while True:
+            remaining = self._get_remaining_time(deadline)
+            if remaining is not None and remaining <= 0:
+                break
+            can_start = len(tried_links) < max(balancer.connect_attempts, 1)
+            if can_start:
+                link = balancer.get_next_link(request, tried_links)
+                if link is not None:
+                    tried_links.append(link)
+                    in_progress += 1
+                    threading.Thread(target=attempt, args=(link, remaining), daemon=True).start()
+                else:
+                    can_start = False
+            if in_progress == 0:
+                break
+
+            wait = hedge_delay if can_start else remaining
+            if wait is not None and remaining is not None:
+                wait = min(wait, remaining)
+            try:
+                result = results.get(timeout=wait)
+            except queue.Empty:
+                continue  # The attempts in progress are too slow, another link is raced
+            in_progress -= 1
+            if result is not None:
+                return result
+
+        with lock:
+            # The attempts still in progress will close their connection
+            winner.append(None)
+        return CloseReason.CONNECT_ERROR if tried_links else CloseReason.REJECTED
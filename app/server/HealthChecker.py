@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import List
+
+from app.server.Link import Link
+from app.server.Logger import logger
+
+
+class HealthChecker:
+    def __init__(self, workers=8):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="HealthChecker")
+        self._lock = threading.Lock()
+        self._next_checks = {}
+        self._in_progress = set()
+
+    def __str__(self):
+        return "HealthChecker:{}".format(len(self._next_checks))
+
+    def check_due_links(self, links: List[Link]):
+        # Each link has its own schedule, a slow or dead link never delays the check of the others
+        now = monotonic()
+        with self._lock:
+            for link in list(self._next_checks):
+                if link not in links:
+                    del self._next_checks[link]
+            for link in links:
+                if link in self._in_progress or self._next_checks.get(link, now) > now:
+                    continue
+                self._in_progress.add(link)
+                self._executor.submit(self._check_link, link)
+
+    def check_links(self, links: List[Link]):
+        list(self._executor.map(lambda link: link.update_latency_and_status(), links))
+
+    def _check_link(self, link: Link):
+        try:
+            link.update_latency_and_status()
+        except Exception as err:
+            logger.error(self, "Error while checking {}: \"{}\".", link, err)
+        finally:
+            with self._lock:
+                self._in_progress.discard(link)
+                self._next_checks[link] = monotonic() + link.get_next_check_delay()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
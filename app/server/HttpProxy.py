@@ -0,0 +1,141 @@
+from enum import Enum
+from urllib.parse import urlsplit
+
+
+class HttpStatus(Enum):
+    CONNECTION_ESTABLISHED = (200, "Connection established")
+    BAD_REQUEST = (400, "Bad Request")
+    FORBIDDEN = (403, "Forbidden")
+    HEADER_FIELDS_TOO_LARGE = (431, "Request Header Fields Too Large")
+    BAD_GATEWAY = (502, "Bad Gateway")
+
+
+# Headers of the client connection to the proxy, they are not forwarded to the target with the ones listed in its
+# Connection header. The Transfer-Encoding is kept as the body is relayed as it is.
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "proxy-authorization", "proxy-authenticate", "te",
+                      "trailer", "upgrade"}
+
+# Largest request head accepted, the data received with it fills the rest of the buffer
+HTTP_BUFFER_SIZE = 16384
+
+
+def build_response(status: HttpStatus) -> bytes:
+    code, reason = status.value
+    if status == HttpStatus.CONNECTION_ESTABLISHED:
+        return "HTTP/1.1 {} {}\r\n\r\n".format(code, reason).encode()
+    return "HTTP/1.1 {} {}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".format(code, reason).encode()
+
+
+def _split_authority(authority: str, default_port: int) -> (str, int):
+    host, separator, port = authority.rpartition(":")
+    # An IPv6 address without port ends with a bracket
+    if not separator or host.count("[") != host.count("]") or authority.endswith("]"):
+        host, port = authority, str(default_port)
+    host = host.strip("[]")
+    if not host or not port.isdigit() or not 0 < int(port) < 65536:
+        raise HttpError("Invalid HTTP proxy target '{}'.".format(authority))
+    return host, int(port)
+
+
+class HttpError(Exception):
+    def __init__(self, message: str, status=HttpStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+class HttpParser:
+    # Same buffer handling as the SocksParser: the request head is received whatever the way it is split, the bytes
+    # received after it are kept to be sent to the target
+    def __init__(self, size=HTTP_BUFFER_SIZE):
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._end = 0
+        self._scanned = 0
+        self.method = None
+        self.domain = None
+        self.port = None
+        # Head sent to the target in place of the one of the client for a forward request
+        self._forward_head = b''
+
+    def __len__(self):
+        return self._end - self._start
+
+    def get_free_buffer(self) -> memoryview:
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+        elif self._end == len(self._buffer):
+            self._buffer[:self._end - self._start] = self._buffer[self._start:self._end]
+            self._scanned -= self._start
+            self._end -= self._start
+            self._start = 0
+        return memoryview(self._buffer)[self._end:]
+
+    def commit(self, received: int):
+        self._end += received
+
+    def feed(self, data: bytes):
+        free_buffer = self.get_free_buffer()
+        if len(data) > len(free_buffer):
+            raise HttpError("HTTP request head too long.", HttpStatus.HEADER_FIELDS_TOO_LARGE)
+        free_buffer[:len(data)] = data
+        self.commit(len(data))
+
+    def is_connect(self) -> bool:
+        return self.method == "CONNECT"
+
+    def parse_request(self) -> bool:
+        # Returns False until the whole head is received, the part already scanned is not searched again
+        head_end = self._buffer.find(b'\r\n\r\n', max(self._start, self._scanned - 3), self._end)
+        if head_end < 0:
+            self._scanned = self._end
+            if self._start == 0 and self._end == len(self._buffer):
+                raise HttpError("HTTP request head too long.", HttpStatus.HEADER_FIELDS_TOO_LARGE)
+            return False
+
+        lines = bytes(self._buffer[self._start:head_end]).decode("latin-1").split("\r\n")
+        self._start = self._scanned = head_end + 4
+        request_line = lines[0].split(" ")
+        if len(request_line) != 3 or not request_line[2].startswith("HTTP/1."):
+            raise HttpError("Malformed HTTP request line '{}'.".format(lines[0][:64]))
+        self.method, target, version = request_line
+        headers = []
+        for line in lines[1:]:
+            name, separator, value = line.partition(":")
+            if not separator or not name or name != name.strip():
+                raise HttpError("Malformed HTTP header '{}'.".format(line[:64]))
+            headers.append((name, value.strip()))
+
+        if self.is_connect():
+            self.domain, self.port = _split_authority(target, 443)
+            return True
+        self._parse_forward_request(target, version, headers)
+        return True
+
+    def _parse_forward_request(self, target: str, version: str, headers: list):
+        # https://tools.ietf.org/html/rfc7230#section-5.3.2
+        url = urlsplit(target)
+        if url.scheme.lower() != "http" or not url.netloc:
+            raise HttpError("Only absolute http URIs can be forwarded, got '{}'.".format(target[:64]))
+        self.domain, self.port = _split_authority(url.netloc.rpartition("@")[2], 80)
+        path = (url.path or "/") + ("?" + url.query if url.query else "")
+
+        # https://tools.ietf.org/html/rfc7230#section-6.1
+        hop_by_hop_headers = set(HOP_BY_HOP_HEADERS)
+        for name, value in headers:
+            if name.lower() in ("connection", "proxy-connection"):
+                hop_by_hop_headers.update(token.strip().lower() for token in value.split(","))
+        # The Host of the client may differ from the authority of the URI, which is the target
+        head = ["{} {} {}".format(self.method, path, version), "Host: {}".format(url.netloc.rpartition("@")[2])]
+        head.extend("{}: {}".format(name, value) for name, value in headers
+                    if name.lower() not in hop_by_hop_headers and name.lower() != "host")
+        # A single target per connection: once it answers, the client opens a new connection for its next request
+        head.append("Connection: close")
+        self._forward_head = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1")
+
+    def pop_pending(self) -> bytes:
+        # Data to send to the target before relaying: the rewritten head of a forward request and the data sent by the
+        # client right after its request
+        pending = self._forward_head + bytes(self._buffer[self._start:self._end])
+        self._forward_head = b''
+        self._start = self._end = self._scanned = 0
+        return pending
@@ -1,13 +1,24 @@
+import errno
+import math
+import random
 import socket
-import time
+import threading
+from time import monotonic
 from enum import Enum
-from typing import Optional, List
+from typing import Callable, Optional, List
 
 import socks
 
+from app.server.CircuitBreaker import CircuitBreaker
+from app.server.ConnectionRegistry import ConnectionRegistry
+from app.server.LinkPool import LinkPool, PrewarmedSocket
 from app.server.Logger import logger
+from app.server.Probe import Probe, probe_results
+from app.server.RateLimit import LinkLimits, TokenBucket
 from app.server.Request import Request
 from app.server.RequestMatcher import Policy, RequestMatcher
+from app.server.Resolver import ResolverMode, connect_happy_eyeballs, resolver
+from app.server.SharedState import SharedLinkState
 
 
 class PriorityLevel(str, Enum):
@@ -31,8 +42,46 @@ PROTOCOLS = {
     "http": socks.HTTP
 }
 
-TEST_ADDRESS = "example.org"
-TEST_PORT = 80
+
+# Replies of a SOCKS5 proxy about the target: network or host unreachable, connection refused and TTL expired
+SOCKS5_TARGET_ERRORS = (0x03, 0x04, 0x05, 0x06)
+# Replies of an HTTP proxy which could not reach the target
+HTTP_TARGET_ERRORS = (502, 504)
+# Errors of a direct connect caused by the interface itself
+INTERFACE_ERRNOS = (errno.ENETDOWN, errno.ENETUNREACH, errno.ENODEV)
+
+
+def _get_reply_code(message: str, base: int) -> Optional[int]:
+    try:
+        return int(message.split(":")[0], base)
+    except ValueError:
+        return None
+
+
+def is_link_failure(err: Exception) -> bool:
+    # Only the errors of the link itself count against it: a refused or unknown target says nothing about the link
+    while isinstance(err, socks.GeneralProxyError) and isinstance(err.socket_err, socks.ProxyError):
+        err = err.socket_err  # PySocks wraps the errors raised while negotiating
+    if isinstance(err, socks.SOCKS5Error):
+        return _get_reply_code(err.msg, 16) not in SOCKS5_TARGET_ERRORS
+    if isinstance(err, socks.SOCKS4Error):
+        return False  # Rejected is also the reply for an unreachable target
+    if isinstance(err, socks.HTTPError):
+        return _get_reply_code(err.msg, 10) not in HTTP_TARGET_ERRORS
+    if isinstance(err, socks.ProxyError):
+        # Proxy unreachable, authentication failure, timeout or invalid data from the proxy
+        return True
+    if isinstance(err, (socket.timeout, TimeoutError)):
+        # A silently dead interface only shows as connects which time out, whatever the target
+        return True
+    return isinstance(err, OSError) and err.errno in INTERFACE_ERRNOS
+
+
+# Unanswered keepalive probes after which the kernel drops the connection
+KEEPALIVE_PROBES = 3
+
+# Time constant (seconds) after which the observed latency has mostly decayed toward the probe latency
+LATENCY_DECAY_TIME = 10
 
 
 class Link:
@@ -43,24 +92,47 @@ class Link:
         ("protocol", "_protocol", Protocol, False),
         ("domain", "_domain", str, False),
         ("port", "_port", int, False),
-        ("matchers", "_request_matchers", RequestMatcher, False)
+        ("matchers", "_request_matchers", RequestMatcher, False),
+        ("pool", "pool", LinkPool, False),
+        ("check_interval", "_check_interval", int, False),
+        ("check_jitter", "_check_jitter", int, False),
+        ("probe", "probe", Probe, False),
+        ("resolver", "_resolver_mode", ResolverMode, False),
+        ("circuit_breaker", "circuit_breaker", CircuitBreaker, False),
+        ("limits", "limits", LinkLimits, False),
+        ("keepalive", "_keepalive", int, False)
     ]
 
-    def __init__(self, interface="", protocol=Protocol.DIRECT, domain="", port=0, timeout=10, weight=1):
+    def __init__(self, interface="", protocol=Protocol.DIRECT, domain="", port=0, timeout=10, weight=1,
+                 check_interval=10, check_jitter=2, resolver_mode=ResolverMode.CACHED, keepalive=0):
+        self._shared_state = None
+        self._shared_idx = 0
         self._interface = interface
         self._protocol = protocol
         self._domain = domain
         self._port = port
         self._timeout = timeout
+        self._keepalive = keepalive
         self.weight = weight
+        self._check_interval = check_interval
+        self._check_jitter = check_jitter
+        self.probe = Probe()
+        self._resolver_mode = resolver_mode
+        self.circuit_breaker = CircuitBreaker()
+        self.limits = LinkLimits()
+        self._open_lock = threading.Lock()
         self._request_matchers = []
-        self.connections = {}
-        self.status = True
+        self.pool = None
+        self._routing_listeners = []
+        self._connections_listeners = []
+        self.connections = ConnectionRegistry()
+        self._status = True
         self.latency = 0
+        self._connect_latency = None
+        self._connect_latency_time = 0.0
 
     def __del__(self):
-        connections = [key for key in self.connections.keys()]
-        for connection_id in connections:
+        for connection_id in self.connections.keys():
             self.close_connection(connection_id)
 
     def __str__(self):
@@ -74,8 +146,91 @@ class Link:
         str_representation += str(self.weight)
         return str_representation
 
+    @property
+    def status(self) -> bool:
+        if self._shared_state is not None:
+            return self._shared_state.get_status(self._shared_idx)
+        return self._status
+
+    @status.setter
+    def status(self, status: bool):
+        is_changed = status != self.status
+        self._status = status
+        if self._shared_state is not None:
+            self._shared_state.set_status(self._shared_idx, status)
+        if is_changed:
+            self._notify_routing_change()
+
+    def is_available(self) -> bool:
+        return self.status and not self.circuit_breaker.is_open()
+
+    def update_circuit_breaker(self):
+        if self.circuit_breaker.update():
+            self._notify_routing_change()
+
+    def record_failure(self):
+        if self.circuit_breaker.record_failure():
+            logger.warning(self, "Too many errors, no request will be sent to this link for {} seconds.",
+                           self.circuit_breaker.open_time)
+            self._notify_routing_change()
+
+    def has_capacity(self) -> bool:
+        return self.limits.has_capacity(self.get_connections_count())
+
+    def get_bandwidth_bucket(self) -> Optional[TokenBucket]:
+        return self.limits.bandwidth_bucket
+
+    def set_limits(self, limits: LinkLimits):
+        self.limits = limits
+        return self
+
+    def attach_shared_state(self, shared_state: SharedLinkState, idx: int):
+        self._shared_state = shared_state
+        self._shared_idx = idx
+        shared_state.set_status(idx, self._status)
+        shared_state.add_connections(idx, len(self.connections))
+        return self
+
+    def get_connections_count(self) -> int:
+        if self._shared_state is not None:
+            return self._shared_state.get_connections_count(self._shared_idx)
+        return len(self.connections)
+
+    def add_routing_listener(self, listener: Callable[[bool], None]):
+        if listener not in self._routing_listeners:
+            self._routing_listeners.append(listener)
+        return self
+
+    def remove_routing_listener(self, listener: Callable[[bool], None]):
+        if listener in self._routing_listeners:
+            self._routing_listeners.remove(listener)
+        return self
+
+    def _notify_routing_change(self, is_index_changed=False):
+        # The routing index only depends on the matchers, a change of status or of circuit only changes the links picked
+        for listener in self._routing_listeners:
+            listener(is_index_changed)
+
+    def add_connections_listener(self, listener: Callable[["Link"], None]):
+        if listener not in self._connections_listeners:
+            self._connections_listeners.append(listener)
+        return self
+
+    def remove_connections_listener(self, listener: Callable[["Link"], None]):
+        if listener in self._connections_listeners:
+            self._connections_listeners.remove(listener)
+        return self
+
+    def _notify_connections_change(self):
+        for listener in self._connections_listeners:
+            listener(self)
+
+    def get_request_matchers(self) -> List[RequestMatcher]:
+        return self._request_matchers
+
     def add_request_matcher(self, request_matcher: RequestMatcher):
         self._request_matchers.append(request_matcher)
+        self._notify_routing_change(True)
         return self
 
     def add_request_matchers(self, request_matchers: List[RequestMatcher]):
@@ -84,12 +239,15 @@ class Link:
         return self
 
     def get_request_priority_level(self, request: Request) -> PriorityLevel:
+        if not self.is_available():
+            return PriorityLevel.FORBID
+
         is_prioritized = False
         is_deprioritized = False
         for request_matcher in self._request_matchers:
             is_matching = request_matcher.request_match(request)
 
-            if not self.status or (request_matcher.policy == Policy.ALLOW and not is_matching) or (
+            if (request_matcher.policy == Policy.ALLOW and not is_matching) or (
                     request_matcher.policy == Policy.FORBID and is_matching):
                 return PriorityLevel.FORBID
 
@@ -107,21 +265,183 @@ class Link:
         if is_deprioritized:
             return PriorityLevel.LOW
 
-    def open_connection(self, connection_id: str) -> Optional[socks.socksocket]:
+    def update_configuration(self, link: "Link"):
+        # The connections, status, latency and circuit state of this link are kept, the configuration is taken from
+        # the other link which has the same upstream
+        self._timeout = link._timeout
+        self._keepalive = link._keepalive
+        self.weight = link.weight
+        self._check_interval = link._check_interval
+        self._check_jitter = link._check_jitter
+        self.probe = link.probe
+        self._resolver_mode = link._resolver_mode
+        self.circuit_breaker.failure_threshold = link.circuit_breaker.failure_threshold
+        self.circuit_breaker.open_time = link.circuit_breaker.open_time
+        self.circuit_breaker.ramp_time = link.circuit_breaker.ramp_time
+        if self.limits.get_key() != link.limits.get_key():
+            self.limits = link.limits
+        pool_key = self.pool.get_key() if self.pool is not None else None
+        if pool_key != (link.pool.get_key() if link.pool is not None else None):
+            self.stop_pool()
+            self.pool = link.pool
+        self._request_matchers = link._request_matchers
+        self._notify_routing_change(True)
+        return self
+
+    def start_pool(self):
+        # The pool fills up as soon as the server starts, the first requests already find prewarmed sockets
+        if self.pool is not None and self._protocol != Protocol.DIRECT:
+            self.pool.start(str(self), self._build_prewarmed_socket)
+        return self
+
+    def stop_pool(self):
+        if self.pool is not None:
+            self.pool.stop()
+        return self
+
+    def set_pool(self, pool: LinkPool):
+        self.pool = pool
+        return self
+
+    def open_connection(self, connection_id: str, prewarmed=True, limited=True) -> Optional[socks.socksocket]:
         if connection_id in self.connections:
-            logger.error(str(self), "Connection id '{}' already in use for this link.".format(connection_id))
+            logger.error(self, "Connection id '{}' already in use for this link.", connection_id)
+            return None
+        sock = None
+        if prewarmed and self.pool is not None and self._protocol != Protocol.DIRECT:
+            sock = self.pool.acquire()
+        if sock is None:
+            sock = self._build_socket()
+        limits = self.limits if limited else None
+        if limits is not None and limits.max_connections:
+            # The count is checked and the connection added at once so that concurrent opens can not exceed it, the
+            # other opens only go through the striped registry
+            with self._open_lock:
+                is_added = self._add_connection(connection_id, sock, limits)
+        else:
+            is_added = self._add_connection(connection_id, sock, limits)
+        if not is_added:
             return None
-        self.connections[connection_id] = self._build_socket()
-        return self.connections[connection_id]
+        self._notify_connections_change()
+        return sock
+
+    def _add_connection(self, connection_id: str, sock: socks.socksocket, limits: Optional[LinkLimits]) -> bool:
+        if limits is not None and not limits.try_open(self.get_connections_count() if limits.max_connections else 0):
+            sock.close()
+            logger.warning(self, "Limits reached, connection '{}' not opened.", connection_id)
+            return False
+        if not self.connections.add(connection_id, sock):
+            sock.close()
+            logger.error(self, "Connection id '{}' already in use for this link.", connection_id)
+            return False
+        if self._shared_state is not None:
+            self._shared_state.add_connections(self._shared_idx, 1)
+        return True
+
+    def connect(self, connection_id: str, address: tuple, timeout: Optional[float] = None) -> socks.socksocket:
+        s_time = monotonic()
+        try:
+            sock = self._connect(connection_id, address, timeout)
+        except socket.error as err:
+            # A failed connect costs at least the whole timeout to the client
+            self.record_connect_latency(max(monotonic() - s_time, timeout or self._timeout))
+            if is_link_failure(err):
+                self.record_failure()
+            raise
+        self.record_connect_latency(monotonic() - s_time)
+        if self.circuit_breaker.record_success():
+            self._notify_routing_change()
+        return sock
+
+    def _connect(self, connection_id: str, address: tuple, timeout: Optional[float] = None) -> socks.socksocket:
+        sock = self.connections[connection_id]
+        # A shorter timeout only applies to the connect, the link timeout is restored for the relay
+        if timeout is None or timeout >= self._timeout:
+            timeout = self._timeout
+        else:
+            sock.settimeout(timeout)
+        try:
+            # Through a proxy the name is resolved by the proxy
+            if self._protocol != Protocol.DIRECT or self._resolver_mode == ResolverMode.SYSTEM:
+                sock.connect(address)
+                return sock
+
+            addresses = resolver.resolve(*address)
+            if len(addresses) == 1 and addresses[0][0] == sock.family:
+                sock.connect(addresses[0][1])
+                return sock
+        finally:
+            sock.settimeout(self._timeout)
+
+        new_sock = connect_happy_eyeballs(addresses, lambda family: self._build_socket(family=family), timeout)
+        new_sock.settimeout(self._timeout)
+        new_sock.proxy_peername = address
+        if not self.connections.replace(connection_id, new_sock):
+            new_sock.close()
+            raise socket.error("Connection '{}' closed while connecting.".format(connection_id))
+        sock.close()
+        return new_sock
+
+    def supports_udp(self) -> bool:
+        return self._protocol in (Protocol.DIRECT, Protocol.SOCKS5)
+
+    def open_datagram_socket(self, address: tuple) -> (socket.socket, tuple):
+        # Returns the socket and the address to send the datagrams to. Through the proxy, the datagrams go through a
+        # UDP association of the proxy which resolves the name.
+        if self._protocol != Protocol.DIRECT:
+            sock = self._build_socket(family=socket.AF_INET, sock_type=socket.SOCK_DGRAM)
+            try:
+                sock.bind(("", 0))
+            except (socket.error, socks.ProxyError):
+                sock.close()
+                raise
+            return sock, address
+
+        if self._resolver_mode == ResolverMode.SYSTEM:
+            family, _, _, _, target = socket.getaddrinfo(*address, type=socket.SOCK_DGRAM)[0]
+        else:
+            family, target = resolver.resolve(*address)[0]
+        sock = self._build_socket(socket.socket, family, socket.SOCK_DGRAM)
+        try:
+            # Only the datagrams of the target are received
+            sock.connect(target)
+        except socket.error:
+            sock.close()
+            raise
+        return sock, target
+
+    def record_connect_latency(self, latency: float):
+        # Peak EWMA: a slower sample is taken at once, faster ones are averaged in depending on the time elapsed
+        now = monotonic()
+        if self._connect_latency is None or latency > self._connect_latency:
+            self._connect_latency = latency
+        else:
+            weight = math.exp(-(now - self._connect_latency_time) / LATENCY_DECAY_TIME)
+            self._connect_latency = self._connect_latency * weight + latency * (1 - weight)
+        self._connect_latency_time = now
+
+    def get_latency_estimate(self) -> float:
+        # Without new samples the estimate goes back to the probe latency, so an unused link gets tried again
+        if self._connect_latency is None:
+            return self.latency
+        weight = math.exp(-(monotonic() - self._connect_latency_time) / LATENCY_DECAY_TIME)
+        return self._connect_latency * weight + self.latency * (1 - weight)
 
     def close_connection(self, connection_id: str):
-        if connection_id in self.connections:
-            self.connections[connection_id].close()
-            del self.connections[connection_id]
+        sock = self.connections.pop(connection_id)
+        if sock is not None:
+            sock.close()
+            if self._shared_state is not None:
+                self._shared_state.add_connections(self._shared_idx, -1)
+            self._notify_connections_change()
         return self
 
-    def _build_socket(self) -> socks.socksocket:
-        sock = socks.socksocket()
+    def _build_prewarmed_socket(self) -> PrewarmedSocket:
+        return self._build_socket(PrewarmedSocket)
+
+    def _build_socket(self, socket_type=socks.socksocket, family=socket.AF_INET,
+                      sock_type=socket.SOCK_STREAM) -> socks.socksocket:
+        sock = socket_type(family, sock_type)
         if self._protocol != Protocol.DIRECT:
             sock.setproxy(PROTOCOLS[self._protocol.value], self._domain, self._port)
         if self._interface:
@@ -130,22 +450,45 @@ class Link:
                 socket.SO_BINDTODEVICE,
                 self._interface.encode()
             )
+        if self._keepalive and sock_type == socket.SOCK_STREAM:
+            self._set_keepalive(sock)
         sock.settimeout(self._timeout)
         return sock
 
+    def _set_keepalive(self, sock: socket.socket):
+        # The first probe is sent after keepalive seconds without any data, the next ones every third of it
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self._keepalive)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, self._keepalive // KEEPALIVE_PROBES))
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_PROBES)
+
+    def get_next_check_delay(self) -> float:
+        # The jitter spreads the checks of links sharing the same interval
+        return self._check_interval + random.uniform(0, self._check_jitter)
+
+    def set_probe(self, probe: Probe):
+        self.probe = probe
+        return self
+
+    def get_upstream_key(self) -> tuple:
+        return self._protocol, self._domain, self._port, self._interface
+
     def update_latency_and_status(self):
-        sock = self.open_connection("TEST_LINK")
         try:
-            s_time = time.time()
-            sock.connect((TEST_ADDRESS, TEST_PORT))
-            sock.sendall(str.encode("GET / HTTP/1.1\r\nHost: {}\r\n\r\n".format(TEST_ADDRESS)))
-            sock.recv(1024)
-            self.latency = round(time.time() - s_time, 3)
+            self.latency = probe_results.get_or_run(self.get_upstream_key() + self.probe.get_key(),
+                                                    self.probe.cache_ttl, self._run_probe)
             self.status = True
         except Exception as e:
             self.latency = 0
             self.status = False
-            logger.warning(str(self),
-                           "Connection error with {}:{}, exception: \"{}\".".format(TEST_ADDRESS, TEST_PORT, e))
+            logger.warning(self, "{} failed, exception: \"{}\".", self.probe, e)
+
+    def _run_probe(self) -> float:
+        sock = self.open_connection("TEST_LINK", prewarmed=False, limited=False)
+        try:
+            return self.probe.measure(sock, lambda address: self._connect("TEST_LINK", address))
         finally:
             self.close_connection("TEST_LINK")
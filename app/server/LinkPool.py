@@ -0,0 +1,192 @@
+import select
+import socket
+import threading
+from collections import deque
+from struct import pack, unpack
+from time import monotonic, sleep
+from typing import Callable, Optional
+
+import socks
+
+from app.server.HttpProxy import HTTP_BUFFER_SIZE
+from app.server.Logger import logger
+from app.server.Socks import SocksCommand, SocksError, build_request_packet, read_address
+
+
+class PrewarmedSocket(socks.socksocket):
+    # Socket already connected to the proxy (and greeted for SOCKS5), connect() only sends the final request. The
+    # exchanges with the proxy are written here with the public attributes of PySocks only, its private negotiation
+    # methods change between its releases.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prewarmed_at = 0.0
+
+    def prewarm(self):
+        proxy_type, proxy_addr, proxy_port = self.proxy[:3]
+        socket.socket.connect(self, (proxy_addr, proxy_port))
+        if proxy_type == socks.SOCKS5:
+            self.sendall(b'\x05\x01\x00')
+            if self._recv_exactly(2) != b'\x05\x00':
+                raise socks.GeneralProxyError("SOCKS5 proxy server refused the no authentication method")
+        self.prewarmed_at = monotonic()
+
+    def is_alive(self) -> bool:
+        # Nothing must be readable: data is unexpected and an empty read means the proxy closed the socket. Unlike
+        # select.select, poll accepts the descriptors above 1024.
+        poller = select.poll()
+        poller.register(self, select.POLLIN)
+        try:
+            return not poller.poll(0)
+        except OSError:
+            return False
+
+    def connect(self, dest_pair, catch_errors=None):
+        dest_addr, dest_port = dest_pair
+        try:
+            if self.proxy[0] == socks.SOCKS5:
+                self._socks5_connect(dest_addr, dest_port)
+            elif self.proxy[0] == socks.SOCKS4:
+                self._socks4_connect(dest_addr, dest_port)
+            else:
+                self._http_connect(dest_addr, dest_port)
+        except socks.ProxyError:
+            self.close()
+            raise
+        except SocksError as err:
+            self.close()
+            raise socks.GeneralProxyError("SOCKS5 proxy server sent invalid data: {}".format(err))
+        except socket.error as err:
+            self.close()
+            raise socks.GeneralProxyError("Socket error", err)
+
+    def _recv_exactly(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            received = self.recv(size - len(data))
+            if not received:
+                raise socks.GeneralProxyError("Connection closed unexpectedly")
+            data += received
+        return data
+
+    def _socks5_connect(self, dest_addr: str, dest_port: int):
+        self.sendall(build_request_packet(SocksCommand.CONNECT, (dest_addr, dest_port)))
+        ver, rep, _, atyp = self._recv_exactly(4)
+        if ver != 5:
+            raise socks.GeneralProxyError("SOCKS5 proxy server sent invalid data")
+        if rep != 0:
+            raise socks.SOCKS5Error("{:#04x}: {}".format(rep, socks.SOCKS5_ERRORS.get(rep, "Unknown error")))
+        self.proxy_sockname = read_address(atyp, self._recv_exactly)
+        self.proxy_peername = (dest_addr, dest_port)
+
+    def _socks4_connect(self, dest_addr: str, dest_port: int):
+        # SOCKS4a when the proxy resolves the domains
+        try:
+            address, domain = socket.inet_aton(dest_addr), b''
+        except OSError:
+            if self.proxy[3]:
+                address, domain = b'\x00\x00\x00\x01', dest_addr.encode() + b'\x00'
+            else:
+                address, domain = socket.inet_aton(socket.gethostbyname(dest_addr)), b''
+        self.sendall(pack('>BBH', 4, 1, dest_port) + address + (self.proxy[4] or b'') + b'\x00' + domain)
+        reply = self._recv_exactly(8)
+        if reply[0] != 0:
+            raise socks.GeneralProxyError("SOCKS4 proxy server sent invalid data")
+        if reply[1] != 0x5A:
+            raise socks.SOCKS4Error("{:#04x}: {}".format(reply[1], socks.SOCKS4_ERRORS.get(reply[1], "Unknown error")))
+        self.proxy_sockname = (socket.inet_ntoa(reply[4:]), unpack('>H', reply[2:4])[0])
+        self.proxy_peername = (dest_addr, dest_port)
+
+    def _http_connect(self, dest_addr: str, dest_port: int):
+        authority = "{}:{}".format("[{}]".format(dest_addr) if ":" in dest_addr else dest_addr, dest_port)
+        self.sendall("CONNECT {0} HTTP/1.1\r\nHost: {0}\r\n\r\n".format(authority).encode())
+        # Read byte per byte, the data the target sends right after the reply belongs to the client
+        head = b''
+        while not head.endswith(b'\r\n\r\n'):
+            if len(head) >= HTTP_BUFFER_SIZE:
+                raise socks.GeneralProxyError("HTTP proxy server sent a too long reply")
+            head += self._recv_exactly(1)
+        status_line = head.split(b'\r\n', 1)[0].decode("latin-1").split(" ", 2)
+        if len(status_line) < 2 or not status_line[0].startswith("HTTP/") or not status_line[1].isdigit():
+            raise socks.GeneralProxyError("Proxy server does not appear to be an HTTP proxy")
+        if status_line[1] != "200":
+            raise socks.HTTPError("{}: {}".format(status_line[1], status_line[2] if len(status_line) > 2 else ""))
+        self.proxy_sockname = (b'0.0.0.0', 0)
+        self.proxy_peername = (dest_addr, dest_port)
+
+
+class LinkPool:
+    OBJECT_SERIALIZATION_DATA = [
+        ("size", "size", int, True),
+        ("idle_ttl", "idle_ttl", int, False),
+        ("refill_rate", "refill_rate", int, False)
+    ]
+
+    def __init__(self, size=0, idle_ttl=30, refill_rate=10):
+        self.size = size
+        self.idle_ttl = idle_ttl
+        self.refill_rate = refill_rate
+        self._sockets = deque()
+        self._lock = threading.Lock()
+        self._refill_event = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def start(self, name: str, build_socket: Callable[[], PrewarmedSocket]):
+        with self._lock:
+            if self._thread is not None or self.size <= 0 or self._stopped:
+                return self
+            self._thread = threading.Thread(target=self._refill_loop, args=(name, build_socket), daemon=True)
+        self._thread.start()
+        return self
+
+    def get_key(self) -> tuple:
+        return self.size, self.idle_ttl, self.refill_rate
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            while self._sockets:
+                self._sockets.pop().close()
+        self._refill_event.set()
+
+    def acquire(self) -> Optional[PrewarmedSocket]:
+        sock = None
+        with self._lock:
+            while self._sockets:
+                candidate = self._sockets.pop()  # Most recently warmed first, it is the least likely to be closed
+                if self._is_usable(candidate):
+                    sock = candidate
+                    break
+                candidate.close()
+        self._refill_event.set()
+        return sock
+
+    def _is_usable(self, sock: PrewarmedSocket) -> bool:
+        return monotonic() - sock.prewarmed_at < self.idle_ttl and sock.is_alive()
+
+    def _evict_expired(self):
+        with self._lock:
+            while self._sockets and monotonic() - self._sockets[0].prewarmed_at >= self.idle_ttl:
+                self._sockets.popleft().close()
+
+    def _refill_loop(self, name: str, build_socket: Callable[[], PrewarmedSocket]):
+        refill_interval = 1 / self.refill_rate if self.refill_rate > 0 else 0
+        while not self._stopped:
+            self._evict_expired()
+            while len(self._sockets) < self.size:
+                sock = build_socket()
+                try:
+                    sock.prewarm()
+                except socket.error as err:
+                    sock.close()
+                    logger.warning(name, "Can not prewarm a connection: \"{}\".", err)
+                    sleep(1)  # Back off while the proxy is unreachable
+                    break
+                with self._lock:
+                    if self._stopped:
+                        sock.close()
+                        return
+                    self._sockets.append(sock)
+                sleep(refill_interval)
+            self._refill_event.wait(1)
+            self._refill_event.clear()
@@ -2,49 +2,48 @@ from datetime import datetime
 
 from termcolor import colored
 
+from app.server.BatchWriter import BatchWriter
 
-class Logger:
-    def __init__(self, output="", error=True, warning=True, info=True):
+
+class Logger(BatchWriter):
+    def __init__(self, output="", error=True, warning=True, info=True, max_pending=10000):
         self.log_error = error
         self.log_warning = warning
         self.log_info = info
-        self.file = None
-
-        if output != "":
+        super().__init__(output, max_pending)
+
+    def __str__(self):
+        return "Logger"
+
+    def _write_message(self, key, value: str, args: tuple, color="white"):
+        # Only the time is taken on the calling thread, the message is formatted and written by the writer thread
+        self._put((datetime.now(), key, value, args, color))
+
+    def _write_batch(self, messages: list):
+        dropped = self._pop_dropped()
+        if dropped:
+            messages.insert(0, (datetime.now(), self, "{} messages dropped, the log output is too slow.", (dropped,),
+                                "yellow"))
+        lines = []
+        for date, key, value, args, color in messages:
             try:
-                self.file = open(output, 'a')
-            except IOError:
-                raise Exception("Can not access to {}.".format(output))
+                line = "[{}]-[{}]: {}".format(date, key, value.format(*args) if args else value)
+            except Exception as err:
+                line = "[{}]-[{}]: Can not format \"{}\": \"{}\".".format(date, key, value, err)
+            lines.append(line if self.file is not None else colored(line, color))
+        self._write_lines(lines)
 
-    def __del__(self):
-        if self.file is not None:
-            self.file.close()
-
-    def set_output(self,  output: str):
-        if output != "":
-            try:
-                self.file = open(output, 'a')
-            except IOError:
-                raise Exception("Can not access to {}.".format(output))
-
-    def _write_message(self, key: str, value: str, color="white"):
-        message = "[{}]-[{}]: {}".format(str(datetime.now()), key, value)
-        if self.file is not None:
-            self.file.write(message + "\n")
-        else:
-            print(colored(message, color))
-
-    def error(self, key: str, value: str):
+    def error(self, key, value: str, *args):
         if self.log_error:
-            self._write_message(key, value, "red")
+            self._write_message(key, value, args, "red")
 
-    def warning(self, key: str, value: str):
+    def warning(self, key, value: str, *args):
         if self.log_warning:
-            self._write_message(key, value, "yellow")
+            self._write_message(key, value, args, "yellow")
 
-    def info(self, key: str, value: str):
+    def info(self, key, value: str, *args):
         if self.log_info:
-            self._write_message(key, value, "white")
+            self._write_message(key, value, args, "white")
 
 
 logger = Logger()
@@ -0,0 +1,189 @@
+import itertools
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+
+from app.server.AccessLog import CloseReason, TunnelStats, access_log
+from app.server.CircuitBreaker import CircuitState
+from app.server.Link import Link, PriorityLevel
+
+# Upper bounds (seconds) of the histograms buckets
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+CIRCUIT_STATES = [CircuitState.CLOSED, CircuitState.HALF_OPEN, CircuitState.OPEN]
+
+# Each thread always updates the same stripe, the threads sharing a stripe are the only ones waiting for each other
+METRICS_STRIPES = 8
+
+_stripe_ids = itertools.count()
+_thread_stripe = threading.local()
+
+
+def _get_stripe() -> int:
+    try:
+        return _thread_stripe.idx
+    except AttributeError:
+        _thread_stripe.idx = next(_stripe_ids) % METRICS_STRIPES
+        return _thread_stripe.idx
+
+
+class _StripedValues:
+    def __init__(self, size: int):
+        self._locks = [threading.Lock() for _ in range(METRICS_STRIPES)]
+        self._values = [[0] * size for _ in range(METRICS_STRIPES)]
+
+    def _add(self, idx: int, amount, value=None):
+        stripe = _get_stripe()
+        values = self._values[stripe]
+        with self._locks[stripe]:
+            values[idx] += amount
+            if value is not None:
+                values[-1] += value
+
+    def _sum(self) -> list:
+        return [sum(values) for values in zip(*self._values)]
+
+
+class Counter(_StripedValues):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        self._add(0, amount)
+
+    def get(self):
+        return self._sum()[0]
+
+
+class Histogram(_StripedValues):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        # One value per bucket, one for the values above the last bucket and the sum of the values
+        super().__init__(len(buckets) + 2)
+        self.buckets = buckets
+
+    def observe(self, value: float):
+        self._add(bisect_left(self.buckets, value), 1, value)
+
+    def get(self) -> (List[int], int, float):
+        values = self._sum()
+        cumulated = list(itertools.accumulate(values[:-1]))
+        return cumulated, cumulated[-1], values[-1]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join("{}=\"{}\"".format(key, _escape(value)) for key, value in labels.items()) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.accepted = Counter()
+        self.finished = Counter()
+        self.rejected = Counter()
+        self.clients_refused = Counter()
+        self.closed = {close_reason: Counter() for close_reason in CloseReason}
+        self.routing_decisions = {priority_level: Counter() for priority_level in PriorityLevel}
+        self.relay_bytes = {"in": Counter(), "out": Counter()}
+        self.pick_time = Histogram()
+        self.connect_time = Histogram()
+        self.tunnel_duration = Histogram(DURATION_BUCKETS)
+
+    def open_tunnel(self):
+        self.accepted.inc()
+
+    def finish_tunnel(self, stats: TunnelStats):
+        self.finished.inc()
+        if stats.close_reason is not None:
+            self.closed[stats.close_reason].inc()
+        if stats.close_reason == CloseReason.REJECTED:
+            self.rejected.inc()
+        if stats.connect_time is not None:
+            self.connect_time.observe(stats.connect_time)
+        if stats.duration is not None:
+            self.tunnel_duration.observe(stats.duration)
+
+    def render(self, links: List[Link]) -> str:
+        lines = []
+
+        def add(name: str, metric_type: str, description: str, samples: list):
+            lines.append("# HELP pythtrt_{} {}".format(name, description))
+            lines.append("# TYPE pythtrt_{} {}".format(name, metric_type))
+            for labels, value in samples:
+                lines.append("pythtrt_{}{} {}".format(name, _format_labels(labels), value))
+
+        def add_histogram(name: str, description: str, histogram: Histogram):
+            cumulated, count, total = histogram.get()
+            lines.append("# HELP pythtrt_{} {}".format(name, description))
+            lines.append("# TYPE pythtrt_{} histogram".format(name))
+            for bound, value in zip(list(histogram.buckets) + ["+Inf"], cumulated):
+                lines.append("pythtrt_{}_bucket{} {}".format(name, _format_labels({"le": bound}), value))
+            lines.append("pythtrt_{}_sum {}".format(name, total))
+            lines.append("pythtrt_{}_count {}".format(name, count))
+
+        accepted = self.accepted.get()
+        add("connections_accepted_total", "counter", "Client connections accepted.", [({}, accepted)])
+        add("connections_active", "gauge", "Client connections in progress.", [({}, accepted - self.finished.get())])
+        add("connections_rejected_total", "counter", "Requests without any link allowed to handle them.",
+            [({}, self.rejected.get())])
+        add("client_connections_refused_total", "counter", "Client connections closed at once as the client is at its "
+            "limits.", [({}, self.clients_refused.get())])
+        add("tunnels_closed_total", "counter", "Tunnels closed, by reason.",
+            [({"reason": close_reason.value}, counter.get()) for close_reason, counter in self.closed.items()])
+        add("routing_decisions_total", "counter", "Links picked, by priority level of the matching links.",
+            [({"priority": level.value}, counter.get()) for level, counter in self.routing_decisions.items()
+             if level != PriorityLevel.FORBID])
+        add("relay_bytes_total", "counter", "Bytes relayed, in is from the clients.",
+            [({"direction": direction}, counter.get()) for direction, counter in self.relay_bytes.items()])
+        add("access_log_dropped_total", "counter", "Access log records dropped as the output is too slow.",
+            [({}, access_log.dropped)])
+        add_histogram("strategy_pick_seconds", "Time taken by the strategy to pick a link.", self.pick_time)
+        add_histogram("link_connect_seconds", "Time taken to connect to the target through a link.",
+                      self.connect_time)
+        add_histogram("tunnel_duration_seconds", "Duration of the tunnels.", self.tunnel_duration)
+
+        link_labels = [{"id": link_idx, "link": str(link)} for link_idx, link in enumerate(links)]
+        add("link_connections", "gauge", "Connections in progress through the link.",
+            [(labels, link.get_connections_count()) for labels, link in zip(link_labels, links)])
+        add("link_up", "gauge", "Status of the link according to its last check.",
+            [(labels, 1 if link.status else 0) for labels, link in zip(link_labels, links)])
+        add("link_probe_latency_seconds", "gauge", "Latency measured by the last check of the link.",
+            [(labels, link.latency) for labels, link in zip(link_labels, links)])
+        add("link_latency_estimate_seconds", "gauge", "Connect latency estimate used by the latency strategies.",
+            [(labels, round(link.get_latency_estimate(), 6)) for labels, link in zip(link_labels, links)])
+        add("link_circuit_state", "gauge", "State of the circuit breaker of the link: 0 closed, 1 half-open, 2 open.",
+            [(labels, CIRCUIT_STATES.index(link.circuit_breaker.get_state())) for labels, link in
+             zip(link_labels, links)])
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(domain: str, port: int, get_links: Callable[[], List[Link]]) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render(get_links()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    metrics_server = ThreadingHTTPServer((domain, port), MetricsHandler)
+    metrics_server.daemon_threads = True
+    threading.Thread(target=metrics_server.serve_forever, name="Metrics", daemon=True).start()
+    return metrics_server
+
+
+metrics = Metrics()
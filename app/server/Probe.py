@@ -0,0 +1,112 @@
+import socket
+import threading
+from enum import Enum
+from time import monotonic
+from typing import Callable, Hashable, Optional
+
+import socks
+
+TEST_ADDRESS = "example.org"
+TEST_PORT = 80
+
+
+class ProbeType(str, Enum):
+    TCP = "tcp"
+    SOCKS = "socks"
+    HTTP = "http"
+
+
+class Probe:
+    OBJECT_SERIALIZATION_DATA = [
+        ("type", "type", ProbeType, False),
+        ("host", "host", str, False),
+        ("port", "port", int, False),
+        ("path", "path", str, False),
+        ("cache_ttl", "cache_ttl", int, False)
+    ]
+
+    def __init__(self, probe_type=ProbeType.HTTP, host=TEST_ADDRESS, port=TEST_PORT, path="/", cache_ttl=5):
+        self.type = probe_type
+        self.host = host
+        self.port = port
+        self.path = path
+        self.cache_ttl = cache_ttl
+
+    def __str__(self):
+        if self.type == ProbeType.SOCKS:
+            return "Probe:{}".format(self.type.value)
+        return "Probe:{},{}:{}".format(self.type.value, self.host, self.port)
+
+    def get_key(self) -> tuple:
+        return self.type, self.host, self.port, self.path
+
+    def measure(self, sock: socks.socksocket, connect: Optional[Callable[[tuple], socks.socksocket]] = None) -> float:
+        s_time = monotonic()
+        proxy_type, proxy_addr, proxy_port = sock.proxy[:3]
+        if self.type == ProbeType.SOCKS and proxy_type is not None:
+            # Only the proxy itself is checked, no connection is made to a remote host
+            socket.socket.connect(sock, (proxy_addr, proxy_port))
+            if proxy_type == socks.SOCKS5:
+                sock.sendall(b'\x05\x01\x00')
+                if sock.recv(2) != b'\x05\x00':
+                    raise socks.GeneralProxyError("SOCKS5 proxy server refused the no authentication method")
+        else:
+            if connect is not None:
+                sock = connect((self.host, self.port))
+            else:
+                sock.connect((self.host, self.port))
+            if self.type == ProbeType.HTTP:
+                sock.sendall(str.encode("GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(
+                    self.path, self.host)))
+                if not sock.recv(1024):
+                    raise socks.GeneralProxyError("Connection closed before any HTTP response.")
+        return round(monotonic() - s_time, 3)
+
+
+class ProbeResults:
+    # Links sharing the same upstream share the result of a probe for cache_ttl seconds, concurrent probes of the
+    # same upstream wait for the one in progress instead of running again
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+        self._running = {}
+
+    def get_or_run(self, key: Hashable, ttl: float, run: Callable[[], float]) -> float:
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and monotonic() - result[0] < ttl:
+                return self._unwrap(result)
+            event = self._running.get(key)
+            is_owner = event is None
+            if is_owner:
+                event = threading.Event()
+                self._running[key] = event
+
+        if not is_owner:
+            event.wait()
+            with self._lock:
+                return self._unwrap(self._results[key])
+
+        try:
+            result = (monotonic(), run(), None)
+        except Exception as err:
+            result = (monotonic(), 0, err)
+        with self._lock:
+            self._results[key] = result
+            del self._running[key]
+        event.set()
+        return self._unwrap(result)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    @staticmethod
+    def _unwrap(result: tuple) -> float:
+        _, latency, error = result
+        if error is not None:
+            raise error
+        return latency
+
+
+probe_results = ProbeResults()
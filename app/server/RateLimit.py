@@ -0,0 +1,138 @@
+import threading
+from time import monotonic
+from typing import Optional
+
+# Clients without connection left are forgotten once there are more than this number of them
+CLIENT_LIMITER_SIZE = 4096
+
+
+class TokenBucket:
+    # Filled with rate tokens per second up to burst tokens, a consume can go below zero and the debt is the time the
+    # caller has to wait for
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst else rate
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._time = monotonic()
+
+    def __str__(self):
+        return "TokenBucket:{}/s".format(self.rate)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._time) * self.rate)
+        self._time = now
+
+    def has_tokens(self, tokens=1) -> bool:
+        return min(self.burst, self._tokens + (monotonic() - self._time) * self.rate) >= tokens
+
+    def try_consume(self, tokens=1) -> bool:
+        with self._lock:
+            self._refill(monotonic())
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def consume(self, tokens: float) -> float:
+        # Returns the time (seconds) to wait before going on
+        with self._lock:
+            self._refill(monotonic())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def is_full(self) -> bool:
+        return self.has_tokens(self.burst)
+
+
+class LinkLimits:
+    OBJECT_SERIALIZATION_DATA = [
+        ("max_connections", "max_connections", int, False),
+        ("connections_per_second", "connections_per_second", int, False),
+        ("bytes_per_second", "bytes_per_second", int, False)
+    ]
+
+    # A limit set to 0 is not applied
+    def __init__(self, max_connections=0, connections_per_second=0, bytes_per_second=0):
+        self.max_connections = max_connections
+        self.connections_per_second = connections_per_second
+        self.bytes_per_second = bytes_per_second
+        self.connections_bucket = None
+        self.bandwidth_bucket = None
+        self.serializer_update_object()
+
+    def __str__(self):
+        return "LinkLimits:{},{}/s,{}B/s".format(self.max_connections, self.connections_per_second,
+                                                 self.bytes_per_second)
+
+    def get_key(self) -> tuple:
+        return self.max_connections, self.connections_per_second, self.bytes_per_second
+
+    def serializer_update_object(self):
+        self.connections_bucket = TokenBucket(self.connections_per_second) if self.connections_per_second else None
+        self.bandwidth_bucket = TokenBucket(self.bytes_per_second) if self.bytes_per_second else None
+
+    def has_capacity(self, connections_count: int) -> bool:
+        if self.max_connections and connections_count >= self.max_connections:
+            return False
+        return self.connections_bucket is None or self.connections_bucket.has_tokens()
+
+    def try_open(self, connections_count: int) -> bool:
+        if self.max_connections and connections_count >= self.max_connections:
+            return False
+        return self.connections_bucket is None or self.connections_bucket.try_consume()
+
+
+class ClientLimiter:
+    # Concurrent connections and new connections per second of each client IP address, a limit set to 0 is not applied
+    def __init__(self, max_connections=0, connections_per_second=0):
+        self.max_connections = max_connections
+        self.connections_per_second = connections_per_second
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def __str__(self):
+        return "ClientLimiter:{},{}/s".format(self.max_connections, self.connections_per_second)
+
+    def is_enabled(self) -> bool:
+        return bool(self.max_connections or self.connections_per_second)
+
+    def acquire(self, client_ip: str) -> bool:
+        if not self.is_enabled():
+            return True
+        with self._lock:
+            client = self._clients.get(client_ip)
+            if client is None:
+                if len(self._clients) >= CLIENT_LIMITER_SIZE:
+                    self._prune()
+                bucket = TokenBucket(self.connections_per_second) if self.connections_per_second else None
+                client = self._clients[client_ip] = [0, bucket]
+            if self.max_connections and client[0] >= self.max_connections:
+                return False
+            if client[1] is not None and not client[1].try_consume():
+                return False
+            client[0] += 1
+            return True
+
+    def release(self, client_ip: str):
+        if not self.is_enabled():
+            return
+        with self._lock:
+            client = self._clients.get(client_ip)
+            if client is None:
+                return
+            client[0] -= 1
+            if client[0] <= 0 and client[1] is None:
+                del self._clients[client_ip]
+
+    def get_connections_count(self, client_ip: str) -> int:
+        client = self._clients.get(client_ip)
+        return client[0] if client is not None else 0
+
+    def _prune(self):
+        # The clients with a full bucket would be recreated the same
+        for client_ip in [client_ip for client_ip, (count, bucket) in self._clients.items() if
+                          count <= 0 and (bucket is None or bucket.is_full())]:
+            del self._clients[client_ip]
@@ -0,0 +1,160 @@
+import os
+import selectors
+import socket
+from enum import Enum
+from time import monotonic, sleep
+from typing import Callable, Optional
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Metrics import metrics
+from app.server.RateLimit import TokenBucket
+
+RELAY_BUFFER_SIZE = 65536
+
+
+class RelayMode(str, Enum):
+    BUFFERED = "buffered"
+    SPLICE = "splice"
+
+
+def is_splice_supported() -> bool:
+    return hasattr(os, "splice")
+
+
+def _shutdown_write(sock: socket):
+    try:
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+def shutdown_sockets(*socks: socket):
+    # Ends the relay of a tunnel from another thread: the blocked calls return at once
+    for sock in socks:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _wait_writable(sock: socket):
+    # select.select fails on the descriptors above 1024, which a busy server reaches
+    with selectors.DefaultSelector() as selector:
+        selector.register(sock, selectors.EVENT_WRITE)
+        selector.select()
+
+
+def _register_readers(readers: list) -> selectors.BaseSelector:
+    # Both sockets are registered once per tunnel, whatever the value of their descriptor
+    selector = selectors.DefaultSelector()
+    for sock in readers:
+        selector.register(sock, selectors.EVENT_READ)
+    return selector
+
+
+def _wait_throttle(throttle: Optional[TokenBucket], received: int):
+    # The relay of the tunnel is paused until the bandwidth it used is refilled
+    if throttle is not None:
+        delay = throttle.consume(received)
+        if delay > 0:
+            sleep(delay)
+
+
+def _set_close_reason(stats: Optional[TunnelStats], readers: list):
+    # The relays have no timeout of their own: the idle and lifetime limits shut the sockets down and set the reason
+    if stats is not None:
+        stats.close(CloseReason.EOF if not readers else CloseReason.STOPPED)
+
+
+def relay_buffered(socket_client: socket, socket_link: socket, is_stopped: Callable[[], bool],
+                   stats: Optional[TunnelStats] = None, throttle: Optional[TokenBucket] = None):
+    # A single buffer is enough as every chunk is fully sent before the next one is received
+    buffer = memoryview(bytearray(RELAY_BUFFER_SIZE))
+    peers = {socket_client: socket_link, socket_link: socket_client}
+    readers = [socket_client, socket_link]
+    selector = _register_readers(readers)
+    # The counters are updated as the chunks are relayed, the stats of the tunnel once it is closed
+    relayed_in, relayed_out = metrics.relay_bytes["in"], metrics.relay_bytes["out"]
+    bytes_in = bytes_out = 0
+    try:
+        while readers and not is_stopped():
+            for key, _ in selector.select():
+                sock = key.fileobj
+                try:
+                    received = sock.recv_into(buffer)
+                except BlockingIOError:
+                    continue
+                if not received:
+                    # Half-close: forward the EOF and keep relaying the other direction
+                    readers.remove(sock)
+                    selector.unregister(sock)
+                    _shutdown_write(peers[sock])
+                    continue
+                _wait_throttle(throttle, received)
+                peers[sock].sendall(buffer[:received])
+                if sock is socket_client:
+                    bytes_in += received
+                    relayed_in.inc(received)
+                else:
+                    bytes_out += received
+                    relayed_out.inc(received)
+                if stats is not None:
+                    stats.last_activity = monotonic()
+        _set_close_reason(stats, readers)
+    finally:
+        selector.close()
+        if stats is not None:
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+
+
+def relay_splice(socket_client: socket, socket_link: socket, is_stopped: Callable[[], bool],
+                 stats: Optional[TunnelStats] = None, throttle: Optional[TokenBucket] = None):
+    # Payload bytes go socket -> pipe -> socket inside the kernel and never reach Python
+    pipes = {}
+    selector = None
+    relayed_in, relayed_out = metrics.relay_bytes["in"], metrics.relay_bytes["out"]
+    bytes_in = bytes_out = 0
+    try:
+        for sock in (socket_client, socket_link):
+            pipes[sock] = os.pipe()
+        peers = {socket_client: socket_link, socket_link: socket_client}
+        readers = [socket_client, socket_link]
+        selector = _register_readers(readers)
+        while readers and not is_stopped():
+            for key, _ in selector.select():
+                sock = key.fileobj
+                pipe_read, pipe_write = pipes[sock]
+                try:
+                    pending = os.splice(sock.fileno(), pipe_write, RELAY_BUFFER_SIZE, flags=os.SPLICE_F_MOVE)
+                except BlockingIOError:
+                    continue
+                if not pending:
+                    readers.remove(sock)
+                    selector.unregister(sock)
+                    _shutdown_write(peers[sock])
+                    continue
+                if sock is socket_client:
+                    bytes_in += pending
+                    relayed_in.inc(pending)
+                else:
+                    bytes_out += pending
+                    relayed_out.inc(pending)
+                _wait_throttle(throttle, pending)
+                while pending:
+                    try:
+                        pending -= os.splice(pipe_read, peers[sock].fileno(), pending, flags=os.SPLICE_F_MOVE)
+                    except BlockingIOError:
+                        _wait_writable(peers[sock])
+                if stats is not None:
+                    stats.last_activity = monotonic()
+        _set_close_reason(stats, readers)
+    finally:
+        if selector is not None:
+            selector.close()
+        if stats is not None:
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+        for pipe_read, pipe_write in pipes.values():
+            os.close(pipe_read)
+            os.close(pipe_write)
@@ -0,0 +1,231 @@
+import selectors
+import socket
+import threading
+from queue import Queue, Empty
+from time import monotonic
+from typing import Callable, Optional, List
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Logger import logger
+from app.server.Metrics import metrics
+from app.server.RateLimit import TokenBucket
+from app.server.Relay import RELAY_BUFFER_SIZE
+
+
+class _Tunnel:
+    __slots__ = ("client", "peers", "pending", "eof", "registered", "on_close", "stats", "throttle", "resume_time")
+
+    def __init__(self, socket_client: socket, socket_link: socket, on_close: Callable[[], None],
+                 stats: Optional[TunnelStats] = None, throttle: Optional[TokenBucket] = None):
+        self.client = socket_client
+        self.peers = {socket_client: socket_link, socket_link: socket_client}
+        # Bytes received from the peer which could not be sent yet to the key socket
+        self.pending = {socket_client: b'', socket_link: b''}
+        self.eof = set()
+        self.registered = set()
+        self.on_close = on_close
+        self.stats = stats if stats is not None else TunnelStats()
+        self.stats.last_activity = monotonic()
+        self.throttle = throttle
+        # Nothing is received until then once the tunnel used up the bandwidth of its link
+        self.resume_time = 0
+
+
+class RelayWorker:
+    def __init__(self, name: str, is_stopped: Callable[[], bool]):
+        self._name = name
+        self._is_stopped = is_stopped
+        self._selector = selectors.DefaultSelector()
+        self._buffer = memoryview(bytearray(RELAY_BUFFER_SIZE))
+        self._new_tunnels = Queue()
+        self._tunnels = set()
+        self._throttled_tunnels = set()
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+
+    def __str__(self):
+        return "RelayWorker:{}".format(self._name)
+
+    def __len__(self):
+        return len(self._tunnels) + self._new_tunnels.qsize()
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, tunnel: _Tunnel):
+        self._new_tunnels.put(tunnel)
+        try:
+            self._wakeup_write.send(b'\x00')
+        except BlockingIOError:
+            pass  # A wake up is already pending
+
+    def _loop(self):
+        while not self._is_stopped():
+            for key, mask in self._selector.select(self._get_select_timeout()):
+                if key.fileobj is self._wakeup_read:
+                    self._accept_new_tunnels()
+                    continue
+                tunnel = key.data
+                sock = key.fileobj
+                if tunnel not in self._tunnels:
+                    continue  # Closed earlier in this iteration
+                try:
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush(tunnel, sock)
+                    if mask & selectors.EVENT_READ:
+                        self._receive(tunnel, sock)
+                    self._update(tunnel)
+                except OSError as err:
+                    logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
+                    self._close(tunnel, CloseReason.ERROR)
+            self._resume_throttled_tunnels()
+
+        self._accept_new_tunnels()
+        for tunnel in list(self._tunnels):
+            self._close(tunnel, CloseReason.STOPPED)
+        self._selector.close()
+        self._wakeup_read.close()
+        self._wakeup_write.close()
+
+    def _get_select_timeout(self) -> float:
+        if not self._throttled_tunnels:
+            return 1
+        return min(max(min(tunnel.resume_time for tunnel in self._throttled_tunnels) - monotonic(), 0), 1)
+
+    def _resume_throttled_tunnels(self):
+        now = monotonic()
+        for tunnel in [tunnel for tunnel in self._throttled_tunnels if tunnel.resume_time <= now]:
+            self._throttled_tunnels.discard(tunnel)
+            tunnel.resume_time = 0
+            tunnel.stats.last_activity = now
+            try:
+                self._update(tunnel)
+            except OSError as err:
+                logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
+                self._close(tunnel, CloseReason.ERROR)
+
+    def _accept_new_tunnels(self):
+        try:
+            while self._wakeup_read.recv(RELAY_BUFFER_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                tunnel = self._new_tunnels.get_nowait()
+            except Empty:
+                return
+            self._tunnels.add(tunnel)
+            try:
+                for sock in tunnel.peers:
+                    sock.setblocking(False)
+                self._update(tunnel)
+            except (OSError, ValueError) as err:
+                logger.error(self, "Cannot relay the connection: \"{}\".", err)
+                self._close(tunnel, CloseReason.ERROR)
+
+    def _receive(self, tunnel: _Tunnel, sock: socket):
+        try:
+            received = sock.recv_into(self._buffer)
+        except BlockingIOError:
+            return
+        peer = tunnel.peers[sock]
+        if not received:
+            # Half-close: forward the EOF once everything received before it is sent
+            tunnel.eof.add(sock)
+            if not tunnel.pending[peer]:
+                self._shutdown_write(peer)
+            return
+        tunnel.stats.last_activity = monotonic()
+        if sock is tunnel.client:
+            tunnel.stats.bytes_in += received
+            metrics.relay_bytes["in"].inc(received)
+        else:
+            tunnel.stats.bytes_out += received
+            metrics.relay_bytes["out"].inc(received)
+        if tunnel.throttle is not None:
+            delay = tunnel.throttle.consume(received)
+            if delay > 0:
+                tunnel.resume_time = monotonic() + delay
+                self._throttled_tunnels.add(tunnel)
+        try:
+            sent = peer.send(self._buffer[:received])
+        except BlockingIOError:
+            sent = 0
+        if sent < received:
+            tunnel.pending[peer] = bytes(self._buffer[sent:received])
+
+    def _flush(self, tunnel: _Tunnel, sock: socket):
+        try:
+            sent = sock.send(tunnel.pending[sock])
+        except BlockingIOError:
+            return
+        tunnel.pending[sock] = tunnel.pending[sock][sent:]
+        tunnel.stats.last_activity = monotonic()
+        if not tunnel.pending[sock] and tunnel.peers[sock] in tunnel.eof:
+            self._shutdown_write(sock)
+
+    def _update(self, tunnel: _Tunnel):
+        if tunnel not in self._tunnels:
+            return
+        if len(tunnel.eof) == len(tunnel.peers) and not any(tunnel.pending.values()):
+            self._close(tunnel, CloseReason.EOF)
+            return
+        for sock, peer in tunnel.peers.items():
+            events = 0
+            if sock not in tunnel.eof and not tunnel.pending[peer] and not tunnel.resume_time:
+                events |= selectors.EVENT_READ
+            if tunnel.pending[sock]:
+                events |= selectors.EVENT_WRITE
+            if not events:
+                if sock in tunnel.registered:
+                    self._selector.unregister(sock)
+                    tunnel.registered.discard(sock)
+            elif sock in tunnel.registered:
+                self._selector.modify(sock, events, tunnel)
+            else:
+                self._selector.register(sock, events, tunnel)
+                tunnel.registered.add(sock)
+
+    def _close(self, tunnel: _Tunnel, close_reason: CloseReason):
+        if tunnel not in self._tunnels:
+            return
+        self._tunnels.discard(tunnel)
+        self._throttled_tunnels.discard(tunnel)
+        tunnel.stats.close(close_reason)
+        for sock in tunnel.registered:
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+        tunnel.registered.clear()
+        try:
+            tunnel.on_close()
+        except OSError as err:
+            logger.error(self, "Error while closing the connection: \"{}\".", err)
+
+    @staticmethod
+    def _shutdown_write(sock: socket):
+        try:
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class RelayPool:
+    def __init__(self, workers: int, is_stopped: Callable[[], bool]):
+        self._workers: List[RelayWorker] = [RelayWorker(str(idx), is_stopped) for idx in range(workers)]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        return self
+
+    def add(self, socket_client: socket, socket_link: socket, on_close: Callable[[], None],
+            stats: Optional[TunnelStats] = None, throttle: Optional[TokenBucket] = None):
+        # The idle and lifetime limits are applied by the TunnelTimeouts of the server, which shuts the sockets down
+        worker = min(self._workers, key=len)
+        worker.add(_Tunnel(socket_client, socket_link, on_close, stats, throttle))
@@ -8,9 +8,11 @@ class DomainType(str, Enum):
 
 
 class Request:
-    def __init__(self, domain: str, port: int):
+    def __init__(self, domain: str, port: int, client=""):
         self.domain = domain
         self.port = port
+        # IP address of the client, used by the affinity
+        self.client = client
 
     def __str__(self):
         return "{}:{}".format(self.domain, self.port)
@@ -0,0 +1,173 @@
+import errno
+import ipaddress
+import os
+import selectors
+import socket
+import threading
+from collections import OrderedDict
+from enum import Enum
+from time import monotonic
+from typing import Callable, List, Optional
+
+# Delay before the connection to the next address is started while the previous one is still in progress (RFC 8305)
+HAPPY_EYEBALLS_DELAY = 0.25
+
+
+class ResolverMode(str, Enum):
+    SYSTEM = "system"
+    CACHED = "cached"
+
+
+class Resolver:
+    # Names are resolved with getaddrinfo which does not return the TTL of the records, so a fixed TTL is used.
+    # Concurrent lookups of the same name wait for the one in progress.
+    def __init__(self, ttl=60, negative_ttl=5, size=4096):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._running = {}
+
+    def __str__(self):
+        return "Resolver:{}".format(len(self._entries))
+
+    def resolve(self, host: str, port: int) -> List[tuple]:
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            pass
+        else:
+            if ip.version == 6:
+                return [(socket.AF_INET6, (host, port, 0, 0))]
+            return [(socket.AF_INET, (host, port))]
+
+        return [(family, (address[0], port) + address[2:]) for family, address in self._get_addresses(host)]
+
+    def _get_addresses(self, host: str) -> List[tuple]:
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is not None and entry[0] > monotonic():
+                self._entries.move_to_end(host)
+                self.hits += 1
+                return self._unwrap(entry)
+            self.misses += 1
+            event = self._running.get(host)
+            is_owner = event is None
+            if is_owner:
+                event = threading.Event()
+                self._running[host] = event
+
+        if not is_owner:
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(host)
+            if entry is None:
+                raise socket.gaierror(socket.EAI_AGAIN, "Resolution of {} was evicted.".format(host))
+            return self._unwrap(entry)
+
+        try:
+            entry = (monotonic() + self.ttl, self._lookup(host), None)
+        except socket.gaierror as err:
+            entry = (monotonic() + self.negative_ttl, [], err)
+        with self._lock:
+            if self.size > 0:
+                self._entries[host] = entry
+                self._entries.move_to_end(host)
+                if len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+            del self._running[host]
+        event.set()
+        return self._unwrap(entry)
+
+    @staticmethod
+    def _lookup(host: str) -> List[tuple]:
+        addresses = []
+        for family, _, _, _, address in socket.getaddrinfo(host, 0, type=socket.SOCK_STREAM):
+            if family in (socket.AF_INET, socket.AF_INET6) and (family, address) not in addresses:
+                addresses.append((family, address))
+        return addresses
+
+    @staticmethod
+    def _unwrap(entry: tuple) -> List[tuple]:
+        _, addresses, error = entry
+        if error is not None:
+            raise error
+        return addresses
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def interleave_families(addresses: List[tuple]) -> List[tuple]:
+    # The first family returned by getaddrinfo is the preferred one, then the families alternate
+    if not addresses:
+        return []
+    first_family = addresses[0][0]
+    preferred = [address for address in addresses if address[0] == first_family]
+    others = [address for address in addresses if address[0] != first_family]
+    interleaved = []
+    for idx in range(max(len(preferred), len(others))):
+        interleaved.extend(addresses[idx] for addresses in (preferred, others) if idx < len(addresses))
+    return interleaved
+
+
+def connect_happy_eyeballs(addresses: List[tuple], build_socket: Callable[[int], socket.socket],
+                           timeout: Optional[float], delay=HAPPY_EYEBALLS_DELAY) -> socket.socket:
+    # The connections to the next addresses are started one after the other without waiting for the previous ones to
+    # fail, the first one established is kept and the others are closed
+    remaining = interleave_families(addresses)
+    deadline = monotonic() + timeout if timeout else None
+    next_attempt = monotonic()
+    last_error = None
+    pending = {}
+    selector = selectors.DefaultSelector()
+    try:
+        while remaining or pending:
+            now = monotonic()
+            if deadline is not None and now >= deadline:
+                raise socket.timeout("Timed out while connecting to {}.".format(addresses[0][1][0]))
+
+            if remaining and (now >= next_attempt or not pending):
+                family, address = remaining.pop(0)
+                sock = build_socket(family)
+                socket.socket.setblocking(sock, False)
+                error = socket.socket.connect_ex(sock, address)
+                if error in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                    pending[sock] = address
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    next_attempt = now + delay
+                else:
+                    sock.close()
+                    last_error = OSError(error, os.strerror(error))
+                continue
+
+            wait = None
+            if remaining:
+                wait = max(next_attempt - now, 0)
+            if deadline is not None:
+                wait = deadline - now if wait is None else min(wait, deadline - now)
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                address = pending.pop(sock)
+                selector.unregister(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error == 0:
+                    socket.socket.setblocking(sock, True)
+                    sock.settimeout(timeout)
+                    return sock
+                sock.close()
+                last_error = OSError(error, os.strerror(error))
+                # A failure starts the next attempt at once
+                next_attempt = monotonic()
+        raise last_error if last_error is not None else OSError("No address to connect to.")
+    finally:
+        for sock in pending:
+            sock.close()
+        selector.close()
+
+
+resolver = Resolver()
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class RoutingCache:
+    def __init__(self, size=4096):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, entry: tuple, generation: int):
+        with self._lock:
+            # The entry was computed before an invalidation, it may be stale
+            if generation != self._generation or self.size <= 0:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
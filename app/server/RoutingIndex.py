@@ -0,0 +1,134 @@
+import re
+from typing import List, Optional
+
+from app.server.Link import Link
+from app.server.Request import Request
+from app.server.RequestMatcher import Policy, RequestMatcher
+
+
+class _DomainPredicate:
+    __slots__ = ("_regex", "_regexes")
+
+    def __init__(self, domains_re_str: tuple):
+        self._regex = None
+        self._regexes = None
+        try:
+            # A matcher matches when any of its patterns matches, which is what an alternation does in one pass
+            self._regex = re.compile("|".join("(?:{})".format(domain_re_str) for domain_re_str in domains_re_str))
+        except re.error:
+            # Some patterns (global inline flags for instance) can not be combined
+            self._regexes = [re.compile(domain_re_str) for domain_re_str in domains_re_str]
+
+    def match(self, domain: str) -> bool:
+        if self._regex is not None:
+            return self._regex.match(domain) is not None
+        return any(regex.match(domain) for regex in self._regexes)
+
+
+class _LinkMasks:
+    __slots__ = ("link", "allow", "forbid", "prioritize", "deprioritize")
+
+    def __init__(self, link: Link):
+        self.link = link
+        self.allow = 0
+        self.forbid = 0
+        self.prioritize = 0
+        self.deprioritize = 0
+
+
+class RoutingIndex:
+    # Every distinct (ports, domains) matcher of the balancer and of its links becomes one bit. A request is evaluated
+    # once into a bitmask of matching matchers, then each policy check is a single AND with a precomputed mask.
+    def __init__(self, request_matchers: List[RequestMatcher], links: List[Link]):
+        self._bit_by_key = {}
+        self._domain_predicates = {}
+        self._domain_by_bit = {}
+        self._domain_bits = 0
+        self._bits_by_port = {}
+        self._any_port_bits = 0
+        self._accept_allow = 0
+        self._accept_forbid = 0
+        self._links = []
+
+        for request_matcher in request_matchers:
+            bit = self._add_matcher(request_matcher)
+            if request_matcher.policy == Policy.ALLOW:
+                self._accept_allow |= bit
+            elif request_matcher.policy == Policy.FORBID:
+                self._accept_forbid |= bit
+
+        for link in links:
+            masks = _LinkMasks(link)
+            for request_matcher in link.get_request_matchers():
+                bit = self._add_matcher(request_matcher)
+                if request_matcher.policy == Policy.ALLOW:
+                    masks.allow |= bit
+                elif request_matcher.policy == Policy.FORBID:
+                    masks.forbid |= bit
+                elif request_matcher.policy == Policy.PRIORITIZE:
+                    masks.prioritize |= bit
+                elif request_matcher.policy == Policy.DEPRIORITIZE:
+                    masks.deprioritize |= bit
+            self._links.append(masks)
+
+        for bit in self._domain_by_bit:
+            self._domain_bits |= bit
+
+    def _add_matcher(self, request_matcher: RequestMatcher) -> int:
+        ports = frozenset(request_matcher.ports)
+        domains_re_str = tuple(request_matcher.domains_re_str)
+        key = (ports, domains_re_str)
+        if key in self._bit_by_key:
+            return self._bit_by_key[key]
+
+        bit = 1 << len(self._bit_by_key)
+        self._bit_by_key[key] = bit
+        if ports:
+            for port in ports:
+                self._bits_by_port[port] = self._bits_by_port.get(port, 0) | bit
+        else:
+            self._any_port_bits |= bit
+        if domains_re_str:
+            if domains_re_str not in self._domain_predicates:
+                self._domain_predicates[domains_re_str] = _DomainPredicate(domains_re_str)
+            self._domain_by_bit[bit] = self._domain_predicates[domains_re_str]
+        return bit
+
+    def match(self, request: Request) -> int:
+        matching = self._bits_by_port.get(request.port, 0) | self._any_port_bits
+        to_check = matching & self._domain_bits
+        # Matchers sharing the same patterns are evaluated once
+        results = {}
+        while to_check:
+            bit = to_check & -to_check
+            to_check ^= bit
+            predicate = self._domain_by_bit[bit]
+            if predicate not in results:
+                results[predicate] = predicate.match(request.domain)
+            if not results[predicate]:
+                matching ^= bit
+        return matching
+
+    def should_accept_request(self, request: Request, matching: Optional[int] = None) -> bool:
+        if matching is None:
+            matching = self.match(request)
+        return not (self._accept_allow & ~matching) and not (self._accept_forbid & matching)
+
+    def get_link_ids_for_request(self, request: Request, matching: Optional[int] = None) -> (list, list, list):
+        if matching is None:
+            matching = self.match(request)
+        high_priority = []
+        normal_priority = []
+        low_priority = []
+        for link_id, masks in enumerate(self._links):
+            if not masks.link.is_available() or masks.allow & ~matching or masks.forbid & matching:
+                continue
+            is_prioritized = bool(masks.prioritize & matching)
+            is_deprioritized = bool(masks.deprioritize & matching)
+            if is_prioritized == is_deprioritized:
+                normal_priority.append(link_id)
+            elif is_prioritized:
+                high_priority.append(link_id)
+            else:
+                low_priority.append(link_id)
+        return high_priority, normal_priority, low_priority
@@ -0,0 +1,35 @@
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+
+class SharedLinkState:
+    # Created before the worker processes are forked so that every worker maps the same memory
+    def __init__(self, links_count: int):
+        context = multiprocessing.get_context("fork")
+        self._status = RawArray('b', [1] * links_count)
+        self._connections = RawArray('l', links_count)
+        self._locks = [context.Lock() for _ in range(links_count)]
+        # Incremented on every status change so that the processes can invalidate what they derived from it
+        self._status_version = RawValue('l', 0)
+
+    def __len__(self):
+        return len(self._status)
+
+    def get_status(self, idx: int) -> bool:
+        return bool(self._status[idx])
+
+    def set_status(self, idx: int, status: bool):
+        value = 1 if status else 0
+        if self._status[idx] != value:
+            self._status[idx] = value
+            self._status_version.value += 1
+
+    def get_status_version(self) -> int:
+        return self._status_version.value
+
+    def get_connections_count(self, idx: int) -> int:
+        return self._connections[idx]
+
+    def add_connections(self, idx: int, count: int):
+        with self._locks[idx]:
+            self._connections[idx] += count
@@ -0,0 +1,215 @@
+import ipaddress
+import socket
+from enum import Enum
+from struct import pack, unpack
+from typing import Callable, Optional
+
+
+class SocksCommand(Enum):
+    CONNECT = b'\x01'
+    BIND = b'\x02'
+    UDP_ASSOCIATE = b'\x03'
+
+
+class SocksAddressType(Enum):
+    IPV4 = b'\x01'
+    DOMAINNAME = b'\x03'
+    IPV6 = b'\x04'
+
+
+class SocksMethod(Enum):
+    NO_AUTH = b'\x00'
+    GSAPI = b'\x01'
+    USERNAME_PASSWORD = b'\x02'
+    NO_ACCEPTABLE_METHODS = b'\xff'
+
+
+class SocksReply(Enum):
+    SUCCEEDED = b'\x00'
+    SERVER_FAILURE = b'\x01'
+    CONNECTION_NOT_ALOWED = b'\x02'
+    NETWORK_UNREACHABLE = b'\x03'
+    HOST_UNREACHABLE = b'\x04'
+    CONNECTION_REFUSED = b'\x05'
+    TTL_EXPIRED = b'\x06'
+    COMMAND_NOT_SUPPORTED = b'\x07'
+    ADDRESS_TYPE_NOT_SUPPORTED = b'\x08'
+
+
+def build_chosen_method_packet(method: SocksMethod) -> bytes:
+    return b'\x05' + method.value
+
+
+def build_reply_packet(reply: SocksReply, address: Optional[tuple] = None) -> bytes:
+    if address is not None:
+        return b'\x05' + reply.value + b'\x00' + _encode_address(*address[:2])
+    return b'\x05' + reply.value + b'\x00' + SocksAddressType.IPV4.value + \
+           b'\x00' + b'\x00' + b'\x00' + b'\x00' + \
+           b'\x00' + b'\x00'
+
+
+def _encode_address(host: str, port: int) -> bytes:
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        domain = host.encode()
+        return SocksAddressType.DOMAINNAME.value + bytes([len(domain)]) + domain + pack('>H', port)
+    address_type = SocksAddressType.IPV4 if ip.version == 4 else SocksAddressType.IPV6
+    return address_type.value + ip.packed + pack('>H', port)
+
+
+def _decode_address(atyp: int, address: bytes) -> str:
+    if atyp == ord(SocksAddressType.IPV4.value):
+        return socket.inet_ntop(socket.AF_INET, address)
+    if atyp == ord(SocksAddressType.IPV6.value):
+        return socket.inet_ntop(socket.AF_INET6, address)
+    try:
+        return address.decode()
+    except UnicodeDecodeError:
+        raise SocksError("Malformed SOCKS address with an invalid domain.")
+
+
+def build_request_packet(command: SocksCommand, address: tuple) -> bytes:
+    # Request sent to an upstream SOCKS5 proxy
+    return b'\x05' + command.value + b'\x00' + _encode_address(*address[:2])
+
+
+def read_address(atyp: int, read: Callable[[int], bytes]) -> (str, int):
+    # Address of a reply of an upstream SOCKS5 proxy, read field by field from the socket
+    if atyp == ord(SocksAddressType.IPV4.value):
+        address = read(4)
+    elif atyp == ord(SocksAddressType.IPV6.value):
+        address = read(16)
+    elif atyp == ord(SocksAddressType.DOMAINNAME.value):
+        address = read(read(1)[0])
+    else:
+        raise SocksError("SOCKS address type '{}' not supported.".format(atyp))
+    return _decode_address(atyp, address), unpack('>H', read(2))[0]
+
+
+def build_udp_datagram(address: tuple, payload: bytes) -> bytes:
+    # https://tools.ietf.org/html/rfc1928#section-7
+    return b'\x00\x00\x00' + _encode_address(*address[:2]) + payload
+
+
+def parse_udp_datagram(datagram: bytes) -> (str, int, bytes):
+    if len(datagram) < 4:
+        raise SocksError("Malformed SOCKS UDP datagram.")
+    if datagram[2] != 0:
+        raise SocksError("Fragmented SOCKS UDP datagrams are not supported.")
+    atyp = datagram[3]
+    if atyp == ord(SocksAddressType.IPV4.value):
+        address_start, address_length = 4, 4
+    elif atyp == ord(SocksAddressType.IPV6.value):
+        address_start, address_length = 4, 16
+    elif atyp == ord(SocksAddressType.DOMAINNAME.value) and len(datagram) > 4 and datagram[4]:
+        address_start, address_length = 5, datagram[4]
+    else:
+        raise SocksError("Malformed SOCKS UDP datagram.")
+    payload_start = address_start + address_length + 2
+    if len(datagram) < payload_start:
+        raise SocksError("Malformed SOCKS UDP datagram.")
+    domain = _decode_address(atyp, datagram[address_start:address_start + address_length])
+    return domain, unpack('>H', datagram[payload_start - 2:payload_start])[0], datagram[payload_start:]
+
+
+# Enough for the largest greeting (257 bytes) and request (262 bytes), the optimistic data received with them fills the
+# rest of the buffer
+SOCKS_BUFFER_SIZE = 2048
+
+
+class SocksError(Exception):
+    def __init__(self, message: str, reply=SocksReply.SERVER_FAILURE):
+        super().__init__(message)
+        self.reply = reply
+
+
+class SocksParser:
+    # The messages of the client are received into the same buffer whatever the way they are split, the bytes received
+    # after a complete message are kept for the next one
+    def __init__(self, size=SOCKS_BUFFER_SIZE):
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._end = 0
+        self.methods = b''
+        self.command = None
+        self.domain = None
+        self.port = None
+
+    def __len__(self):
+        return self._end - self._start
+
+    def get_free_buffer(self) -> memoryview:
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            self._buffer[:self._end - self._start] = self._buffer[self._start:self._end]
+            self._end -= self._start
+            self._start = 0
+        return memoryview(self._buffer)[self._end:]
+
+    def commit(self, received: int):
+        self._end += received
+
+    def feed(self, data: bytes):
+        free_buffer = self.get_free_buffer()
+        if len(data) > len(free_buffer):
+            raise SocksError("SOCKS message too long.")
+        free_buffer[:len(data)] = data
+        self.commit(len(data))
+
+    def parse_greeting(self) -> bool:
+        # Returns False until the whole message is received
+        if len(self) < 2:
+            return False
+        ver, nmethods = self._buffer[self._start], self._buffer[self._start + 1]
+        if ver != 5:
+            raise SocksError("SOCKS version '{}' not supported.".format(ver))
+        if nmethods == 0:
+            raise SocksError("Malformed SOCKS greeting without any method.")
+        if len(self) < 2 + nmethods:
+            return False
+        self.methods = bytes(self._buffer[self._start + 2:self._start + 2 + nmethods])
+        self._start += 2 + nmethods
+        return True
+
+    def parse_request(self) -> bool:
+        if len(self) < 4:
+            return False
+        ver, cmd, rsv, atyp = self._buffer[self._start:self._start + 4]
+        if ver != 5:
+            raise SocksError("SOCKS version '{}' not supported.".format(ver), SocksReply.CONNECTION_REFUSED)
+        if rsv != 0:
+            raise SocksError("Malformed SOCKS request.")
+        if atyp == ord(SocksAddressType.IPV4.value):
+            address_start, address_length = 4, 4
+        elif atyp == ord(SocksAddressType.IPV6.value):
+            address_start, address_length = 4, 16
+        elif atyp == ord(SocksAddressType.DOMAINNAME.value):
+            if len(self) < 5:
+                return False
+            address_start, address_length = 5, self._buffer[self._start + 4]
+            if address_length == 0:
+                raise SocksError("Malformed SOCKS request with an empty domain.")
+        else:
+            raise SocksError("SOCKS address type '{}' not supported.".format(atyp),
+                             SocksReply.ADDRESS_TYPE_NOT_SUPPORTED)
+        length = address_start + address_length + 2
+        if len(self) < length:
+            return False
+
+        request = bytes(self._buffer[self._start:self._start + length])
+        self._start += length
+        try:
+            self.command = SocksCommand(request[1:2])
+        except ValueError:
+            raise SocksError("SOCKS command '{}' not supported.".format(cmd), SocksReply.COMMAND_NOT_SUPPORTED)
+        self.domain = _decode_address(atyp, request[address_start:address_start + address_length])
+        self.port = unpack('>H', request[-2:])[0]
+        return True
+
+    def pop_pending(self) -> bytes:
+        # Data sent by the client right after its request without waiting for the reply
+        pending = bytes(self._buffer[self._start:self._end])
+        self._start = self._end = 0
+        return pending
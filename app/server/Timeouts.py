@@ -0,0 +1,151 @@
+import math
+import threading
+from time import monotonic, sleep
+from typing import Callable, Optional
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Logger import logger
+
+TIMER_WHEEL_TICK = 0.5
+TIMER_WHEEL_SLOTS = 512
+
+
+class Timer:
+    __slots__ = ("tick", "callback")
+
+    def __init__(self, tick: int, callback: Callable[[], None]):
+        self.tick = tick
+        self.callback = callback
+
+
+class TimerWheel:
+    # Hashed timing wheel: a timer is put in the slot of the tick it expires at and each tick only visits one slot, the
+    # timers of a slot which are due in a later round of the wheel stay there until then
+    def __init__(self, tick=TIMER_WHEEL_TICK, slots=TIMER_WHEEL_SLOTS, clock: Callable[[], float] = monotonic):
+        self.tick = tick
+        self.clock = clock
+        self._slots = [set() for _ in range(slots)]
+        self._lock = threading.Lock()
+        self._origin = clock()
+        # Next tick to visit
+        self._current_tick = 0
+
+    def __str__(self):
+        return "TimerWheel:{}".format(len(self))
+
+    def __len__(self):
+        return sum(len(slot) for slot in self._slots)
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> Timer:
+        # The callback is run at the first tick after the delay, never before
+        tick = math.ceil((self.clock() + delay - self._origin) / self.tick)
+        with self._lock:
+            timer = Timer(max(tick, self._current_tick), callback)
+            self._slots[timer.tick % len(self._slots)].add(timer)
+        return timer
+
+    def cancel(self, timer: Timer):
+        with self._lock:
+            self._slots[timer.tick % len(self._slots)].discard(timer)
+
+    def advance(self) -> int:
+        # Runs the callbacks of the timers due up to now, returns their number
+        last_tick = int((self.clock() - self._origin) / self.tick)
+        expired = []
+        with self._lock:
+            while self._current_tick <= last_tick:
+                slot = self._slots[self._current_tick % len(self._slots)]
+                due = [timer for timer in slot if timer.tick <= self._current_tick]
+                slot.difference_update(due)
+                expired.extend(due)
+                self._current_tick += 1
+        for timer in expired:
+            try:
+                timer.callback()
+            except Exception as err:
+                logger.error(self, "Timer callback failed: \"{}\".", err)
+        return len(expired)
+
+
+class _Watch:
+    __slots__ = ("stats", "close", "timer")
+
+    def __init__(self, stats: TunnelStats, close: Callable[[], None]):
+        self.stats = stats
+        self.close = close
+        self.timer = None
+
+
+class TunnelTimeouts:
+    # The idle and lifetime limits of all the tunnels are checked by a single timer wheel, the relays only record the
+    # time of their last activity in the stats of the tunnel. A limit set to 0 is not applied.
+    def __init__(self, idle_timeout=0, max_lifetime=0, wheel: Optional[TimerWheel] = None):
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.wheel = wheel if wheel is not None else TimerWheel()
+        self._watches = set()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "TunnelTimeouts:{}".format(len(self._watches))
+
+    def __len__(self):
+        return len(self._watches)
+
+    def start(self, is_stopped: Callable[[], bool]):
+        threading.Thread(target=self._loop, args=(is_stopped,), name="TunnelTimeouts", daemon=True).start()
+        return self
+
+    def _loop(self, is_stopped: Callable[[], bool]):
+        while not is_stopped():
+            sleep(self.wheel.tick)
+            self.wheel.advance()
+        # The relays do not check the stop flag on their own
+        with self._lock:
+            watches = list(self._watches)
+        for watch in watches:
+            self._expire(watch, CloseReason.STOPPED)
+
+    def watch(self, stats: TunnelStats, close: Callable[[], None]) -> _Watch:
+        # close has to end the relay of the tunnel, it is called from the thread of the wheel
+        stats.last_activity = self.wheel.clock()
+        watch = _Watch(stats, close)
+        with self._lock:
+            self._watches.add(watch)
+        self._schedule(watch)
+        return watch
+
+    def unwatch(self, watch: _Watch):
+        with self._lock:
+            self._watches.discard(watch)
+        if watch.timer is not None:
+            self.wheel.cancel(watch.timer)
+
+    def _schedule(self, watch: _Watch):
+        deadlines = []
+        if self.idle_timeout:
+            deadlines.append(watch.stats.last_activity + self.idle_timeout)
+        if self.max_lifetime:
+            deadlines.append(watch.stats.start_time + self.max_lifetime)
+        if deadlines:
+            watch.timer = self.wheel.schedule(min(deadlines) - self.wheel.clock(), lambda: self._check(watch))
+
+    def _check(self, watch: _Watch):
+        if watch not in self._watches:
+            return
+        now = self.wheel.clock()
+        if self.max_lifetime and now - watch.stats.start_time >= self.max_lifetime:
+            self._expire(watch, CloseReason.LIFETIME)
+        elif self.idle_timeout and now - watch.stats.last_activity >= self.idle_timeout:
+            self._expire(watch, CloseReason.IDLE)
+        else:
+            # There was some activity since the timer was set
+            self._schedule(watch)
+
+    def _expire(self, watch: _Watch, close_reason: CloseReason):
+        self.unwatch(watch)
+        watch.stats.close(close_reason)
+        try:
+            watch.close()
+        except (OSError, RuntimeError) as err:
+            logger.error(self, "Error while closing the tunnel: \"{}\".", err)
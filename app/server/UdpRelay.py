@@ -0,0 +1,289 @@
+import selectors
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from time import monotonic
+from typing import Callable, Optional
+
+import socks
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Balancer import Balancer
+from app.server.Link import Link
+from app.server.Logger import logger
+from app.server.Metrics import metrics
+from app.server.Request import Request
+from app.server.Socks import SocksError, build_udp_datagram, parse_udp_datagram
+
+UDP_BUFFER_SIZE = 65535
+# Datagrams received from a socket at once before the other sockets get their turn
+UDP_BATCH_SIZE = 64
+# Datagrams kept for a flow while its socket is being opened
+UDP_PENDING_SIZE = 16
+# Seconds between two searches of the idle flows
+UDP_SWEEP_INTERVAL = 1
+
+
+class _Flow:
+    __slots__ = ("association", "key", "link", "sock", "target", "pending", "last_activity")
+
+    def __init__(self, association: "UdpAssociation", key: tuple, link: Link):
+        self.association = association
+        # Destination as sent by the client, the answers are sent back with it
+        self.key = key
+        self.link = link
+        self.sock = None
+        self.target = None
+        self.pending = []
+        self.last_activity = monotonic()
+
+
+class UdpAssociation:
+    def __init__(self, sock: socket.socket, client_ip: str, client_port: int, stats: TunnelStats):
+        self.sock = sock
+        self.client_ip = client_ip
+        # The client may not know its port when it sends its request, it is then learned from its first datagram
+        self.client_address = (client_ip, client_port) if client_port else None
+        self.stats = stats
+        # NAT table: one flow, and so one link, per destination
+        self.flows = {}
+
+    def __str__(self):
+        return "UdpAssociation:{}".format(self.client_ip)
+
+    def get_address(self) -> tuple:
+        return self.sock.getsockname()[:2]
+
+
+class UdpRelay:
+    # A single thread relays the datagrams of all the associations, the flows are opened by a small pool as opening
+    # one through a proxy blocks
+    def __init__(self, get_balancer: Callable[[], Balancer], is_stopped: Callable[[], bool], flow_timeout=60,
+                 workers=4):
+        self._get_balancer = get_balancer
+        self._is_stopped = is_stopped
+        self.flow_timeout = flow_timeout
+        self._workers = workers
+        self._selector = selectors.DefaultSelector()
+        self._commands = Queue()
+        self._associations = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._executor = None
+        self._last_sweep = monotonic()
+        self._wakeup_read, self._wakeup_write = socket.socketpair()
+        self._wakeup_read.setblocking(False)
+        self._wakeup_write.setblocking(False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+
+    def __str__(self):
+        return "UdpRelay:{}".format(len(self._associations))
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="UdpFlow")
+            self._thread = threading.Thread(target=self._loop, name="UdpRelay", daemon=True)
+        self._thread.start()
+
+    def open(self, bind_address: str, client_ip: str, client_port: int, stats: TunnelStats) -> UdpAssociation:
+        family = socket.AF_INET6 if ":" in bind_address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.bind((bind_address, 0))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        association = UdpAssociation(sock, client_ip, client_port, stats)
+        self._start()
+        self._run(lambda: self._add(association))
+        return association
+
+    def close(self, association: UdpAssociation, close_reason: CloseReason):
+        association.stats.close(close_reason)
+        self._run(lambda: self._remove(association))
+
+    def _run(self, command: Callable[[], None]):
+        # The selector and the NAT tables are only used by the relay thread
+        self._commands.put(command)
+        try:
+            self._wakeup_write.send(b'\x00')
+        except BlockingIOError:
+            pass  # A wake up is already pending
+
+    def _loop(self):
+        while not self._is_stopped():
+            for key, _ in self._selector.select(1):
+                if key.fileobj is self._wakeup_read:
+                    self._run_commands()
+                elif isinstance(key.data, UdpAssociation):
+                    self._receive_from_client(key.data)
+                else:
+                    self._receive_from_flow(key.data)
+            self._close_idle_flows()
+
+        self._run_commands()
+        for association in list(self._associations):
+            association.stats.close(CloseReason.STOPPED)
+            self._remove(association)
+        # The flows still being opened queue their socket to the relay thread, it is closed by this last run
+        self._executor.shutdown(wait=True)
+        self._run_commands()
+
+    def _run_commands(self):
+        try:
+            while self._wakeup_read.recv(UDP_BUFFER_SIZE):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                command = self._commands.get_nowait()
+            except Empty:
+                return
+            command()
+
+    def _add(self, association: UdpAssociation):
+        self._associations.add(association)
+        self._selector.register(association.sock, selectors.EVENT_READ, association)
+
+    def _remove(self, association: UdpAssociation):
+        if association not in self._associations:
+            association.sock.close()
+            return
+        self._associations.discard(association)
+        self._selector.unregister(association.sock)
+        association.sock.close()
+        for flow in list(association.flows.values()):
+            self._close_flow(flow)
+
+    def _receive_from_client(self, association: UdpAssociation):
+        for _ in range(UDP_BATCH_SIZE):
+            try:
+                datagram, address = association.sock.recvfrom(UDP_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as err:
+                logger.error(association, "Error while receiving from the client: \"{}\".", err)
+                return
+            if address[0] != association.client_ip:
+                continue  # Only the client of the association can use it
+            if association.client_address is None:
+                association.client_address = address[:2]
+            elif association.client_address != address[:2]:
+                continue
+            try:
+                domain, port, payload = parse_udp_datagram(datagram)
+            except SocksError as err:
+                logger.warning(association, "Datagram dropped: \"{}\".", err)
+                continue
+            association.stats.bytes_in += len(payload)
+            metrics.relay_bytes["in"].inc(len(payload))
+            self._send_to_flow(association, (domain, port), payload)
+
+    def _send_to_flow(self, association: UdpAssociation, key: tuple, payload: bytes):
+        flow = association.flows.get(key)
+        if flow is None:
+            balancer = self._get_balancer()
+            # The links which can not carry datagrams are left out as if they had already been tried
+            link = balancer.get_next_link(Request(key[0], key[1], association.client_ip),
+                                          [link for link in balancer.links if not link.supports_udp()])
+            if link is None:
+                return
+            if association.stats.link is None:
+                association.stats.link = link
+            flow = association.flows[key] = _Flow(association, key, link)
+            flow.pending.append(payload)
+            self._executor.submit(self._open_flow, flow)
+            return
+
+        flow.last_activity = monotonic()
+        if flow.sock is None:
+            if len(flow.pending) < UDP_PENDING_SIZE:
+                flow.pending.append(payload)
+            return
+        self._send(flow, payload)
+
+    def _open_flow(self, flow: _Flow):
+        if self._is_stopped():
+            return
+        try:
+            sock, target = flow.link.open_datagram_socket(flow.key)
+            sock.setblocking(False)
+        except (OSError, socks.ProxyError, IndexError) as err:
+            logger.error(flow.link, "Can not open a UDP flow to {}:{}: \"{}\".", flow.key[0], flow.key[1], err)
+            self._run(lambda: self._close_flow(flow))
+            return
+        self._run(lambda: self._start_flow(flow, sock, target))
+
+    def _start_flow(self, flow: _Flow, sock: socket.socket, target: tuple):
+        if flow.association.flows.get(flow.key) is not flow:
+            sock.close()  # The association or the flow was closed meanwhile
+            return
+        flow.sock = sock
+        flow.target = target
+        self._selector.register(sock, selectors.EVENT_READ, flow)
+        for payload in flow.pending:
+            self._send(flow, payload)
+        flow.pending = []
+
+    def _send(self, flow: _Flow, payload: bytes):
+        try:
+            if isinstance(flow.sock, socks.socksocket):
+                flow.sock.sendto(payload, flow.target)
+            else:
+                flow.sock.send(payload)
+        except BlockingIOError:
+            pass  # As any UDP datagram, it may be lost
+        except OSError as err:
+            logger.error(flow.link, "Error while sending a datagram to {}:{}: \"{}\".", flow.key[0], flow.key[1], err)
+
+    def _receive_from_flow(self, flow: _Flow):
+        association = flow.association
+        for _ in range(UDP_BATCH_SIZE):
+            try:
+                payload, _ = flow.sock.recvfrom(UDP_BUFFER_SIZE)
+            except BlockingIOError:
+                return
+            except (OSError, NotImplementedError) as err:
+                logger.error(flow.link, "Error while receiving from {}:{}: \"{}\".", flow.key[0], flow.key[1], err)
+                return
+            flow.last_activity = monotonic()
+            if association.client_address is None:
+                continue
+            association.stats.bytes_out += len(payload)
+            metrics.relay_bytes["out"].inc(len(payload))
+            try:
+                association.sock.sendto(build_udp_datagram(flow.key, payload), association.client_address)
+            except OSError:
+                pass
+
+    def _close_flow(self, flow: _Flow):
+        association = flow.association
+        if association.flows.get(flow.key) is flow:
+            del association.flows[flow.key]
+        if flow.sock is not None:
+            self._selector.unregister(flow.sock)
+            flow.sock.close()
+            flow.sock = None
+
+    def _close_idle_flows(self):
+        # Every flow is visited, so not more than once per interval however many datagrams wake the thread up
+        now = monotonic()
+        if not self.flow_timeout or now - self._last_sweep < UDP_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for association in self._associations:
+            for flow in [flow for flow in association.flows.values() if
+                         now - flow.last_activity > self.flow_timeout]:
+                self._close_flow(flow)
+
+
+def get_bind_address(sockname: Optional[tuple], domain: str) -> str:
+    # The relay listens on the address the client used to reach the server
+    if sockname:
+        return sockname[0]
+    return domain
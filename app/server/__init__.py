@@ -1,48 +1,45 @@
+import itertools
+import multiprocessing
+import os
 import select
+import selectors
+import signal
 import socket
 import threading
 from enum import Enum
-from struct import unpack
-from time import sleep
-from typing import Optional
+from time import monotonic, sleep
+from typing import Callable, Optional, Union
 
 import socks
 
+from app.server.AccessLog import CloseReason, TunnelStats, access_log
+from app.server.AsyncEngine import AsyncEngine
 from app.server.Balancer import Balancer
+from app.server.Connector import Connector
+from app.server.HttpProxy import HttpError, HttpParser, HttpStatus, build_response
 from app.server.Link import Link
 from app.server.Logger import logger
+from app.server.Metrics import metrics, start_metrics_server
+from app.server.RateLimit import ClientLimiter, TokenBucket
+from app.server.Relay import RELAY_BUFFER_SIZE, RelayMode, is_splice_supported, relay_buffered, relay_splice, \
+    shutdown_sockets
+from app.server.RelayPool import RelayPool
+from app.server.Resolver import resolver
+from app.server.SharedState import SharedLinkState
+from app.server.Timeouts import TunnelTimeouts
 from app.server.Request import Request
+from app.server.UdpRelay import UdpRelay, get_bind_address
+from app.server.Socks import SocksCommand, SocksError, SocksMethod, SocksParser, SocksReply, \
+    build_chosen_method_packet, build_reply_packet
 
 
-class SocksCommand(Enum):
-    CONNECT = b'\x01'
-    BIND = b'\x02'
-    UDP_ASSOCIATE = b'\x03'
+BALANCER_LOOP_INTERVAL = 0.5
+BALANCER_REPORT_INTERVAL = 10
 
 
-class SocksAddressType(Enum):
-    IPV4 = b'\x01'
-    DOMAINNAME = b'\x03'
-    IPV6 = b'\x04'
-
-
-class SocksMethod(Enum):
-    NO_AUTH = b'\x00'
-    GSAPI = b'\x01'
-    USERNAME_PASSWORD = b'\x02'
-    NO_ACCEPTABLE_METHODS = b'\xff'
-
-
-class SocksReply(Enum):
-    SUCCEEDED = b'\x00'
-    SERVER_FAILURE = b'\x01'
-    CONNECTION_NOT_ALOWED = b'\x02'
-    NETWORK_UNREACHABLE = b'\x03'
-    HOST_UNREACHABLE = b'\x04'
-    CONNECTION_REFUSED = b'\x05'
-    TTL_EXPIRED = b'\x06'
-    COMMAND_NOT_SUPPORTED = b'\x07'
-    ADDRESS_TYPE_NOT_SUPPORTED = b'\x08'
+class ServerMode(str, Enum):
+    THREADING = "threading"
+    ASYNCIO = "asyncio"
 
 
 # https://tools.ietf.org/html/rfc1928
@@ -51,20 +48,66 @@ class Server:
         ("balancer", "balancer", Balancer, True),
         ("domain", "domain", str, False),
         ("port", "port", int, False),
+        ("http_port", "http_port", int, False),
         ("timeout", "timeout", int, False),
         ("max_threads", "max_threads", int, False),
+        ("mode", "mode", ServerMode, False),
+        ("relay", "relay", RelayMode, False),
+        ("relay_workers", "relay_workers", int, False),
+        ("processes", "processes", int, False),
+        ("backlog", "backlog", int, False),
+        ("access_log", "access_log_output", str, False),
+        ("metrics_domain", "metrics_domain", str, False),
+        ("metrics_port", "metrics_port", int, False),
+        ("dns_ttl", "dns_ttl", int, False),
+        ("dns_negative_ttl", "dns_negative_ttl", int, False),
+        ("client_max_connections", "client_max_connections", int, False),
+        ("client_connections_per_second", "client_connections_per_second", int, False),
+        ("handshake_timeout", "handshake_timeout", int, False),
+        ("udp_timeout", "udp_timeout", int, False),
+        ("idle_timeout", "idle_timeout", int, False),
+        ("max_lifetime", "max_lifetime", int, False),
     ]
 
-    def __init__(self, domain="0.0.0.0", port=1080, timeout=5, max_threads=200):
+    def __init__(self, domain="0.0.0.0", port=1080, timeout=5, max_threads=200, mode=ServerMode.THREADING,
+                 relay=RelayMode.BUFFERED, relay_workers=0, processes=1, backlog=128, access_log_output="",
+                 metrics_domain="127.0.0.1", metrics_port=0, dns_ttl=60, dns_negative_ttl=5, client_max_connections=0,
+                 client_connections_per_second=0, handshake_timeout=5, udp_timeout=60, http_port=0,
+                 idle_timeout=300, max_lifetime=0):
         self.balancer = None
         self.domain = domain
         self.port = port
+        self.http_port = http_port
         self.timeout = timeout
         self.max_threads = max_threads
+        self.mode = mode
+        self.relay = relay
+        self.relay_workers = relay_workers
+        self.processes = processes
+        self.backlog = backlog
+        self.access_log_output = access_log_output
+        self.metrics_domain = metrics_domain
+        self.metrics_port = metrics_port
+        self.dns_ttl = dns_ttl
+        self.dns_negative_ttl = dns_negative_ttl
+        self.client_max_connections = client_max_connections
+        self.client_connections_per_second = client_connections_per_second
+        self.client_limiter = ClientLimiter()
+        self.handshake_timeout = handshake_timeout
+        self.udp_timeout = udp_timeout
+        self.udp_relay = None
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.tunnel_timeouts = TunnelTimeouts()
+        self._metrics_server = None
+        self._relay_pool = None
+        self._processes = []
         self._server_thread = None
         self._balancer_thread = None
         self.STOP = False
-        self._link_counter = 0
+        self._connection_ids = itertools.count()
+        self._reload_lock = threading.Lock()
+        self.connector = Connector(self)
 
     def __str__(self):
         return "Server:{}:{}".format(self.domain, self.port)
@@ -76,220 +119,450 @@ class Server:
         self.balancer = balancer
         return self
 
+    def reload_balancer(self, balancer: Balancer) -> bool:
+        if self._processes:
+            # Each worker process reloads the configuration and swaps its own balancer
+            for process in self._processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGHUP)
+            return True
+
+        with self._reload_lock:
+            old_balancer = self.balancer
+            removed_links = balancer.take_over(old_balancer)
+            if removed_links is None:
+                logger.error(self, "Configuration not reloaded.")
+                return False
+            # Only the requests handled from now on use the new balancer, the tunnels in progress keep their link
+            self.balancer = balancer
+            old_balancer.detach_links()
+        for link in removed_links:
+            link.stop_pool()
+        if self._server_thread is not None:
+            # The pools of the new links and the ones replaced by the new configuration
+            for link in balancer.links:
+                link.start_pool()
+        logger.info(self, "Configuration reloaded: {} links, {} removed.", len(balancer.links), len(removed_links))
+        return True
+
     def start(self) -> bool:
         self.STOP = False
+        if self.access_log_output and not access_log.is_enabled():
+            access_log.set_output(self.access_log_output)
+        resolver.ttl = self.dns_ttl
+        resolver.negative_ttl = self.dns_negative_ttl
+        self.client_limiter = ClientLimiter(self.client_max_connections, self.client_connections_per_second)
+        if self.processes > 1:
+            return self._start_processes()
+        return self._start_server()
+
+    def _start_processes(self) -> bool:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            logger.error(self, "SO_REUSEPORT is not supported, can not start {} processes.", self.processes)
+            return False
+
+        # The link status and connections count are shared so that every process sees the global load
+        self.balancer.attach_shared_state(SharedLinkState(len(self.balancer.links)))
+
+        context = multiprocessing.get_context("fork")
+        for process_idx in range(self.processes):
+            process = context.Process(target=self._run_worker_process, args=(process_idx,))
+            process.start()
+            self._processes.append(process)
+        logger.info(self, "Started {} worker processes.", self.processes)
+        return True
+
+    def _run_worker_process(self, process_idx: int):
+        self._processes = []
+        signal.signal(signal.SIGTERM, lambda sig, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda sig, frame: self.stop())
+        try:
+            # Only one process checks the links, the others read the shared status
+            if not self._start_server(reuse_port=True, check_links=process_idx == 0, metrics_port_offset=process_idx):
+                return
+            while self._server_thread.is_alive():
+                self._server_thread.join(1)
+        finally:
+            # The worker process exits through os._exit, the atexit handlers do not run
+            logger.flush()
+            access_log.flush()
+
+    def _create_server_socket(self, port: int, reuse_port: bool) -> Optional[socket.socket]:
         try:
             server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             server_socket.settimeout(self.timeout)
         except socket.error as err:
-            logger.error(str(self), "Failed to create the socket server, error: \"{}\".".format(err))
-            return False
+            logger.error(self, "Failed to create the socket server, error: \"{}\".", err)
+            return None
 
         try:
             server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_socket.bind((self.domain, self.port))
-            logger.info(str(self), 'Bind {}.'.format(str(self.port)))
+            if reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server_socket.bind((self.domain, port))
+            logger.info(self, 'Bind {}.', port)
         except socket.error as err:
             server_socket.close()
-            logger.error(str(self), "Cannot bind {}:{}, error: \"{}\".".format(self.domain, self.port, err))
-            return False
+            logger.error(self, "Cannot bind {}:{}, error: \"{}\".", self.domain, port, err)
+            return None
 
         try:
-            server_socket.listen(10)
+            server_socket.listen(self.backlog)
         except socket.error as err:
             server_socket.close()
-            logger.error(str(self), "Listen failed, error: \"{}\".".format(err))
+            logger.error(self, "Listen failed, error: \"{}\".", err)
+            return None
+        return server_socket
+
+    def _start_server(self, reuse_port=False, check_links=True, metrics_port_offset=0) -> bool:
+        # The SOCKS5 listener and the optional HTTP proxy one share the accept loop, the accounting and the relay
+        server_sockets = []
+        for port in [self.port, self.http_port] if self.http_port else [self.port]:
+            server_socket = self._create_server_socket(port, reuse_port)
+            if server_socket is None:
+                for opened_socket in server_sockets:
+                    opened_socket.close()
+                return False
+            server_sockets.append(server_socket)
+
+        if self.metrics_port and not self._start_metrics_server(self.metrics_port + metrics_port_offset):
+            for server_socket in server_sockets:
+                server_socket.close()
             return False
 
-        self._server_thread = threading.Thread(target=self._accept_client_loop, args=(server_socket,))
+        for link in self.balancer.links:
+            link.start_pool()
+        self.udp_relay = UdpRelay(lambda: self.balancer, lambda: self.STOP, self.udp_timeout)
+        self.tunnel_timeouts = TunnelTimeouts(self.idle_timeout, self.max_lifetime).start(lambda: self.STOP)
+        if self.mode == ServerMode.ASYNCIO:
+            self._server_thread = threading.Thread(target=AsyncEngine(self).run, args=(server_sockets,))
+        else:
+            if self.relay_workers > 0:
+                self._relay_pool = RelayPool(self.relay_workers, lambda: self.STOP).start()
+            handlers = [self.handle_request, self.handle_http_request]
+            self._server_thread = threading.Thread(target=self._accept_client_loop,
+                                                   args=(dict(zip(server_sockets, handlers)),))
         self._server_thread.start()
 
-        self._balancer_thread = threading.Thread(target=self._balancer_loop)
-        self._balancer_thread.start()
+        if check_links:
+            self._balancer_thread = threading.Thread(target=self._balancer_loop)
+            self._balancer_thread.start()
+
+        return True
 
+    def _start_metrics_server(self, port: int) -> bool:
+        try:
+            self._metrics_server = start_metrics_server(self.metrics_domain, port, lambda: self.balancer.links)
+        except OSError as err:
+            logger.error(self, "Cannot bind the metrics endpoint {}:{}, error: \"{}\".", self.metrics_domain, port,
+                         err)
+            return False
+        logger.info(self, "Metrics available on http://{}:{}/metrics.", self.metrics_domain, port)
         return True
 
     def stop(self):
         self.STOP = True
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server.server_close()
+            self._metrics_server = None
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
 
     def _balancer_loop(self):
+        last_report = 0
         while not self.STOP:
-            self.balancer.update_links_status()
-            sleep(10)
-
-    def _socks_sub_negotiation_choose_method(self, socket_client: socket) -> SocksMethod:
+            self.balancer.check_due_links()
+            if monotonic() - last_report >= BALANCER_REPORT_INTERVAL:
+                last_report = monotonic()
+                routing_cache = self.balancer.get_routing_cache()
+                logger.info(self.balancer, "Routing cache: {} entries, hit rate {:.1%}.", len(routing_cache),
+                            routing_cache.hit_rate())
+            sleep(BALANCER_LOOP_INTERVAL)
+        self.balancer.stop_health_checks()
+
+    def _receive_handshake(self, socket_client: socket, parser: Union[SocksParser, HttpParser],
+                           parse: Callable[[], bool]):
+        # Each phase of the handshake has its own deadline, however the message is split
+        deadline = monotonic() + self.handshake_timeout
         try:
-            methods_packet = socket_client.recv(2048)
-        except socket.error:
-            logger.error(str(self), "Socket error while trying to communicate with client.")
-            return SocksMethod.NO_ACCEPTABLE_METHODS
-
-        ver = methods_packet[0]
-        nmethods = methods_packet[1]
-        methods = methods_packet[2:]
-
-        if ver != 5:
-            logger.error(str(self), "SOCKS version '{}' not supported.".format(ver))
-            return SocksMethod.NO_ACCEPTABLE_METHODS
-
-        if nmethods != len(methods):
-            logger.error(str(self), "Malformed SOCKS packet received from client.")
-            return SocksMethod.NO_ACCEPTABLE_METHODS
-
-        if ord(SocksMethod.NO_AUTH.value) in methods:
-            return SocksMethod.NO_AUTH
-
-        return SocksMethod.NO_ACCEPTABLE_METHODS
+            while not parse():
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("Timed out during the handshake.")
+                socket_client.settimeout(remaining)
+                received = socket_client.recv_into(parser.get_free_buffer())
+                if not received:
+                    raise ConnectionError("Client closed the connection during the handshake.")
+                parser.commit(received)
+        finally:
+            socket_client.settimeout(None)
 
     def _socks_sub_negotiation_send_chosen_method(self, socket_client: socket, method: SocksMethod) -> bool:
-        chosen_method_packet = b'\x05' + method.value
+        chosen_method_packet = build_chosen_method_packet(method)
         try:
             socket_client.sendall(chosen_method_packet)
         except socket.error as err:
-            logger.error(str(self), "Socket error while trying to communicate with client: \"{}\".".format(err))
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
             return False
         return True
 
-    def _socks_sub_negotiation(self, socket_client: socket) -> bool:
-        method = self._socks_sub_negotiation_choose_method(socket_client)
-        self._socks_sub_negotiation_send_chosen_method(socket_client, method)
-        if method == SocksMethod.NO_ACCEPTABLE_METHODS:
-            return False
-        return True
-
-    def _socks_request_get_dest(self, socket_client: socket) -> (Optional[str], Optional[int]):
+    def _socks_sub_negotiation(self, socket_client: socket, parser: SocksParser) -> bool:
         try:
-            request_packet = socket_client.recv(2048)
-        except socket.error:
-            logger.error(str(self), "Socket error while trying to communicate with client.")
-            self._socks_request_send_reply(socket_client, SocksReply.SERVER_FAILURE)
-            raise Exception()
+            self._receive_handshake(socket_client, parser, parser.parse_greeting)
+        except SocksError as err:
+            logger.error(self, "Invalid SOCKS greeting: \"{}\".", err)
+            self._socks_sub_negotiation_send_chosen_method(socket_client, SocksMethod.NO_ACCEPTABLE_METHODS)
+            return False
+        except OSError as err:
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
+            return False
 
-        ver = request_packet[0]
-        cmd = request_packet[1]
-        atyp = request_packet[3]
+        method = SocksMethod.NO_AUTH if ord(SocksMethod.NO_AUTH.value) in parser.methods else \
+            SocksMethod.NO_ACCEPTABLE_METHODS
+        if not self._socks_sub_negotiation_send_chosen_method(socket_client, method):
+            return False
+        return method != SocksMethod.NO_ACCEPTABLE_METHODS
 
-        if ver != 5:
-            logger.error(str(self), "SOCKS version '{}' not supported.".format(ver))
-            self._socks_request_send_reply(socket_client, SocksReply.CONNECTION_REFUSED)
+    def _socks_request_get_dest(self, socket_client: socket, parser: SocksParser) -> Optional[tuple]:
+        try:
+            self._receive_handshake(socket_client, parser, parser.parse_request)
+        except SocksError as err:
+            logger.error(self, "Invalid SOCKS request: \"{}\".", err)
+            self._socks_request_send_reply(socket_client, err.reply)
             return None
-
-        if cmd != ord(SocksCommand.CONNECT.value):
-            logger.error(str(self), "SOCKS command '{}' not supported.".format(cmd))
-            self._socks_request_send_reply(socket_client, SocksReply.COMMAND_NOT_SUPPORTED)
+        except OSError as err:
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
             return None
 
-        if atyp == ord(SocksAddressType.IPV4.value):
-            dst_addr = socket.inet_ntop(socket.AF_INET, request_packet[4:-2])
-        elif atyp == ord(SocksAddressType.DOMAINNAME.value):
-            dst_addr = request_packet[5:-2].decode()
-        elif atyp == ord(SocksAddressType.IPV6.value):
-            dst_addr = socket.inet_ntop(socket.AF_INET6, request_packet[4:-2])
-        else:
-            logger.error(str(self), "SOCKS address type '{}' not supported.".format(atyp))
-            self._socks_request_send_reply(socket_client, SocksReply.ADDRESS_TYPE_NOT_SUPPORTED)
+        if parser.command not in (SocksCommand.CONNECT, SocksCommand.UDP_ASSOCIATE):
+            logger.error(self, "SOCKS command '{}' not supported.", parser.command.name)
+            self._socks_request_send_reply(socket_client, SocksReply.COMMAND_NOT_SUPPORTED)
             return None
 
-        dst_port = unpack('>H', request_packet[-2:])[0]
-
-        return dst_addr, dst_port
+        return parser.domain, parser.port
 
-    def _socks_request_send_reply(self, socket_client: socket, reply: SocksReply) -> bool:
-        reply_packet = b'\x05' + reply.value + b'\x00' + SocksAddressType.IPV4.value + \
-                       b'\x00' + b'\x00' + b'\x00' + b'\x00' + \
-                       b'\x00' + b'\x00'
+    def _socks_request_send_reply(self, socket_client: socket, reply: SocksReply,
+                                  address: Optional[tuple] = None) -> bool:
+        reply_packet = build_reply_packet(reply, address)
         try:
             socket_client.sendall(reply_packet)
         except socket.error as err:
-            logger.error(str(self), "Socket error while trying to communicate with client: \"{}\".".format(err))
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
             return False
         return True
 
-    def _socks_request(self, socket_client: socket) -> (Optional[Link], Optional[int], Optional[socks.socksocket]):
-        (domain, port) = self._socks_request_get_dest(socket_client)
-        request = Request(domain, port)
-        link = self.balancer.get_next_link(request)
-        if link is None:
-            logger.error(str(self), "No Link available to handle the request.")
+    def _socks_request(self, socket_client: socket, parser: SocksParser, stats: TunnelStats) -> (
+            Optional[Link], Optional[int], Optional[socks.socksocket]):
+        dest = self._socks_request_get_dest(socket_client, parser)
+        if dest is None:
+            return None
+        (domain, port) = dest
+        request = Request(domain, port, stats.client_ip)
+        stats.request = request
+        stats.set_handshake_done()
+        if parser.command == SocksCommand.UDP_ASSOCIATE:
+            self._socks_udp_associate(socket_client, request, stats)
             return None
-        connection_id = self.generate_connection_id()
-        socket_link = link.open_connection(connection_id)
-        if socket_link is None:
+        connection = self.connector.connect(request, stats)
+        if connection is None:
+            if stats.close_reason == CloseReason.REJECTED:
+                logger.error(self, "No Link available to handle the request.")
+                self._socks_request_send_reply(socket_client, SocksReply.CONNECTION_NOT_ALOWED)
+            else:
+                self._socks_request_send_reply(socket_client, SocksReply.NETWORK_UNREACHABLE)
+            return None
+        link, connection_id, socket_link = connection
+
+        if not self._socks_request_send_reply(socket_client, SocksReply.SUCCEEDED) or \
+                not self._send_optimistic_data(socket_link, parser, stats):
+            stats.close(CloseReason.ERROR)
             link.close_connection(connection_id)
             return None
+
+        return link, connection_id, socket_link
+
+    def _socks_udp_associate(self, socket_client: socket, request: Request, stats: TunnelStats):
+        # The port given by the client is only trusted when it also gives its own address
+        client_port = request.port if request.domain == stats.client_ip else 0
         try:
-            socket_link.connect((domain, port))
-        except socket.error as err:
-            logger.error(str(self),
-                         "Socket error while trying to connect to {}:{}: \"{}\".".format(domain, port, err))
-            link.close_connection(connection_id)
-            self._socks_request_send_reply(socket_client, SocksReply.NETWORK_UNREACHABLE)
+            association = self.udp_relay.open(get_bind_address(socket_client.getsockname(), self.domain),
+                                              stats.client_ip, client_port, stats)
+        except OSError as err:
+            logger.error(self, "Cannot open a UDP relay: \"{}\".", err)
+            stats.close(CloseReason.ERROR)
+            self._socks_request_send_reply(socket_client, SocksReply.SERVER_FAILURE)
+            return
+
+        try:
+            if self._socks_request_send_reply(socket_client, SocksReply.SUCCEEDED, association.get_address()):
+                # The association lasts as long as the TCP connection of the client
+                with selectors.DefaultSelector() as selector:
+                    selector.register(socket_client, selectors.EVENT_READ)
+                    while not self.STOP:
+                        if selector.select(1) and not socket_client.recv(RELAY_BUFFER_SIZE):
+                            break
+        except OSError as err:
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
+        finally:
+            self.udp_relay.close(association, CloseReason.STOPPED if self.STOP else CloseReason.EOF)
+
+    def _http_request(self, socket_client: socket, parser: HttpParser, stats: TunnelStats) -> (
+            Optional[Link], Optional[int], Optional[socks.socksocket]):
+        try:
+            self._receive_handshake(socket_client, parser, parser.parse_request)
+        except HttpError as err:
+            logger.error(self, "Invalid HTTP proxy request: \"{}\".", err)
+            self._http_send_response(socket_client, err.status)
+            return None
+        except OSError as err:
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
             return None
 
-        if not self._socks_request_send_reply(socket_client, SocksReply.SUCCEEDED):
+        request = Request(parser.domain, parser.port, stats.client_ip)
+        stats.request = request
+        stats.set_handshake_done()
+        connection = self.connector.connect(request, stats)
+        if connection is None:
+            if stats.close_reason == CloseReason.REJECTED:
+                logger.error(self, "No Link available to handle the request.")
+                self._http_send_response(socket_client, HttpStatus.FORBIDDEN)
+            else:
+                self._http_send_response(socket_client, HttpStatus.BAD_GATEWAY)
+            return None
+        link, connection_id, socket_link = connection
+
+        # A forward request is answered by the target itself
+        if (parser.is_connect() and not self._http_send_response(socket_client, HttpStatus.CONNECTION_ESTABLISHED)) or \
+                not self._send_optimistic_data(socket_link, parser, stats):
+            stats.close(CloseReason.ERROR)
             link.close_connection(connection_id)
             return None
 
         return link, connection_id, socket_link
 
+    def _http_send_response(self, socket_client: socket, status: HttpStatus) -> bool:
+        try:
+            socket_client.sendall(build_response(status))
+        except socket.error as err:
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
+            return False
+        return True
+
+    def _send_optimistic_data(self, socket_link: socket, parser: Union[SocksParser, HttpParser],
+                              stats: TunnelStats) -> bool:
+        # The client may send its first data with the request, without waiting for the reply
+        pending = parser.pop_pending()
+        if not pending:
+            return True
+        try:
+            socket_link.sendall(pending)
+        except socket.error as err:
+            logger.error(self, "Socket error while trying to communicate with the link: \"{}\".", err)
+            return False
+        stats.bytes_in += len(pending)
+        metrics.relay_bytes["in"].inc(len(pending))
+        return True
+
     def generate_connection_id(self) -> str:
-        connection_id = str(self._link_counter)
-        self._link_counter += 1
-        return connection_id
+        # next() on a count is atomic, two client threads never get the same id
+        return str(next(self._connection_ids))
 
-    def _accept_client_loop(self, server_socket: socket):
-        logger.info(str(self), "Ready to receive requests.")
+    def _accept_client_loop(self, server_sockets: dict):
+        # Each listening socket comes with the handler of its protocol
+        logger.info(self, "Ready to receive requests.")
         while not self.STOP:
             if threading.active_count() > self.max_threads:
                 sleep(5)  # It means that the thread will take 5 seconds maximum to return
                 continue
 
             try:
-                client_socket, _ = server_socket.accept()
-                client_socket.setblocking(True)
-            except socket.timeout:
-                continue
-            except socket.error:
-                continue
-            except TypeError as err:
-                logger.error(str(self), "Error: \"{}\".".format(err))
-                return
-            exchange_thread = threading.Thread(target=self.handle_request, args=(client_socket,))
-            exchange_thread.start()
-        server_socket.close()
-        logger.info(str(self), "Stopping server.")
+                readable, _, _ = select.select(list(server_sockets), [], [], self.timeout)
+            except (OSError, ValueError) as err:
+                logger.error(self, "Error: \"{}\".", err)
+                break
+            for server_socket in readable:
+                try:
+                    client_socket, address = server_socket.accept()
+                    client_socket.setblocking(True)
+                except socket.error:
+                    continue
+                if not self.accept_client(address[0]):
+                    client_socket.close()
+                    continue
+                exchange_thread = threading.Thread(target=server_sockets[server_socket],
+                                                   args=(client_socket, address[0]))
+                exchange_thread.start()
+        for server_socket in server_sockets:
+            server_socket.close()
+        logger.info(self, "Stopping server.")
 
-    def handle_request(self, socket_client: socket):
-        if not self._socks_sub_negotiation(socket_client):
-            return
-        request = self._socks_request(socket_client)
+    def accept_client(self, client_ip: str) -> bool:
+        if self.client_limiter.acquire(client_ip):
+            return True
+        metrics.clients_refused.inc()
+        logger.warning(self, "Client {} is at its limits, connection refused.", client_ip)
+        return False
+
+    def handle_request(self, socket_client: socket, client_ip=""):
+        self._handle_client(socket_client, client_ip, SocksParser(), self._socks_handshake)
+
+    def handle_http_request(self, socket_client: socket, client_ip=""):
+        self._handle_client(socket_client, client_ip, HttpParser(), self._http_request)
+
+    def _socks_handshake(self, socket_client: socket, parser: SocksParser, stats: TunnelStats) -> (
+            Optional[Link], Optional[int], Optional[socks.socksocket]):
+        if not self._socks_sub_negotiation(socket_client, parser):
+            return None
+        return self._socks_request(socket_client, parser, stats)
+
+    def _handle_client(self, socket_client: socket, client_ip: str, parser: Union[SocksParser, HttpParser],
+                       handshake: Callable):
+        stats = TunnelStats(self._get_client_address(socket_client), client_ip)
+        metrics.open_tunnel()
+        request = handshake(socket_client, parser, stats)
         if request is None:
+            socket_client.close()
+            self.finish_tunnel(stats)
             return
         link, connection_id, socket_link = request
-        self._exchange_with_client(socket_client, socket_link)
+        # The relay has no timeout of its own, the idle and lifetime limits end it by shutting the sockets down
+        watch = self.tunnel_timeouts.watch(stats, lambda: shutdown_sockets(socket_client, socket_link))
+        if self._relay_pool is not None:
+            # The relay workers take over the sockets, this thread is only used for the handshake
+            self._relay_pool.add(socket_client, socket_link,
+                                 lambda: self._close_exchange(socket_client, link, connection_id, stats, watch), stats,
+                                 link.get_bandwidth_bucket())
+            return
+        self._exchange_with_client(socket_client, socket_link, stats, link.get_bandwidth_bucket())
+        self._close_exchange(socket_client, link, connection_id, stats, watch)
+
+    @staticmethod
+    def _get_client_address(socket_client: socket) -> str:
+        try:
+            return "{}:{}".format(*socket_client.getpeername()[:2])
+        except OSError:
+            return ""
+
+    def _close_exchange(self, socket_client: socket, link: Link, connection_id: str, stats: TunnelStats, watch):
+        self.tunnel_timeouts.unwatch(watch)
         socket_client.close()
         link.close_connection(connection_id)
-        return
-
-    def _exchange_with_client(self, socket_client: socket, socket_link: socks.socksocket):
-        while not self.STOP:
-            try:
-                reader, _, _ = select.select([socket_client, socket_link], [], [], socket_link.gettimeout())
-            except select.error as err:
-                logger.error(str(self), "Select failed: \"{}\".".format(err))
-                return
-            if not reader:
-                return
-            try:
-                for sock in reader:
-                    data = sock.recv(2048)
-                    if not data:
-                        return
-                    if sock is socket_link:
-                        socket_client.send(data)
-                    else:
-                        socket_link.send(data)
-            except socket.error as err:
-                logger.error(str(self),
-                             "Socket error while trying to communicate with client: \"{}\".".format(err))
-                return
+        self.finish_tunnel(stats)
+
+    def finish_tunnel(self, stats: TunnelStats):
+        self.client_limiter.release(stats.client_ip)
+        access_log.record(stats)
+        metrics.finish_tunnel(stats)
+
+    def _exchange_with_client(self, socket_client: socket, socket_link: socks.socksocket, stats: TunnelStats,
+                              throttle: Optional[TokenBucket] = None):
+        relay = relay_buffered
+        if self.relay == RelayMode.SPLICE and is_splice_supported():
+            relay = relay_splice
+        try:
+            relay(socket_client, socket_link, lambda: self.STOP, stats, throttle)
+        except (OSError, ValueError) as err:
+            stats.close(CloseReason.ERROR)
+            logger.error(self, "Socket error while trying to communicate with client: \"{}\".", err)
@@ -1,16 +1,63 @@
 from enum import Enum
-from importlib import import_module
-from typing import List, Optional
+from typing import List
 
 from app.server.Link import Link
+from app.server.Request import Request
+from app.server.balancing_strategy import least_connections, least_latency, peak_ewma, power_of_two_choices, \
+    random_link, round_robin
 
 
 class Strategy(str, Enum):
     ROUND_ROBIN = "round_robin"
     RANDOM_LINK = "random_link"
     LEAST_CONNECTIONS = "least_connections"
+    LEAST_LATENCY = "least_latency"
+    PEAK_EWMA = "peak_ewma"
+    POWER_OF_TWO_CHOICES = "power_of_two_choices"
 
 
-def get_next_link(links: List[Link], last_link: Optional[Link], strategy: Strategy):
-    module = import_module(strategy)
-    return module.get_next_link(links, last_link=last_link)
+class Affinity(str, Enum):
+    NONE = "none"
+    CLIENT = "client"
+    DOMAIN = "domain"
+    CLIENT_DOMAIN = "client_domain"
+
+
+def get_affinity_key(affinity: Affinity, request: Request) -> str:
+    if affinity == Affinity.CLIENT:
+        return request.client
+    if affinity == Affinity.DOMAIN:
+        return request.domain
+    if affinity == Affinity.CLIENT_DOMAIN and request.client:
+        return "{} {}".format(request.client, request.domain)
+    return ""
+
+
+class FunctionStrategy:
+    # The latency estimates decay with time, they can't be kept ordered between two picks
+    def __init__(self, links: List[Link], function):
+        self._links = links
+        self._function = function
+
+    def get_next_link(self) -> Link:
+        return self._function(self._links)
+
+    def update(self, link: Link):
+        pass
+
+
+def build_strategy(strategy: Strategy, links: List[Link], is_shared=False):
+    if strategy == Strategy.ROUND_ROBIN:
+        return round_robin.RoundRobin(links)
+    if strategy == Strategy.RANDOM_LINK:
+        return random_link.WeightedRandom(links)
+    if strategy == Strategy.LEAST_CONNECTIONS:
+        if is_shared:
+            # The connections opened by the other processes are not notified, the counts are read on each pick
+            return FunctionStrategy(links, least_connections.get_next_link)
+        return least_connections.LeastConnections(links)
+    if strategy == Strategy.LEAST_LATENCY:
+        return FunctionStrategy(links, least_latency.get_next_link)
+    if strategy == Strategy.PEAK_EWMA:
+        return FunctionStrategy(links, peak_ewma.get_next_link)
+    return FunctionStrategy(links, power_of_two_choices.get_next_link)
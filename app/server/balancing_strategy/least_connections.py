@@ -1,8 +1,65 @@
+import threading
 from typing import List
 
 from app.server.Link import Link
 
 
-def get_next_link(links: List[Link]) -> Link:
-    links_count = [len(link.connections) / link.weight for link in links]
+def get_next_link(links: List[Link], **kwargs) -> Link:
+    links_count = [link.get_connections_count() / link.weight for link in links]
     return links[links_count.index(min(links_count))]
+
+
+class LeastConnections:
+    # Binary heap of the links indexes, the position of each link in the heap is kept so that a change of its
+    # connections count only moves this link
+    def __init__(self, links: List[Link]):
+        self._links = links
+        self._lock = threading.Lock()
+        self._keys = [self._get_key(idx) for idx in range(len(links))]
+        self._heap = sorted(range(len(links)), key=lambda idx: self._keys[idx])
+        self._positions = {idx: position for position, idx in enumerate(self._heap)}
+        self._links_idx = {link: idx for idx, link in enumerate(links)}
+
+    def _get_key(self, idx: int) -> tuple:
+        link = self._links[idx]
+        return link.get_connections_count() / link.weight, idx
+
+    def get_next_link(self) -> Link:
+        with self._lock:
+            return self._links[self._heap[0]]
+
+    def update(self, link: Link):
+        idx = self._links_idx.get(link)
+        if idx is None:
+            return
+        with self._lock:
+            self._keys[idx] = self._get_key(idx)
+            position = self._sift_up(self._positions[idx])
+            self._sift_down(position)
+
+    def _swap(self, position_a: int, position_b: int):
+        heap = self._heap
+        heap[position_a], heap[position_b] = heap[position_b], heap[position_a]
+        self._positions[heap[position_a]] = position_a
+        self._positions[heap[position_b]] = position_b
+
+    def _sift_up(self, position: int) -> int:
+        while position > 0:
+            parent = (position - 1) // 2
+            if self._keys[self._heap[position]] >= self._keys[self._heap[parent]]:
+                break
+            self._swap(position, parent)
+            position = parent
+        return position
+
+    def _sift_down(self, position: int):
+        size = len(self._heap)
+        while True:
+            smallest = position
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < size and self._keys[self._heap[child]] < self._keys[self._heap[smallest]]:
+                    smallest = child
+            if smallest == position:
+                return
+            self._swap(position, smallest)
+            position = smallest
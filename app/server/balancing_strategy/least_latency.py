@@ -0,0 +1,7 @@
+from typing import List
+
+from app.server.Link import Link
+
+
+def get_next_link(links: List[Link], **kwargs) -> Link:
+    return min(links, key=lambda link: link.get_latency_estimate())
@@ -0,0 +1,14 @@
+from typing import List
+
+from app.server.Link import Link
+
+# Keeps the in-flight connections meaningful for links without any latency measured yet
+LATENCY_FLOOR = 0.001
+
+
+def get_cost(link: Link) -> float:
+    return (link.get_latency_estimate() + LATENCY_FLOOR) * (link.get_connections_count() + 1) / link.weight
+
+
+def get_next_link(links: List[Link], **kwargs) -> Link:
+    return min(links, key=get_cost)
@@ -0,0 +1,11 @@
+from random import sample
+from typing import List
+
+from app.server.Link import Link
+from app.server.balancing_strategy.peak_ewma import get_cost
+
+
+def get_next_link(links: List[Link], **kwargs) -> Link:
+    if len(links) == 1:
+        return links[0]
+    return min(sample(links, 2), key=get_cost)
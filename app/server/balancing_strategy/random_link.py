@@ -1,12 +1,20 @@
-from random import choice
+from bisect import bisect_right
+from itertools import accumulate
+from random import random
 from typing import List
 
 from app.server.Link import Link
 
 
-def get_next_link(links: List[Link]) -> Link:
-    weighted_links_idx = []
-    for idx, element in enumerate(links):
-        for _ in range(0, element.weight):
-            weighted_links_idx.append(idx)
-    return links[choice(weighted_links_idx)]
\ No newline at end of file
+class WeightedRandom:
+    # The cumulated weights are computed once, a pick is a binary search in them
+    def __init__(self, links: List[Link]):
+        self._links = links
+        self._cumulated_weights = list(accumulate(link.weight for link in links))
+
+    def get_next_link(self) -> Link:
+        idx = bisect_right(self._cumulated_weights, random() * self._cumulated_weights[-1])
+        return self._links[min(idx, len(self._links) - 1)]
+
+    def update(self, link: Link):
+        pass
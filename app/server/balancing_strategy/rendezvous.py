@@ -0,0 +1,40 @@
+import hashlib
+import math
+from typing import List
+
+from app.server.Link import Link
+
+
+def _get_score(link_key: bytes, weight: int, key: bytes) -> float:
+    # Weighted rendezvous hashing: the hash is mapped to ]0, 1[ and the link with the highest score gets the key
+    digest = hashlib.blake2b(link_key + b'\x00' + key, digest_size=8).digest()
+    uniform = (int.from_bytes(digest, "big") + 1) / (2 ** 64 + 2)
+    return weight / -math.log(uniform)
+
+
+class Rendezvous:
+    # A key always goes to the same link while it is available, when a link goes down only its keys move to the others
+    def __init__(self, links: List[Link]):
+        self._links = links
+        self._link_keys = []
+        for link_idx, link in enumerate(links):
+            # The upstream identifies a link whatever its position, the occurrence separates the identical ones
+            upstream_key = link.get_upstream_key()
+            occurrence = sum(1 for other_link in links[:link_idx] if other_link.get_upstream_key() == upstream_key)
+            self._link_keys.append("{}#{}".format(upstream_key, occurrence).encode())
+
+    def _get_scores(self, key: str) -> List[float]:
+        key = key.encode()
+        return [_get_score(link_key, link.weight, key) for link_key, link in zip(self._link_keys, self._links)]
+
+    def get_next_link(self, key: str) -> Link:
+        scores = self._get_scores(key)
+        return self._links[scores.index(max(scores))]
+
+    def get_ranked_links(self, key: str) -> List[Link]:
+        # Order in which the key goes to the links when the ones before are not available
+        scores = self._get_scores(key)
+        return [self._links[idx] for idx in sorted(range(len(scores)), key=lambda idx: -scores[idx])]
+
+    def update(self, link: Link):
+        pass
@@ -1,11 +1,17 @@
+from itertools import count
 from typing import List
 
 from app.server.Link import Link
 
 
-def get_next_link(links: List[Link], **kwargs) -> Link:
-    last_link = kwargs.get('last_link', None)
-    if last_link is None:
-        return links[0]
-    next_link_idx = (links.index(last_link) + 1) % len(links)
-    return links[next_link_idx]
\ No newline at end of file
+class RoundRobin:
+    def __init__(self, links: List[Link]):
+        self._links = links
+        # next() on a count is atomic, the accepting threads share it without a lock
+        self._counter = count()
+
+    def get_next_link(self) -> Link:
+        return self._links[next(self._counter) % len(self._links)]
+
+    def update(self, link: Link):
+        pass
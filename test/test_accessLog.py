@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from app.server.AccessLog import AccessLog, CloseReason, TunnelStats
+from app.server.Link import Link
+from app.server.Request import Request
+
+
+class TestAccessLog(TestCase):
+    def setUp(self):
+        self.output = tempfile.NamedTemporaryFile(delete=False).name
+
+    def tearDown(self):
+        os.remove(self.output)
+
+    def test_should_write_one_json_line_per_tunnel(self):
+        access_log = AccessLog(self.output)
+        stats = TunnelStats("127.0.0.1:4000")
+        stats.request = Request("example.org", 443)
+        stats.link = Link()
+        stats.bytes_in = 10
+        stats.bytes_out = 20
+        stats.close(CloseReason.EOF)
+        stats.close(CloseReason.ERROR)
+
+        access_log.record(stats)
+        self.assertTrue(access_log.flush())
+
+        with open(self.output) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["client"], "127.0.0.1:4000")
+        self.assertEqual(records[0]["link"], "Link:1")
+        self.assertEqual(records[0]["request"], "example.org:443")
+        self.assertEqual(records[0]["bytes_in"], 10)
+        self.assertEqual(records[0]["bytes_out"], 20)
+        self.assertEqual(records[0]["close_reason"], "eof")
+
+    def test_should_not_write_tunnel_without_request(self):
+        access_log = AccessLog(self.output)
+
+        access_log.record(TunnelStats())
+        self.assertTrue(access_log.flush())
+
+        with open(self.output) as file:
+            self.assertEqual(file.read(), "")
+
+    def test_should_count_dropped_records(self):
+        access_log = AccessLog(self.output, max_pending=1)
+        access_log._writer_thread = True  # No writer, the queue stays full
+        stats = TunnelStats()
+        stats.request = Request("example.org", 443)
+
+        access_log.record(stats)
+        access_log.record(stats)
+        access_log.record(stats)
+
+        self.assertEqual(access_log.dropped, 2)
+        self.assertEqual(access_log._pop_dropped(), 2)
+        self.assertEqual(access_log._pop_dropped(), 0)
+        access_log._writer_thread = None
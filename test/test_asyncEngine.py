@@ -0,0 +1,78 @@
+import socket
+import threading
+from unittest import TestCase
+
+import socks
+
+from app.server import Server, ServerMode
+from app.server.Balancer import Balancer
+from app.server.Link import Link
+
+
+def _get_free_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _start_echo_server() -> socket.socket:
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+
+    def echo(sock: socket.socket):
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            sock.sendall(data)
+        sock.close()
+
+    def accept():
+        while True:
+            try:
+                sock, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=echo, args=(sock,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server
+
+
+class TestAsyncEngine(TestCase):
+    def setUp(self):
+        self.echo_server = _start_echo_server()
+        self.server = Server(domain="127.0.0.1", port=_get_free_port(), timeout=1, mode=ServerMode.ASYNCIO)
+        self.server.set_balancer(Balancer().add_link(Link(timeout=5)))
+        # The links are not checked, they would be marked down without network access
+        self.assertTrue(self.server._start_server(check_links=False))
+
+    def tearDown(self):
+        self.server.stop()
+        self.server._server_thread.join(5)
+        self.echo_server.close()
+
+    def test_should_relay_the_data_both_ways(self):
+        client = socks.socksocket()
+        client.set_proxy(socks.SOCKS5, "127.0.0.1", self.server.port)
+        client.settimeout(5)
+        client.connect(self.echo_server.getsockname())
+        payload = bytes(range(256)) * 2000
+
+        sender = threading.Thread(target=client.sendall, args=(payload,))
+        sender.start()
+        received = b''
+        while len(received) < len(payload):
+            data = client.recv(65536)
+            if not data:
+                break
+            received += data
+        sender.join(5)
+
+        self.assertEqual(received, payload)
+        client.shutdown(socket.SHUT_WR)
+        self.assertEqual(client.recv(65536), b'')
+        client.close()
@@ -2,7 +2,10 @@ from unittest import TestCase
 
 from RequestMatcher import RequestMatcher, Policy
 from app.server.Balancer import Balancer, Strategy
-from app.server.Link import Link
+from app.server.balancing_strategy import Affinity
+from app.server.Link import Link, PriorityLevel
+from app.server.Metrics import metrics
+from app.server.RateLimit import LinkLimits
 from app.server.Request import Request
 
 
@@ -57,3 +60,73 @@ class TestBalancer(TestCase):
 
         should_be_link = balancer.get_next_link(Request('test', 80))
         self.assertEqual(expected_link, should_be_link)
+
+    def test_should_use_link_matchers_added_after_the_link(self):
+        link = Link(domain="Link1", port=1080)
+
+        balancer = Balancer() \
+            .set_strategy(Strategy.ROUND_ROBIN) \
+            .add_link(link)
+        self.assertEqual(link, balancer.get_next_link(Request('test', 80)))
+
+        link.add_request_matcher(RequestMatcher(policy=Policy.FORBID).add_port(80))
+        self.assertIsNone(balancer.get_next_link(Request('test', 80)))
+
+    def test_should_not_use_cached_routing_after_link_status_change(self):
+        first_link = Link(domain="Link1", port=1080)
+        second_link = Link(domain="Link2", port=1081)
+
+        balancer = Balancer() \
+            .set_strategy(Strategy.ROUND_ROBIN) \
+            .add_link(first_link) \
+            .add_link(second_link)
+        self.assertEqual(balancer.get_link_ids_for_request(Request('test', 80)), ([], [0, 1], []))
+
+        first_link.status = False
+        self.assertEqual(balancer.get_link_ids_for_request(Request('test', 80)), ([], [1], []))
+        self.assertEqual(balancer.get_next_link(Request('test', 80)), second_link)
+
+    def test_should_keep_the_routing_index_after_link_status_change(self):
+        link = Link(domain="Link1", port=1080).add_request_matcher(
+            RequestMatcher(policy=Policy.ALLOW).add_domain_re(r'^test$'))
+        balancer = Balancer().add_link(link)
+        balancer.get_next_link(Request('test', 80))
+        routing_index = balancer._get_routing_index()
+
+        link.status = False
+        link.record_failure()
+        self.assertIs(balancer._get_routing_index(), routing_index)
+        self.assertEqual(len(balancer.get_routing_cache()), 0)
+
+        link.add_request_matcher(RequestMatcher(policy=Policy.FORBID).add_port(22))
+        self.assertIsNot(balancer._get_routing_index(), routing_index)
+
+    def test_should_keep_the_link_of_a_client_with_affinity(self):
+        links = [Link(domain="Link{}".format(idx), port=1080) for idx in range(3)]
+        balancer = Balancer().set_affinity(Affinity.CLIENT).add_links(links)
+
+        first_link = balancer.get_next_link(Request('test', 80, "10.0.0.1"))
+
+        for domain in ("test", "other", "another"):
+            self.assertEqual(balancer.get_next_link(Request(domain, 443, "10.0.0.1")), first_link)
+        other_links = [link for link in links if link is not first_link]
+        self.assertIn(balancer.get_next_link(Request('test', 80, "10.0.0.1"), [first_link]), other_links)
+
+        first_link.status = False
+        self.assertIn(balancer.get_next_link(Request('test', 80, "10.0.0.1")), other_links)
+
+    def test_should_skip_links_at_their_limits_with_the_strategy_of_the_level(self):
+        links = [Link(domain="Link{}".format(idx), port=1080).set_limits(LinkLimits(max_connections=1))
+                 for idx in range(4)]
+        balancer = Balancer().add_links(links)
+        request = Request('test', 80)
+        decisions = metrics.routing_decisions[PriorityLevel.NORMAL].get()
+
+        for link in links[:3]:
+            link.open_connection("1")
+        for _ in range(5):
+            self.assertIs(balancer.get_next_link(request), links[3])
+        self.assertIsNone(balancer.get_next_link(request, [links[3]]))
+
+        self.assertEqual(len(balancer._strategies), 1)
+        self.assertEqual(metrics.routing_decisions[PriorityLevel.NORMAL].get() - decisions, 5)
@@ -0,0 +1,103 @@
+import socket
+from time import sleep
+from unittest import TestCase
+
+import socks
+
+from app.server.Balancer import Balancer
+from app.server.CircuitBreaker import CircuitBreaker, CircuitState
+from app.server.Link import Link, PriorityLevel, is_link_failure
+from app.server.Request import Request
+
+
+class TestCircuitBreaker(TestCase):
+    def test_should_open_after_consecutive_failures(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=2)
+
+        self.assertFalse(circuit_breaker.record_failure())
+        circuit_breaker.record_success()
+        self.assertFalse(circuit_breaker.record_failure())
+        self.assertTrue(circuit_breaker.record_failure())
+
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.OPEN)
+        self.assertFalse(circuit_breaker.is_request_allowed())
+
+    def test_should_be_half_open_after_open_time(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, open_time=0)
+        circuit_breaker.record_failure()
+
+        self.assertTrue(circuit_breaker.update())
+
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.HALF_OPEN)
+
+    def test_should_open_again_on_half_open_failure(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=3, open_time=0)
+        for _ in range(3):
+            circuit_breaker.record_failure()
+        circuit_breaker.update()
+
+        self.assertTrue(circuit_breaker.record_failure())
+
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.OPEN)
+
+    def test_should_close_after_ramp(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, open_time=0, ramp_time=0)
+        circuit_breaker.record_failure()
+        circuit_breaker.update()
+
+        self.assertTrue(circuit_breaker.is_request_allowed())
+        self.assertTrue(circuit_breaker.record_success())
+
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.CLOSED)
+
+    def test_link_should_be_forbidden_while_open(self):
+        link = Link()
+        link.circuit_breaker = CircuitBreaker(failure_threshold=1)
+
+        link.record_failure()
+
+        self.assertEqual(link.get_request_priority_level(Request("test", 80)), PriorityLevel.FORBID)
+
+    def test_balancer_should_route_again_to_half_open_link(self):
+        link_1 = Link()
+        link_1.circuit_breaker = CircuitBreaker(failure_threshold=1, open_time=1, ramp_time=0)
+        link_2 = Link()
+        balancer = Balancer().add_links([link_1, link_2])
+        request = Request("test", 80)
+
+        link_1.record_failure()
+        self.assertEqual(balancer.get_link_ids_for_request(request), ([], [1], []))
+
+        sleep(1.1)
+        self.assertEqual(balancer.get_link_ids_for_request(request), ([], [0, 1], []))
+
+    def test_should_stay_closed_when_the_targets_refuse_the_connections(self):
+        link = Link(timeout=1)
+        link.circuit_breaker.failure_threshold = 2
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        port = server.getsockname()[1]
+        server.close()
+
+        for connection_id in range(5):
+            link.open_connection(str(connection_id))
+            with self.assertRaises(OSError):
+                link.connect(str(connection_id), ("127.0.0.1", port))
+            link.close_connection(str(connection_id))
+
+        self.assertEqual(link.circuit_breaker.get_state(), CircuitState.CLOSED)
+
+    def test_should_only_count_the_errors_of_the_link(self):
+        self.assertTrue(is_link_failure(socks.ProxyConnectionError("Error connecting to SOCKS5 proxy")))
+        self.assertTrue(is_link_failure(socks.GeneralProxyError("Socket error", socket.timeout("timed out"))))
+        self.assertTrue(is_link_failure(socks.SOCKS5AuthError("SOCKS5 authentication failed")))
+        self.assertTrue(is_link_failure(socks.SOCKS5Error("0x01: General SOCKS server failure")))
+        self.assertTrue(is_link_failure(socks.HTTPError("407: Proxy Authentication Required")))
+        self.assertFalse(is_link_failure(socks.GeneralProxyError("Socket error",
+                                                                 socks.SOCKS5Error("0x05: Connection refused"))))
+        self.assertFalse(is_link_failure(socks.HTTPError("502: Bad Gateway")))
+        self.assertFalse(is_link_failure(socket.gaierror(-2, "Name or service not known")))
+        self.assertFalse(is_link_failure(ConnectionRefusedError(111, "Connection refused")))
+        self.assertTrue(is_link_failure(socket.timeout("Timed out while connecting to 10.0.0.1.")))
+        self.assertTrue(is_link_failure(TimeoutError(110, "Connection timed out")))
+        self.assertTrue(is_link_failure(OSError(100, "Network is down")))
@@ -0,0 +1,37 @@
+import threading
+from unittest import TestCase
+
+from app.server.ConnectionRegistry import ConnectionRegistry
+
+
+class TestConnectionRegistry(TestCase):
+    def test_should_refuse_an_id_already_in_use(self):
+        registry = ConnectionRegistry()
+
+        self.assertTrue(registry.add("1", "a"))
+        self.assertFalse(registry.add("1", "b"))
+        self.assertEqual(registry["1"], "a")
+
+    def test_should_pop_connection(self):
+        registry = ConnectionRegistry()
+        registry.add("1", "a")
+
+        self.assertEqual(registry.pop("1"), "a")
+        self.assertIsNone(registry.pop("1"))
+        self.assertFalse("1" in registry)
+
+    def test_should_count_connections_added_concurrently(self):
+        registry = ConnectionRegistry()
+
+        def add_connections(thread_idx: int):
+            for idx in range(1000):
+                registry.add("{}-{}".format(thread_idx, idx), idx)
+
+        threads = [threading.Thread(target=add_connections, args=(thread_idx,)) for thread_idx in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(registry), 8000)
+        self.assertEqual(len(registry.keys()), 8000)
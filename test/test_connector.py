@@ -0,0 +1,83 @@
+import itertools
+import socket
+from time import sleep
+from unittest import TestCase
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Balancer import Balancer
+from app.server.Connector import Connector
+from app.server.Link import Link
+from app.server.Request import Request
+
+
+class FakeLink(Link):
+    def __init__(self, delay=0.0, error=False):
+        super().__init__()
+        self.delay = delay
+        self.error = error
+        self.closed = []
+
+    def open_connection(self, connection_id: str, prewarmed=True):
+        return True
+
+    def connect(self, connection_id: str, address: tuple, timeout=None):
+        sleep(self.delay)
+        if self.error:
+            raise socket.error("Connection refused.")
+        return "socket"
+
+    def close_connection(self, connection_id: str):
+        self.closed.append(connection_id)
+        return self
+
+
+class FakeServer:
+    def __init__(self, balancer: Balancer):
+        self.balancer = balancer
+        self._ids = itertools.count()
+
+    def __str__(self):
+        return "FakeServer"
+
+    def generate_connection_id(self) -> str:
+        return str(next(self._ids))
+
+
+class TestConnector(TestCase):
+    def test_should_fail_over_to_the_next_link(self):
+        failing_link = FakeLink(error=True)
+        working_link = FakeLink()
+        connector = Connector(FakeServer(Balancer().add_links([failing_link, working_link])))
+        stats = TunnelStats()
+
+        link, _, _ = connector.connect(Request("test", 80), stats)
+
+        self.assertEqual(link, working_link)
+        self.assertEqual(stats.link, working_link)
+        self.assertEqual(len(failing_link.closed), 1)
+
+    def test_should_give_up_after_connect_attempts(self):
+        links = [FakeLink(error=True), FakeLink(error=True), FakeLink()]
+        connector = Connector(FakeServer(Balancer(connect_attempts=2).add_links(links)))
+        stats = TunnelStats()
+
+        self.assertIsNone(connector.connect(Request("test", 80), stats))
+        self.assertEqual(stats.close_reason, CloseReason.CONNECT_ERROR)
+
+    def test_should_reject_when_no_link(self):
+        connector = Connector(FakeServer(Balancer()))
+        stats = TunnelStats()
+
+        self.assertIsNone(connector.connect(Request("test", 80), stats))
+        self.assertEqual(stats.close_reason, CloseReason.REJECTED)
+
+    def test_should_race_another_link_after_hedge_delay(self):
+        slow_link = FakeLink(delay=0.5)
+        fast_link = FakeLink()
+        connector = Connector(FakeServer(Balancer(hedge_delay=50).add_links([slow_link, fast_link])))
+
+        link, _, _ = connector.connect(Request("test", 80), TunnelStats())
+
+        self.assertEqual(link, fast_link)
+        sleep(0.6)
+        self.assertEqual(len(slow_link.closed), 1)
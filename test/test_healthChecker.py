@@ -0,0 +1,45 @@
+import threading
+from time import monotonic, sleep
+from unittest import TestCase
+
+from app.server.HealthChecker import HealthChecker
+from app.server.Link import Link
+
+
+class SlowLink(Link):
+    def __init__(self, duration: float, **kwargs):
+        super().__init__(**kwargs)
+        self.duration = duration
+        self.checks = 0
+        self.checked = threading.Event()
+
+    def update_latency_and_status(self):
+        sleep(self.duration)
+        self.checks += 1
+        self.checked.set()
+
+
+class TestHealthChecker(TestCase):
+    def test_should_check_links_in_parallel(self):
+        links = [SlowLink(0.3) for _ in range(5)]
+        health_checker = HealthChecker(workers=5)
+
+        s_time = monotonic()
+        health_checker.check_links(links)
+
+        self.assertLess(monotonic() - s_time, 1)
+        self.assertTrue(all(link.checks == 1 for link in links))
+        health_checker.shutdown()
+
+    def test_should_not_wait_for_slow_links_to_check_the_others(self):
+        slow_link = SlowLink(1, check_interval=0, check_jitter=0)
+        fast_link = SlowLink(0, check_interval=0, check_jitter=0)
+        health_checker = HealthChecker(workers=2)
+
+        for _ in range(10):
+            health_checker.check_due_links([slow_link, fast_link])
+            sleep(0.05)
+
+        self.assertGreater(fast_link.checks, 1)
+        self.assertEqual(slow_link.checks, 0)
+        health_checker.shutdown()
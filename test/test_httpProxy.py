@@ -0,0 +1,87 @@
+from unittest import TestCase
+
+from app.server.HttpProxy import HttpError, HttpParser, HttpStatus, build_response
+
+CONNECT = b'CONNECT example.org:443 HTTP/1.1\r\nHost: example.org:443\r\n\r\n'
+FORWARD = b'GET http://example.org:8080/path?query=1 HTTP/1.1\r\nHost: example.org:8080\r\n' \
+          b'Proxy-Connection: keep-alive\r\nAccept: */*\r\n\r\n'
+
+
+class TestHttpParser(TestCase):
+    def test_should_parse_a_connect_request_and_keep_the_optimistic_data(self):
+        parser = HttpParser()
+        parser.feed(CONNECT + b'\x16\x03\x01')
+
+        self.assertTrue(parser.parse_request())
+        self.assertTrue(parser.is_connect())
+        self.assertEqual((parser.domain, parser.port), ("example.org", 443))
+        self.assertEqual(parser.pop_pending(), b'\x16\x03\x01')
+
+    def test_should_wait_for_the_whole_head(self):
+        parser = HttpParser()
+
+        for byte in CONNECT[:-1]:
+            parser.feed(bytes([byte]))
+            self.assertFalse(parser.parse_request())
+        parser.feed(CONNECT[-1:])
+
+        self.assertTrue(parser.parse_request())
+        self.assertEqual(parser.domain, "example.org")
+
+    def test_should_rewrite_a_forward_request_for_the_target(self):
+        parser = HttpParser()
+        parser.feed(FORWARD + b'body')
+
+        self.assertTrue(parser.parse_request())
+        self.assertFalse(parser.is_connect())
+        self.assertEqual((parser.domain, parser.port), ("example.org", 8080))
+        self.assertEqual(parser.pop_pending(), b'GET /path?query=1 HTTP/1.1\r\nHost: example.org:8080\r\n'
+                                              b'Accept: */*\r\nConnection: close\r\n\r\nbody')
+
+    def test_should_strip_the_headers_listed_in_connection(self):
+        parser = HttpParser()
+        parser.feed(b'GET http://example.org/ HTTP/1.1\r\nConnection: Keep-Alive, X-Hop\r\nX-Hop: 1\r\n'
+                    b'Keep-Alive: timeout=5\r\nTE: trailers\r\nUpgrade: h2c\r\nTrailer: X-Sum\r\nAccept: */*\r\n\r\n')
+
+        self.assertTrue(parser.parse_request())
+        self.assertEqual(parser.pop_pending(), b'GET / HTTP/1.1\r\nHost: example.org\r\nAccept: */*\r\n'
+                                              b'Connection: close\r\n\r\n')
+
+    def test_should_write_the_host_of_the_target(self):
+        parser = HttpParser()
+        parser.feed(b'GET http://user@example.org:8080/ HTTP/1.1\r\nHost: other.org\r\n\r\n')
+
+        self.assertTrue(parser.parse_request())
+        self.assertEqual((parser.domain, parser.port), ("example.org", 8080))
+        self.assertEqual(parser.pop_pending(), b'GET / HTTP/1.1\r\nHost: example.org:8080\r\nConnection: close\r\n\r\n')
+
+    def test_should_parse_ipv6_targets(self):
+        parser = HttpParser()
+        parser.feed(b'CONNECT [::1]:8443 HTTP/1.1\r\n\r\nGET http://[::1]/ HTTP/1.0\r\n\r\n')
+
+        self.assertTrue(parser.parse_request())
+        self.assertEqual((parser.domain, parser.port), ("::1", 8443))
+        self.assertTrue(parser.parse_request())
+        self.assertEqual((parser.domain, parser.port), ("::1", 80))
+
+    def test_should_refuse_invalid_requests(self):
+        for head in [b'GET / HTTP/1.1\r\n\r\n', b'GET ftp://example.org/ HTTP/1.1\r\n\r\n',
+                     b'CONNECT example.org:http HTTP/1.1\r\n\r\n', b'CONNECT example.org:443\r\n\r\n',
+                     b'CONNECT example.org:443 HTTP/1.1\r\nHost\r\n\r\n']:
+            parser = HttpParser()
+            parser.feed(head)
+            with self.assertRaises(HttpError):
+                parser.parse_request()
+
+    def test_should_refuse_a_head_larger_than_the_buffer(self):
+        parser = HttpParser(64)
+        parser.feed(b'GET http://example.org/ HTTP/1.1\r\n' + b'X: y\r\n' * 5)
+
+        with self.assertRaises(HttpError) as context:
+            parser.parse_request()
+        self.assertEqual(context.exception.status, HttpStatus.HEADER_FIELDS_TOO_LARGE)
+
+    def test_should_build_the_responses(self):
+        self.assertEqual(build_response(HttpStatus.CONNECTION_ESTABLISHED),
+                         b'HTTP/1.1 200 Connection established\r\n\r\n')
+        self.assertTrue(build_response(HttpStatus.BAD_GATEWAY).startswith(b'HTTP/1.1 502 Bad Gateway\r\n'))
@@ -6,6 +6,7 @@ from app.server.Link import Link, PriorityLevel
 from app.server.Logger import Logger
 from app.server.Request import Request
 from app.server.RequestMatcher import RequestMatcher, Policy
+from app.server.SharedState import SharedLinkState
 
 
 class TestLink(TestCase):
@@ -93,3 +94,18 @@ class TestLink(TestCase):
         link.close_connection("1")
         self.assertEqual(len(link.connections), 0)
         self.assertTrue(socket_connection._closed)
+
+    def test_shared_state_should_be_seen_by_every_copy_of_the_link(self):
+        shared_state = SharedLinkState(1)
+        link_in_process_1 = Link().attach_shared_state(shared_state, 0)
+        link_in_process_2 = Link().attach_shared_state(shared_state, 0)
+
+        link_in_process_1.open_connection("1")
+        link_in_process_2.open_connection("1")
+        self.assertEqual(link_in_process_1.get_connections_count(), 2)
+
+        link_in_process_2.close_connection("1")
+        self.assertEqual(link_in_process_1.get_connections_count(), 1)
+
+        link_in_process_1.status = False
+        self.assertFalse(link_in_process_2.status)
@@ -0,0 +1,127 @@
+import os
+import socket
+import threading
+from time import monotonic
+from unittest import TestCase
+
+import socks
+
+from app.server.LinkPool import LinkPool, PrewarmedSocket
+
+
+class FakePrewarmedSocket:
+    def __init__(self, age=0, alive=True):
+        self.prewarmed_at = monotonic() - age
+        self.alive = alive
+        self.closed = False
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+    def close(self):
+        self.closed = True
+
+
+def _start_proxy(exchanges: list) -> int:
+    # Answers each expected message of a single client with the given reply, then echoes
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def serve():
+        client, _ = server.accept()
+        for expected, reply in exchanges:
+            received = b''
+            while len(received) < len(expected):
+                received += client.recv(len(expected) - len(received))
+            client.sendall(reply if received == expected else b'')
+        try:
+            data = client.recv(65536)
+            while data:
+                client.sendall(data)
+                data = client.recv(65536)
+        except OSError:
+            pass
+        client.close()
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def _build_socket(proxy_type: int, port: int) -> PrewarmedSocket:
+    sock = PrewarmedSocket()
+    sock.set_proxy(proxy_type, "127.0.0.1", port)
+    sock.settimeout(2)
+    return sock
+
+
+class TestLinkPool(TestCase):
+    def test_should_return_none_when_pool_is_empty(self):
+        pool = LinkPool(size=2)
+
+        self.assertIsNone(pool.acquire())
+
+    def test_should_skip_and_close_expired_or_dead_sockets(self):
+        pool = LinkPool(size=3, idle_ttl=30)
+        usable = FakePrewarmedSocket()
+        dead = FakePrewarmedSocket(alive=False)
+        expired = FakePrewarmedSocket(age=60)
+        pool._sockets.extend([usable, dead, expired])
+
+        self.assertIs(pool.acquire(), usable)
+        self.assertTrue(dead.closed)
+        self.assertTrue(expired.closed)
+        self.assertFalse(usable.closed)
+        self.assertIsNone(pool.acquire())
+
+    def test_should_connect_a_prewarmed_socks5_socket(self):
+        port = _start_proxy([(b'\x05\x01\x00', b'\x05\x00'),
+                             (b'\x05\x01\x00\x03\x0bexample.org\x01\xbb', b'\x05\x00\x00\x01\x7f\x00\x00\x01\x10\x00')])
+        sock = _build_socket(socks.SOCKS5, port)
+        sock.prewarm()
+        self.assertTrue(sock.is_alive())
+
+        sock.connect(("example.org", 443))
+
+        self.assertEqual(sock.proxy_sockname, ("127.0.0.1", 4096))
+        sock.sendall(b'data')
+        self.assertEqual(sock.recv(4), b'data')
+        sock.close()
+
+    def test_should_raise_the_reply_of_the_socks5_proxy(self):
+        port = _start_proxy([(b'\x05\x01\x00', b'\x05\x00'),
+                             (b'\x05\x01\x00\x01\x7f\x00\x00\x01\x00\x50',
+                              b'\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00')])
+        sock = _build_socket(socks.SOCKS5, port)
+        sock.prewarm()
+
+        with self.assertRaises(socks.SOCKS5Error) as context:
+            sock.connect(("127.0.0.1", 80))
+        self.assertTrue(context.exception.msg.startswith("0x05"))
+
+    def test_should_connect_a_prewarmed_http_socket(self):
+        port = _start_proxy([(b'CONNECT example.org:443 HTTP/1.1\r\nHost: example.org:443\r\n\r\n',
+                              b'HTTP/1.1 200 Connection established\r\n\r\nbanner')])
+        sock = _build_socket(socks.HTTP, port)
+        sock.prewarm()
+
+        sock.connect(("example.org", 443))
+
+        self.assertEqual(sock.recv(6), b'banner')
+        sock.close()
+
+    def test_should_see_a_live_socket_above_descriptor_1024(self):
+        port = _start_proxy([])
+        descriptors = []
+        while not descriptors or descriptors[-1] < 1024:
+            descriptors.append(os.open(os.devnull, os.O_RDONLY))
+        try:
+            sock = _build_socket(socks.HTTP, port)
+            sock.prewarm()
+            self.assertGreater(sock.fileno(), 1024)
+            self.assertTrue(sock.is_alive())
+            sock.close()
+        finally:
+            for descriptor in descriptors:
+                os.close(descriptor)
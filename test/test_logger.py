@@ -0,0 +1,50 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from app.server.Logger import Logger
+
+
+class TestLogger(TestCase):
+    def setUp(self):
+        self.output = tempfile.NamedTemporaryFile(delete=False).name
+
+    def tearDown(self):
+        os.remove(self.output)
+
+    def _read_output(self) -> str:
+        with open(self.output) as file:
+            return file.read()
+
+    def test_should_format_message_in_writer(self):
+        logger = Logger(self.output)
+
+        logger.error("Key", "Value {} {}.", 1, "a")
+        logger.info("Key", "No {} argument.")
+
+        self.assertTrue(logger.flush())
+        content = self._read_output()
+        self.assertIn("-[Key]: Value 1 a.", content)
+        self.assertIn("-[Key]: No {} argument.", content)
+
+    def test_should_skip_disabled_level(self):
+        logger = Logger(self.output, info=False)
+
+        logger.info("Key", "Info.")
+        logger.warning("Key", "Warning.")
+
+        self.assertTrue(logger.flush())
+        content = self._read_output()
+        self.assertNotIn("Info.", content)
+        self.assertIn("Warning.", content)
+
+    def test_should_count_dropped_messages(self):
+        logger = Logger(self.output, max_pending=1)
+        logger._writer_thread = True  # No writer, the queue stays full
+
+        logger.error("Key", "First.")
+        logger.error("Key", "Second.")
+        logger.error("Key", "Third.")
+
+        self.assertEqual(logger.dropped, 2)
+        logger._writer_thread = None
@@ -0,0 +1,56 @@
+import threading
+from unittest import TestCase
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Link import Link
+from app.server.Metrics import Counter, Histogram, Metrics
+
+
+class TestMetrics(TestCase):
+    def test_should_count_increments_from_several_threads(self):
+        counter = Counter()
+
+        def increment():
+            for _ in range(10000):
+                counter.inc()
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.get(), 80000)
+
+    def test_histogram_should_return_cumulated_buckets(self):
+        histogram = Histogram((1, 2))
+
+        histogram.observe(0.5)
+        histogram.observe(1)
+        histogram.observe(1.5)
+        histogram.observe(3)
+
+        cumulated, count, total = histogram.get()
+        self.assertEqual(cumulated, [2, 3, 4])
+        self.assertEqual(count, 4)
+        self.assertEqual(total, 6)
+
+    def test_should_render_tunnels_and_links(self):
+        metrics = Metrics()
+        stats = TunnelStats()
+        stats.close(CloseReason.REJECTED)
+        metrics.open_tunnel()
+        metrics.open_tunnel()
+        metrics.finish_tunnel(stats)
+        metrics.relay_bytes["in"].inc(100)
+        link = Link()
+        link.open_connection("1")
+
+        actual = metrics.render([link])
+
+        self.assertIn("pythtrt_connections_accepted_total 2\n", actual)
+        self.assertIn("pythtrt_connections_active 1\n", actual)
+        self.assertIn("pythtrt_connections_rejected_total 1\n", actual)
+        self.assertIn("pythtrt_relay_bytes_total{direction=\"in\"} 100\n", actual)
+        self.assertIn("pythtrt_link_connections{id=\"0\",link=\"Link:1\"} 1\n", actual)
+        self.assertIn("pythtrt_link_up{id=\"0\",link=\"Link:1\"} 1\n", actual)
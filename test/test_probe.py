@@ -0,0 +1,76 @@
+import socket
+import threading
+from unittest import TestCase
+
+from app.server.Link import Link, Protocol
+from app.server.Probe import Probe, ProbeResults, ProbeType
+
+
+class TestProbe(TestCase):
+    def setUp(self) -> None:
+        self.server_socket = socket.socket()
+        self.server_socket.bind(("127.0.0.1", 0))
+        self.server_socket.listen(5)
+        self.port = self.server_socket.getsockname()[1]
+        self.received = []
+
+    def tearDown(self) -> None:
+        self.server_socket.close()
+
+    def _answer_once(self, answer: bytes):
+        def serve():
+            client, _ = self.server_socket.accept()
+            self.received.append(client.recv(1024))
+            client.sendall(answer)
+            client.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+
+    def test_tcp_probe_should_only_connect(self):
+        link = Link().set_probe(Probe(ProbeType.TCP, "127.0.0.1", self.port))
+
+        link.update_latency_and_status()
+
+        self.assertTrue(link.status)
+
+    def test_socks_probe_should_only_greet_the_proxy(self):
+        self._answer_once(b'\x05\x00')
+        link = Link(protocol=Protocol.SOCKS5, domain="127.0.0.1", port=self.port).set_probe(Probe(ProbeType.SOCKS))
+
+        link.update_latency_and_status()
+
+        self.assertTrue(link.status)
+        self.assertEqual(self.received, [b'\x05\x01\x00'])
+
+    def test_http_probe_should_mark_link_down_without_answer(self):
+        self._answer_once(b'')
+        link = Link().set_probe(Probe(ProbeType.HTTP, "127.0.0.1", self.port, cache_ttl=0))
+
+        link.update_latency_and_status()
+
+        self.assertFalse(link.status)
+
+
+class TestProbeResults(TestCase):
+    def test_should_reuse_result_for_the_same_upstream(self):
+        probe_results = ProbeResults()
+        calls = []
+
+        def run() -> float:
+            calls.append(1)
+            return 0.1
+
+        self.assertEqual(probe_results.get_or_run("upstream", 10, run), 0.1)
+        self.assertEqual(probe_results.get_or_run("upstream", 10, run), 0.1)
+        self.assertEqual(len(calls), 1)
+
+    def test_should_reuse_errors_for_the_same_upstream(self):
+        probe_results = ProbeResults()
+
+        def run() -> float:
+            raise socket.error("unreachable")
+
+        with self.assertRaises(socket.error):
+            probe_results.get_or_run("upstream", 10, run)
+        with self.assertRaises(socket.error):
+            probe_results.get_or_run("upstream", 10, lambda: 0.1)
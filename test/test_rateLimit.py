@@ -0,0 +1,94 @@
+import socket
+from time import monotonic
+from unittest import TestCase
+
+from app.server.Balancer import Balancer
+from app.server.Link import Link
+from app.server.RateLimit import ClientLimiter, LinkLimits, TokenBucket
+from app.server.Relay import relay_buffered
+from app.server.Request import Request
+
+
+class TestRateLimit(TestCase):
+    def test_should_refuse_tokens_once_the_burst_is_used(self):
+        bucket = TokenBucket(2)
+
+        self.assertTrue(bucket.try_consume())
+        self.assertTrue(bucket.try_consume())
+        self.assertFalse(bucket.try_consume())
+        self.assertFalse(bucket.has_tokens())
+
+    def test_should_return_the_time_to_wait_for_a_debt(self):
+        bucket = TokenBucket(1000)
+
+        self.assertEqual(bucket.consume(1000), 0)
+        self.assertAlmostEqual(bucket.consume(500), 0.5, places=2)
+
+    def test_should_not_open_more_than_max_connections(self):
+        link = Link().set_limits(LinkLimits(max_connections=1))
+
+        self.assertIsNotNone(link.open_connection("1"))
+        self.assertFalse(link.has_capacity())
+        self.assertIsNone(link.open_connection("2"))
+        link.close_connection("1")
+        self.assertTrue(link.has_capacity())
+
+    def test_should_not_serialize_opens_without_max_connections(self):
+        link = Link().set_limits(LinkLimits(connections_per_second=10))
+
+        with link._open_lock:  # Held by another open, the ones without a count to check do not wait for it
+            self.assertIsNotNone(link.open_connection("1", prewarmed=False))
+        link.close_connection("1")
+
+    def test_should_not_open_more_connections_per_second(self):
+        link = Link().set_limits(LinkLimits(connections_per_second=1))
+
+        self.assertIsNotNone(link.open_connection("1"))
+        link.close_connection("1")
+        self.assertIsNone(link.open_connection("2"))
+
+    def test_should_drop_links_at_capacity_from_the_candidates(self):
+        link_1 = Link(weight=10).set_limits(LinkLimits(max_connections=1))
+        link_2 = Link(weight=1)
+        balancer = Balancer().add_links([link_1, link_2])
+        request = Request("example.org", 80)
+        link_1.open_connection("1")
+
+        self.assertTrue(all(balancer.get_next_link(request) is link_2 for _ in range(10)))
+
+        link_2.set_limits(LinkLimits(max_connections=1)).open_connection("1")
+        self.assertIsNone(balancer.get_next_link(request))
+
+    def test_should_limit_connections_per_client(self):
+        client_limiter = ClientLimiter(max_connections=2)
+
+        self.assertTrue(client_limiter.acquire("10.0.0.1"))
+        self.assertTrue(client_limiter.acquire("10.0.0.1"))
+        self.assertFalse(client_limiter.acquire("10.0.0.1"))
+        self.assertTrue(client_limiter.acquire("10.0.0.2"))
+        client_limiter.release("10.0.0.1")
+        self.assertTrue(client_limiter.acquire("10.0.0.1"))
+
+    def test_should_limit_new_connections_per_client(self):
+        client_limiter = ClientLimiter(connections_per_second=1)
+
+        self.assertTrue(client_limiter.acquire("10.0.0.1"))
+        client_limiter.release("10.0.0.1")
+        self.assertFalse(client_limiter.acquire("10.0.0.1"))
+
+    def test_should_throttle_the_relay(self):
+        client, client_relay_side = socket.socketpair()
+        link, link_relay_side = socket.socketpair()
+        client.sendall(b'x' * 3000)
+        client.shutdown(socket.SHUT_WR)
+        link.shutdown(socket.SHUT_WR)
+
+        s_time = monotonic()
+        relay_buffered(client_relay_side, link_relay_side, lambda: False, throttle=TokenBucket(10000, 1000))
+
+        self.assertGreaterEqual(monotonic() - s_time, 0.15)
+        received = b''
+        while len(received) < 3000:
+            received += link.recv(3000)
+        for sock in (client, client_relay_side, link, link_relay_side):
+            sock.close()
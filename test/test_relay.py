@@ -0,0 +1,73 @@
+import os
+import resource
+import socket
+import threading
+from unittest import TestCase, skipUnless
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Metrics import metrics
+from app.server.Relay import relay_buffered, relay_splice, is_splice_supported
+
+
+def _receive_all(sock: socket) -> bytes:
+    data = b''
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+class TestRelay(TestCase):
+    def _assert_relay_forwards_data_and_half_close(self, relay):
+        client, client_relay_side = socket.socketpair()
+        link, link_relay_side = socket.socketpair()
+        stats = TunnelStats()
+        relayed_in = metrics.relay_bytes["in"].get()
+        relay_thread = threading.Thread(target=relay, args=(client_relay_side, link_relay_side, lambda: False,
+                                                            stats))
+        relay_thread.start()
+
+        def send_and_half_close(payload: bytes):
+            client.sendall(payload)
+            client.shutdown(socket.SHUT_WR)
+
+        payload = b'x' * 500000
+        threading.Thread(target=send_and_half_close, args=(payload,)).start()
+
+        self.assertEqual(_receive_all(link), payload)
+        # Counted while the tunnel is still open
+        self.assertEqual(metrics.relay_bytes["in"].get() - relayed_in, len(payload))
+
+        link.sendall(b'answer after half-close')
+        link.shutdown(socket.SHUT_WR)
+        self.assertEqual(_receive_all(client), b'answer after half-close')
+
+        relay_thread.join(5)
+        self.assertFalse(relay_thread.is_alive())
+        self.assertEqual(stats.bytes_in, len(payload))
+        self.assertEqual(stats.bytes_out, len(b'answer after half-close'))
+        self.assertEqual(stats.close_reason, CloseReason.EOF)
+        for sock in (client, client_relay_side, link, link_relay_side):
+            sock.close()
+
+    def test_buffered_relay_should_forward_data_and_half_close(self):
+        self._assert_relay_forwards_data_and_half_close(relay_buffered)
+
+    @skipUnless(is_splice_supported(), "os.splice is not available on this platform")
+    def test_splice_relay_should_forward_data_and_half_close(self):
+        self._assert_relay_forwards_data_and_half_close(relay_splice)
+
+    @skipUnless(resource.getrlimit(resource.RLIMIT_NOFILE)[0] > 1100, "Not enough file descriptors allowed")
+    def test_should_relay_sockets_with_descriptors_above_1024(self):
+        # The sockets of the tunnel are opened once more than 1024 descriptors are in use
+        descriptors = []
+        while not descriptors or descriptors[-1] < 1024:
+            descriptors.append(os.open(os.devnull, os.O_RDONLY))
+        try:
+            self._assert_relay_forwards_data_and_half_close(relay_buffered)
+            if is_splice_supported():
+                self._assert_relay_forwards_data_and_half_close(relay_splice)
+        finally:
+            for descriptor in descriptors:
+                os.close(descriptor)
@@ -0,0 +1,53 @@
+import socket
+import threading
+from unittest import TestCase
+
+from app.server.RelayPool import RelayPool
+
+
+def _receive_all(sock: socket) -> bytes:
+    data = b''
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+class TestRelayPool(TestCase):
+    def setUp(self) -> None:
+        self.stopped = False
+        self.pool = RelayPool(2, lambda: self.stopped).start()
+
+    def tearDown(self) -> None:
+        self.stopped = True
+
+    def test_should_relay_many_tunnels_and_close_them_after_half_close(self):
+        closed = []
+        tunnels = []
+        for idx in range(10):
+            client, client_relay_side = socket.socketpair()
+            link, link_relay_side = socket.socketpair()
+            self.pool.add(client_relay_side, link_relay_side, lambda idx=idx: closed.append(idx))
+            tunnels.append((client, link))
+
+        for idx, (client, link) in enumerate(tunnels):
+            def send_and_half_close(sock: socket, payload: bytes):
+                sock.sendall(payload)
+                sock.shutdown(socket.SHUT_WR)
+
+            payload = bytes([idx]) * 300000
+            threading.Thread(target=send_and_half_close, args=(client, payload)).start()
+            self.assertEqual(_receive_all(link), payload)
+
+            send_and_half_close(link, b'answer')
+            self.assertEqual(_receive_all(client), b'answer')
+
+        for client, link in tunnels:
+            client.close()
+            link.close()
+        for _ in range(50):
+            if len(closed) == len(tunnels):
+                break
+            threading.Event().wait(0.1)
+        self.assertCountEqual(closed, range(10))
@@ -0,0 +1,97 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from app.configuration import reload_server, save_server
+from app.server import Server
+from app.server.Balancer import Balancer
+from app.server.Link import Link, Protocol
+from app.server.Request import Request
+from app.server.RequestMatcher import Policy, RequestMatcher
+from app.server.SharedState import SharedLinkState
+
+
+class TestReload(TestCase):
+    def test_should_keep_the_state_of_the_reused_links(self):
+        link = Link(interface="lo")
+        link.open_connection("1")
+        link.status = False
+        server = Server().set_balancer(Balancer().add_link(link))
+
+        new_link = Link(interface="lo", weight=3).add_request_matcher(
+            RequestMatcher(policy=Policy.FORBID).add_port(22))
+        self.assertTrue(server.reload_balancer(Balancer().add_link(new_link)))
+
+        self.assertIs(server.balancer.links[0], link)
+        self.assertEqual(link.weight, 3)
+        self.assertEqual(len(link.get_request_matchers()), 1)
+        self.assertIn("1", link.connections)
+        self.assertFalse(link.status)
+
+    def test_should_route_new_requests_with_the_new_links(self):
+        old_link = Link(interface="lo")
+        server = Server().set_balancer(Balancer().add_link(old_link))
+
+        new_link = Link(protocol=Protocol.SOCKS5, domain="127.0.0.1", port=1081)
+        self.assertTrue(server.reload_balancer(Balancer().add_link(new_link)))
+
+        self.assertIs(server.balancer.get_next_link(Request("example.org", 80)), new_link)
+
+    def test_should_notify_the_new_balancer_only(self):
+        link = Link(interface="lo")
+        server = Server().set_balancer(Balancer().add_link(link))
+        old_balancer = server.balancer
+        server.reload_balancer(Balancer().add_link(Link(interface="lo")))
+        old_balancer._get_routing_index()
+        server.balancer._get_routing_index()
+
+        link.add_request_matcher(RequestMatcher(policy=Policy.FORBID).add_port(22))
+
+        self.assertIsNotNone(old_balancer._routing_index)
+        self.assertIsNone(server.balancer._routing_index)
+
+    def test_should_not_start_health_checks_on_the_replaced_balancer(self):
+        server = Server().set_balancer(Balancer().add_link(Link(interface="lo")))
+        old_balancer = server.balancer
+        server.reload_balancer(Balancer().add_link(Link(interface="lo")))
+
+        old_balancer.check_due_links()
+
+        self.assertIsNone(old_balancer._health_checker)
+
+    def test_should_refuse_other_links_with_shared_state(self):
+        balancer = Balancer().add_links([Link(interface="lo"), Link(interface="eth0")])
+        balancer.attach_shared_state(SharedLinkState(2))
+        server = Server().set_balancer(balancer)
+
+        self.assertFalse(server.reload_balancer(Balancer().add_link(Link(interface="lo"))))
+        self.assertIs(server.balancer, balancer)
+        self.assertTrue(server.reload_balancer(Balancer().add_links([Link(interface="lo"), Link(interface="eth0")])))
+        self.assertIsNot(server.balancer, balancer)
+
+    def test_should_reload_from_the_configuration_file(self):
+        link = Link(interface="lo")
+        server = Server().set_balancer(Balancer().add_link(link))
+        path = os.path.join(tempfile.mkdtemp(), "config.json")
+        save_server(path, Server().set_balancer(Balancer().add_links([Link(interface="lo", weight=2),
+                                                                      Link(interface="eth0")])))
+
+        self.assertTrue(reload_server(path, server))
+
+        self.assertIs(server.balancer.links[0], link)
+        self.assertEqual(link.weight, 2)
+        self.assertEqual(len(server.balancer.links), 2)
+        os.remove(path)
+
+    def test_should_not_reload_a_configuration_without_link(self):
+        link = Link(interface="lo")
+        server = Server().set_balancer(Balancer().add_link(link))
+        path = os.path.join(tempfile.mkdtemp(), "config.json")
+        for configuration in ('{"balancer": {"links": []}}', '{"port": 8080}'):
+            with open(path, "w") as file:
+                file.write(configuration)
+
+            self.assertFalse(reload_server(path, server))
+
+        self.assertEqual(server.balancer.links, [link])
+        os.remove(path)
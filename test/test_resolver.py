@@ -0,0 +1,69 @@
+import socket
+import threading
+from time import sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from app.server.Resolver import Resolver, connect_happy_eyeballs, interleave_families
+
+
+def _addrinfo(*addresses):
+    return [(family, socket.SOCK_STREAM, 6, "", address) for family, address in addresses]
+
+
+class TestResolver(TestCase):
+    def test_should_cache_resolution(self):
+        resolver = Resolver()
+        with patch("socket.getaddrinfo", return_value=_addrinfo((socket.AF_INET, ("10.0.0.1", 0)))) as getaddrinfo:
+            self.assertEqual(resolver.resolve("test", 80), [(socket.AF_INET, ("10.0.0.1", 80))])
+            self.assertEqual(resolver.resolve("test", 443), [(socket.AF_INET, ("10.0.0.1", 443))])
+            self.assertEqual(getaddrinfo.call_count, 1)
+
+    def test_should_cache_failure(self):
+        resolver = Resolver()
+        with patch("socket.getaddrinfo", side_effect=socket.gaierror(socket.EAI_NONAME, "unknown")) as getaddrinfo:
+            self.assertRaises(socket.gaierror, resolver.resolve, "test", 80)
+            self.assertRaises(socket.gaierror, resolver.resolve, "test", 80)
+            self.assertEqual(getaddrinfo.call_count, 1)
+
+    def test_should_not_resolve_ip_address(self):
+        resolver = Resolver()
+        with patch("socket.getaddrinfo") as getaddrinfo:
+            self.assertEqual(resolver.resolve("::1", 80), [(socket.AF_INET6, ("::1", 80, 0, 0))])
+            getaddrinfo.assert_not_called()
+
+    def test_should_share_concurrent_lookups(self):
+        resolver = Resolver()
+
+        def slow_getaddrinfo(*args, **kwargs):
+            sleep(0.2)
+            return _addrinfo((socket.AF_INET, ("10.0.0.1", 0)))
+
+        with patch("socket.getaddrinfo", side_effect=slow_getaddrinfo) as getaddrinfo:
+            threads = [threading.Thread(target=resolver.resolve, args=("test", 80)) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(getaddrinfo.call_count, 1)
+
+    def test_should_interleave_families(self):
+        addresses = [(socket.AF_INET6, "a"), (socket.AF_INET6, "b"), (socket.AF_INET, "c")]
+
+        self.assertEqual(interleave_families(addresses),
+                         [(socket.AF_INET6, "a"), (socket.AF_INET, "c"), (socket.AF_INET6, "b")])
+
+    def test_happy_eyeballs_should_connect_to_the_first_reachable_address(self):
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+
+        sock = connect_happy_eyeballs([(socket.AF_INET, closed.getsockname()), (socket.AF_INET, listener.getsockname())],
+                                      socket.socket, 2)
+
+        self.assertEqual(sock.getpeername(), listener.getsockname())
+        self.assertEqual(sock.gettimeout(), 2)
+        for s in (sock, closed, listener):
+            s.close()
@@ -0,0 +1,34 @@
+from unittest import TestCase
+
+from app.server.RoutingCache import RoutingCache
+
+
+class TestRoutingCache(TestCase):
+    def test_should_evict_least_recently_used_entry(self):
+        cache = RoutingCache(size=2)
+        cache.put(("a.com", 80), (True,), cache.get_generation())
+        cache.put(("b.com", 80), (True,), cache.get_generation())
+        cache.get(("a.com", 80))
+        cache.put(("c.com", 80), (True,), cache.get_generation())
+
+        self.assertIsNotNone(cache.get(("a.com", 80)))
+        self.assertIsNone(cache.get(("b.com", 80)))
+        self.assertIsNotNone(cache.get(("c.com", 80)))
+
+    def test_should_report_hit_rate(self):
+        cache = RoutingCache()
+        cache.get(("a.com", 80))
+        cache.put(("a.com", 80), (True,), cache.get_generation())
+        cache.get(("a.com", 80))
+        cache.get(("a.com", 80))
+        cache.get(("a.com", 80))
+
+        self.assertEqual(cache.hit_rate(), 0.75)
+
+    def test_should_ignore_entry_computed_before_invalidation(self):
+        cache = RoutingCache()
+        generation = cache.get_generation()
+        cache.clear()
+        cache.put(("a.com", 80), (True,), generation)
+
+        self.assertIsNone(cache.get(("a.com", 80)))
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from app.server.Link import Link, PriorityLevel
+from app.server.Request import Request
+from app.server.RequestMatcher import RequestMatcher, Policy
+from app.server.RoutingIndex import RoutingIndex
+
+
+class TestRoutingIndex(TestCase):
+    def setUp(self) -> None:
+        self.links = [
+            Link().add_request_matcher(RequestMatcher(Policy.FORBID).add_domain_re(r'^.+\.intranet\.com$')),
+            Link().add_request_matcher(RequestMatcher(Policy.ALLOW).add_domain_re(r'^.+\.intranet\.com$')),
+            Link().add_request_matcher(RequestMatcher(Policy.PRIORITIZE).add_domains_re([r'^.+\.fr$', r'^.+\.de$'])),
+            Link().add_request_matcher(RequestMatcher(Policy.DEPRIORITIZE).add_port(443)),
+            Link().add_request_matcher(RequestMatcher(Policy.ALLOW).add_port(80).add_domain_re(r'^.+\.org$')),
+            Link()
+        ]
+        self.requests = [Request(domain, port) for domain in ["www.intranet.com", "google.fr", "test.de", "python.org",
+                                                               "example.com"] for port in [80, 443, 8080]]
+
+    def test_should_give_the_same_priority_levels_as_the_links(self):
+        routing_index = RoutingIndex([], self.links)
+
+        for request in self.requests:
+            high_priority, normal_priority, low_priority = routing_index.get_link_ids_for_request(request)
+            for link_id, link in enumerate(self.links):
+                expected = link.get_request_priority_level(request)
+                if link_id in high_priority:
+                    actual = PriorityLevel.HIGH
+                elif link_id in normal_priority:
+                    actual = PriorityLevel.NORMAL
+                elif link_id in low_priority:
+                    actual = PriorityLevel.LOW
+                else:
+                    actual = PriorityLevel.FORBID
+                self.assertEqual(actual, expected, "{} on {}".format(request, link))
+
+    def test_should_accept_request_like_the_balancer_matchers(self):
+        request_matchers = [RequestMatcher(Policy.ALLOW).add_ports([80, 443]),
+                            RequestMatcher(Policy.FORBID).add_domain_re(r'^.+\.intranet\.com$')]
+        routing_index = RoutingIndex(request_matchers, self.links)
+
+        for request in self.requests:
+            expected = all(request_matcher.request_match(request) == (request_matcher.policy == Policy.ALLOW)
+                           for request_matcher in request_matchers)
+            self.assertEqual(routing_index.should_accept_request(request), expected, str(request))
+
+    def test_should_forbid_links_which_are_down(self):
+        self.links[5].status = False
+        routing_index = RoutingIndex([], self.links)
+
+        high_priority, normal_priority, low_priority = routing_index.get_link_ids_for_request(Request("a.com", 80))
+
+        self.assertNotIn(5, high_priority + normal_priority + low_priority)
@@ -0,0 +1,68 @@
+from struct import pack
+from unittest import TestCase
+
+from app.server.Socks import SocksCommand, SocksError, SocksParser, SocksReply
+
+GREETING = b'\x05\x02\x00\x02'
+REQUEST = b'\x05\x01\x00\x03\x0bexample.org' + pack('>H', 443)
+
+
+class TestSocksParser(TestCase):
+    def test_should_parse_pipelined_messages_and_keep_the_optimistic_data(self):
+        parser = SocksParser()
+        parser.feed(GREETING + REQUEST + b'GET / HTTP/1.1')
+
+        self.assertTrue(parser.parse_greeting())
+        self.assertEqual(parser.methods, b'\x00\x02')
+        self.assertTrue(parser.parse_request())
+        self.assertEqual(parser.command, SocksCommand.CONNECT)
+        self.assertEqual((parser.domain, parser.port), ("example.org", 443))
+        self.assertEqual(parser.pop_pending(), b'GET / HTTP/1.1')
+
+    def test_should_wait_for_the_whole_message(self):
+        parser = SocksParser()
+        parser.feed(GREETING)
+        parser.parse_greeting()
+
+        for byte in REQUEST[:-1]:
+            parser.feed(bytes([byte]))
+            self.assertFalse(parser.parse_request())
+        parser.feed(REQUEST[-1:])
+
+        self.assertTrue(parser.parse_request())
+        self.assertEqual(parser.domain, "example.org")
+
+    def test_should_parse_ip_addresses(self):
+        parser = SocksParser()
+        parser.feed(b'\x05\x01\x00\x01\x7f\x00\x00\x01\x00\x50' +
+                    b'\x05\x01\x00\x04' + b'\x00' * 15 + b'\x01' + b'\x00\x50')
+
+        self.assertTrue(parser.parse_request())
+        self.assertEqual(parser.domain, "127.0.0.1")
+        self.assertTrue(parser.parse_request())
+        self.assertEqual(parser.domain, "::1")
+
+    def test_should_reuse_the_buffer(self):
+        parser = SocksParser(size=32)
+
+        for _ in range(10):
+            parser.feed(REQUEST)
+            self.assertTrue(parser.parse_request())
+        self.assertEqual(len(parser), 0)
+
+    def test_should_fail_fast_on_malformed_messages(self):
+        for message, parse, reply in [
+            (b'\x04\x01\x00', SocksParser.parse_greeting, SocksReply.SERVER_FAILURE),
+            (b'\x05\x00', SocksParser.parse_greeting, SocksReply.SERVER_FAILURE),
+            (b'\x04\x01\x00\x01', SocksParser.parse_request, SocksReply.CONNECTION_REFUSED),
+            (b'\x05\x01\x01\x01', SocksParser.parse_request, SocksReply.SERVER_FAILURE),
+            (b'\x05\x01\x00\x09', SocksParser.parse_request, SocksReply.ADDRESS_TYPE_NOT_SUPPORTED),
+            (b'\x05\x01\x00\x03\x00', SocksParser.parse_request, SocksReply.SERVER_FAILURE),
+            (b'\x05\x09\x00\x01\x7f\x00\x00\x01\x00\x50', SocksParser.parse_request,
+             SocksReply.COMMAND_NOT_SUPPORTED),
+        ]:
+            parser = SocksParser()
+            parser.feed(message)
+            with self.assertRaises(SocksError) as context:
+                parse(parser)
+            self.assertEqual(context.exception.reply, reply)
@@ -1,7 +1,9 @@
+import threading
 from unittest import TestCase
 
 from app.server.Link import Link
-from app.server.balancing_strategy import least_connections, round_robin, random_link
+from app.server.balancing_strategy import least_connections, round_robin, random_link, least_latency, peak_ewma, \
+    power_of_two_choices, rendezvous
 
 
 class TestStrategy(TestCase):
@@ -10,59 +12,67 @@ class TestStrategy(TestCase):
         link_2 = Link()
         link_3 = Link()
 
-        links = [link_1, link_2, link_3]
-
-        actual = round_robin.get_next_link(links, last_link=link_1)
+        strategy = round_robin.RoundRobin([link_1, link_2, link_3])
+        strategy.get_next_link()
 
-        self.assertEqual(actual, link_2)
+        self.assertEqual(strategy.get_next_link(), link_2)
 
     def test_round_robin_should_return_the_first_after_the_last_one(self):
         link_1 = Link()
         link_2 = Link()
         link_3 = Link()
 
-        links = [link_1, link_2, link_3]
-
-        actual = round_robin.get_next_link(links, last_link=link_3)
+        strategy = round_robin.RoundRobin([link_1, link_2, link_3])
+        for _ in range(3):
+            strategy.get_next_link()
 
-        self.assertEqual(actual, link_1)
+        self.assertEqual(strategy.get_next_link(), link_1)
 
-    def test_round_robin_should_return_the_first_one_when_no_last_link(self):
+    def test_round_robin_should_return_the_first_one_at_first(self):
         link_1 = Link()
         link_2 = Link()
         link_3 = Link()
 
-        links = [link_1, link_2, link_3]
+        strategy = round_robin.RoundRobin([link_1, link_2, link_3])
+
+        self.assertEqual(strategy.get_next_link(), link_1)
+
+    def test_round_robin_should_spread_the_picks_of_concurrent_threads(self):
+        links = [Link(), Link(), Link()]
+        strategy = round_robin.RoundRobin(links)
+        picked = []
+
+        def pick():
+            for _ in range(300):
+                picked.append(strategy.get_next_link())
 
-        actual = round_robin.get_next_link(links)
+        threads = [threading.Thread(target=pick) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
-        self.assertEqual(actual, link_1)
+        self.assertEqual([picked.count(link) for link in links], [400, 400, 400])
 
     def test_should_return_random_idx(self):
         link_1 = Link()
         link_2 = Link()
         link_3 = Link()
 
-        links = [link_1, link_2, link_3]
+        strategy = random_link.WeightedRandom([link_1, link_2, link_3])
 
-        next_linkA = random_link.get_next_link(links)
-        next_linkB = random_link.get_next_link(links)
-        next_linkC = random_link.get_next_link(links)
-        next_linkD = random_link.get_next_link(links)
-        next_linkE = random_link.get_next_link(links)
+        picked = [strategy.get_next_link() for _ in range(20)]
 
-        self.assertFalse(next_linkA == next_linkB == next_linkC == next_linkD == next_linkE)
+        self.assertGreater(len(set(picked)), 1)
 
     def test_should_almost_always_return_element(self):
         link_1 = Link(weight=1)
         link_2 = Link(weight=100000)
         link_3 = Link(weight=1)
 
-        links = [link_1, link_2, link_3]
-
-        next_link = random_link.get_next_link(links)
+        strategy = random_link.WeightedRandom([link_1, link_2, link_3])
 
-        self.assertEqual(next_link, link_2)
+        self.assertEqual(strategy.get_next_link(), link_2)
 
     def test_least_connections_should_return_the_link_with_least_connections(self):
         link_1 = Link()
@@ -90,3 +100,120 @@ class TestStrategy(TestCase):
 
         actual = least_connections.get_next_link(links)
         self.assertEqual(actual, link_2)
+
+    def test_least_latency_should_return_the_link_with_the_lowest_latency(self):
+        link_1 = Link()
+        link_2 = Link()
+        link_3 = Link()
+
+        link_1.record_connect_latency(0.3)
+        link_2.record_connect_latency(0.1)
+        link_3.record_connect_latency(0.2)
+
+        links = [link_1, link_2, link_3]
+
+        actual = least_latency.get_next_link(links)
+        self.assertEqual(actual, link_2)
+
+    def test_latency_estimate_should_take_a_slower_sample_at_once(self):
+        link = Link()
+
+        link.record_connect_latency(0.1)
+        link.record_connect_latency(2)
+
+        self.assertAlmostEqual(link.get_latency_estimate(), 2, places=2)
+
+    def test_latency_estimate_should_average_faster_samples(self):
+        link = Link()
+
+        link.record_connect_latency(2)
+        link.record_connect_latency(0.1)
+
+        self.assertGreater(link.get_latency_estimate(), 1.9)
+
+    def test_peak_ewma_should_take_the_connections_into_account(self):
+        link_1 = Link()
+        link_2 = Link()
+
+        link_1.record_connect_latency(0.1)
+        link_2.record_connect_latency(0.15)
+        link_1.open_connection("1")
+        link_1.open_connection("2")
+
+        links = [link_1, link_2]
+
+        actual = peak_ewma.get_next_link(links)
+        self.assertEqual(actual, link_2)
+
+    def test_power_of_two_choices_should_never_return_the_worst_link(self):
+        link_1 = Link()
+        link_2 = Link()
+        link_3 = Link()
+
+        link_1.record_connect_latency(0.1)
+        link_2.record_connect_latency(0.2)
+        link_3.record_connect_latency(5)
+
+        links = [link_1, link_2, link_3]
+
+        for _ in range(20):
+            self.assertNotEqual(power_of_two_choices.get_next_link(links), link_3)
+
+    def test_round_robin_object_should_return_the_links_in_order(self):
+        link_1 = Link()
+        link_2 = Link()
+
+        strategy = round_robin.RoundRobin([link_1, link_2])
+
+        actual = [strategy.get_next_link() for _ in range(3)]
+        self.assertEqual(actual, [link_1, link_2, link_1])
+
+    def test_least_connections_object_should_follow_the_connections_of_the_links(self):
+        link_1 = Link()
+        link_2 = Link(weight=2)
+        link_3 = Link()
+
+        strategy = least_connections.LeastConnections([link_1, link_2, link_3])
+        for link in [link_1, link_2, link_3]:
+            link.add_connections_listener(strategy.update)
+
+        link_1.open_connection("1")
+        link_2.open_connection("1")
+        link_2.open_connection("2")
+        self.assertEqual(strategy.get_next_link(), link_3)
+
+        link_3.open_connection("1")
+        link_3.open_connection("2")
+        link_2.close_connection("2")
+        self.assertEqual(strategy.get_next_link(), link_2)
+
+    def test_rendezvous_should_always_return_the_same_link_for_a_key(self):
+        links = [Link(interface="eth{}".format(idx)) for idx in range(4)]
+
+        strategy = rendezvous.Rendezvous(links)
+        other_strategy = rendezvous.Rendezvous(list(reversed(links)))
+
+        for key in ("10.0.0.{}".format(idx) for idx in range(20)):
+            self.assertIs(strategy.get_next_link(key), strategy.get_next_link(key))
+            self.assertIs(strategy.get_next_link(key), other_strategy.get_next_link(key))
+
+    def test_rendezvous_should_only_move_the_keys_of_a_removed_link(self):
+        links = [Link(interface="eth{}".format(idx)) for idx in range(4)]
+        keys = ["10.0.0.{}".format(idx) for idx in range(200)]
+        before = {key: rendezvous.Rendezvous(links).get_next_link(key) for key in keys}
+
+        strategy = rendezvous.Rendezvous(links[1:])
+
+        for key in keys:
+            if before[key] is not links[0]:
+                self.assertIs(strategy.get_next_link(key), before[key])
+        self.assertTrue(any(link is links[0] for link in before.values()))
+
+    def test_rendezvous_should_follow_the_weights(self):
+        link_1 = Link(interface="eth0")
+        link_2 = Link(interface="eth1", weight=3)
+
+        strategy = rendezvous.Rendezvous([link_1, link_2])
+
+        picked = [strategy.get_next_link(str(idx)) for idx in range(2000)]
+        self.assertAlmostEqual(picked.count(link_2) / len(picked), 0.75, delta=0.05)
@@ -0,0 +1,111 @@
+import socket
+from unittest import TestCase
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Link import Link
+from app.server.Timeouts import TimerWheel, TunnelTimeouts
+
+
+class _Clock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self) -> float:
+        return self.time
+
+
+class TestTimerWheel(TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+
+    def test_should_run_the_timers_once_due(self):
+        wheel = TimerWheel(tick=1, slots=8, clock=self.clock)
+        fired = []
+        wheel.schedule(2, lambda: fired.append(2))
+        wheel.schedule(5, lambda: fired.append(5))
+
+        self.clock.time = 3
+        wheel.advance()
+        self.assertEqual(fired, [2])
+        self.clock.time = 6
+        wheel.advance()
+        self.assertEqual(fired, [2, 5])
+        self.assertEqual(len(wheel), 0)
+
+    def test_should_keep_the_timers_of_a_later_round(self):
+        wheel = TimerWheel(tick=1, slots=4, clock=self.clock)
+        fired = []
+        wheel.schedule(6, lambda: fired.append(6))
+
+        self.clock.time = 4
+        wheel.advance()
+        self.assertEqual(fired, [])
+        self.clock.time = 7
+        wheel.advance()
+        self.assertEqual(fired, [6])
+
+    def test_should_not_run_a_cancelled_timer(self):
+        wheel = TimerWheel(tick=1, slots=8, clock=self.clock)
+        fired = []
+        timer = wheel.schedule(1, lambda: fired.append(1))
+        wheel.cancel(timer)
+
+        self.clock.time = 3
+        wheel.advance()
+        self.assertEqual(fired, [])
+
+
+class TestTunnelTimeouts(TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        self.stats = TunnelStats()
+        self.stats.start_time = 0.0
+        self.closed = []
+
+    def test_should_close_an_idle_tunnel(self):
+        timeouts = TunnelTimeouts(idle_timeout=10, wheel=TimerWheel(tick=1, slots=8, clock=self.clock))
+        timeouts.watch(self.stats, lambda: self.closed.append(True))
+
+        # Some activity pushes the deadline back
+        self.stats.last_activity = 5
+        self.clock.time = 12
+        timeouts.wheel.advance()
+        self.assertEqual(self.closed, [])
+        self.clock.time = 15
+        timeouts.wheel.advance()
+        self.assertEqual(self.closed, [True])
+        self.assertEqual(self.stats.close_reason, CloseReason.IDLE)
+        self.assertEqual(len(timeouts), 0)
+
+    def test_should_close_a_tunnel_at_the_end_of_its_lifetime(self):
+        timeouts = TunnelTimeouts(idle_timeout=10, max_lifetime=20, wheel=TimerWheel(tick=1, slots=8,
+                                                                                    clock=self.clock))
+        timeouts.watch(self.stats, lambda: self.closed.append(True))
+
+        for time in range(0, 22, 2):
+            self.clock.time = self.stats.last_activity = time
+            timeouts.wheel.advance()
+            self.assertEqual(self.closed, [True] if time >= 20 else [])
+
+        self.assertEqual(self.stats.close_reason, CloseReason.LIFETIME)
+
+    def test_should_forget_the_unwatched_tunnels(self):
+        timeouts = TunnelTimeouts(idle_timeout=1, wheel=TimerWheel(tick=1, slots=8, clock=self.clock))
+        watch = timeouts.watch(self.stats, lambda: self.closed.append(True))
+        timeouts.unwatch(watch)
+
+        self.clock.time = 3
+        timeouts.wheel.advance()
+        self.assertEqual(self.closed, [])
+        self.assertEqual(len(timeouts.wheel), 0)
+
+    def test_should_enable_the_keepalive_of_the_link_sockets(self):
+        sock = Link(keepalive=30)._build_socket(socket.socket)
+
+        self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 30)
+        sock.close()
+        sock = Link()._build_socket(socket.socket)
+        self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 0)
+        sock.close()
@@ -0,0 +1,122 @@
+import socket
+import threading
+from time import monotonic, sleep
+from unittest import TestCase
+
+from app.server.AccessLog import CloseReason, TunnelStats
+from app.server.Balancer import Balancer
+from app.server.Link import Link, Protocol
+from app.server.Socks import SocksError, build_udp_datagram, parse_udp_datagram
+from app.server.UdpRelay import UdpAssociation, UdpRelay, _Flow
+
+
+def _start_echo_server() -> socket.socket:
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+
+    def echo():
+        while True:
+            try:
+                data, address = server.recvfrom(65535)
+            except OSError:
+                return
+            server.sendto(data, address)
+
+    threading.Thread(target=echo, daemon=True).start()
+    return server
+
+
+class TestUdpRelay(TestCase):
+    def setUp(self):
+        self.stopped = False
+        self.balancer = Balancer().add_link(Link())
+        self.relay = UdpRelay(lambda: self.balancer, lambda: self.stopped, flow_timeout=1)
+        self.echo_server = _start_echo_server()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.bind(("127.0.0.1", 0))
+        self.client.settimeout(2)
+
+    def tearDown(self):
+        self.stopped = True
+        self.client.close()
+        self.echo_server.close()
+
+    def test_should_parse_the_datagrams_it_builds(self):
+        self.assertEqual(parse_udp_datagram(build_udp_datagram(("example.org", 53), b'data')),
+                         ("example.org", 53, b'data'))
+        self.assertEqual(parse_udp_datagram(build_udp_datagram(("::1", 53), b'data')), ("::1", 53, b'data'))
+        with self.assertRaises(SocksError):
+            parse_udp_datagram(b'\x00\x00\x01\x01\x7f\x00\x00\x01\x00\x35data')
+
+    def test_should_relay_the_datagrams_of_the_client(self):
+        association = self.relay.open("127.0.0.1", "127.0.0.1", self.client.getsockname()[1], TunnelStats())
+        target = self.echo_server.getsockname()
+
+        self.client.sendto(build_udp_datagram(target, b'ping'), association.get_address())
+
+        self.assertEqual(parse_udp_datagram(self.client.recv(65535)), (target[0], target[1], b'ping'))
+        self.assertEqual(association.stats.bytes_in, 4)
+        self.relay.close(association, CloseReason.EOF)
+
+    def test_should_close_the_idle_flows(self):
+        association = self.relay.open("127.0.0.1", "127.0.0.1", 0, TunnelStats())
+        self.client.sendto(build_udp_datagram(self.echo_server.getsockname(), b'ping'), association.get_address())
+        self.client.recv(65535)
+        self.assertEqual(len(association.flows), 1)
+
+        sleep(2.5)
+
+        self.assertEqual(len(association.flows), 0)
+        self.relay.close(association, CloseReason.EOF)
+
+    def test_should_ignore_the_datagrams_of_other_clients(self):
+        association = self.relay.open("127.0.0.1", "127.0.0.2", 0, TunnelStats())
+
+        self.client.sendto(build_udp_datagram(self.echo_server.getsockname(), b'ping'), association.get_address())
+
+        with self.assertRaises(socket.timeout):
+            self.client.settimeout(0.5)
+            self.client.recv(65535)
+        self.relay.close(association, CloseReason.EOF)
+
+    def test_should_only_carry_datagrams_with_direct_and_socks5_links(self):
+        self.assertTrue(Link().supports_udp())
+        self.assertTrue(Link(protocol=Protocol.SOCKS5, domain="127.0.0.1", port=1080).supports_udp())
+        self.assertFalse(Link(protocol=Protocol.HTTP, domain="127.0.0.1", port=3128).supports_udp())
+
+    def test_should_close_the_flows_opened_while_stopping(self):
+        opened = threading.Event()
+        released = threading.Event()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        def open_datagram_socket(key: tuple):
+            opened.set()
+            released.wait(5)
+            return sock, key
+
+        self.balancer.links[0].open_datagram_socket = open_datagram_socket
+        association = self.relay.open("127.0.0.1", "127.0.0.1", 0, TunnelStats())
+        self.client.sendto(build_udp_datagram(self.echo_server.getsockname(), b'ping'), association.get_address())
+        self.assertTrue(opened.wait(2))
+
+        self.stopped = True
+        sleep(1.5)
+        released.set()
+        self.relay._thread.join(2)
+
+        self.assertEqual(association.stats.close_reason, CloseReason.STOPPED)
+        self.assertEqual(sock.fileno(), -1)
+
+    def test_should_search_the_idle_flows_once_per_interval(self):
+        relay = UdpRelay(lambda: self.balancer, lambda: self.stopped, flow_timeout=1)  # Not started
+        association = UdpAssociation(self.client, "127.0.0.1", 0, TunnelStats())
+        association.flows[("example.org", 53)] = _Flow(association, ("example.org", 53), self.balancer.links[0])
+        association.flows[("example.org", 53)].last_activity -= 10
+        relay._associations.add(association)
+        relay._last_sweep = monotonic()
+
+        relay._close_idle_flows()
+        self.assertEqual(len(association.flows), 1)
+        relay._last_sweep -= 1
+        relay._close_idle_flows()
+        self.assertEqual(len(association.flows), 0)